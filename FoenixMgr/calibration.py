@@ -0,0 +1,81 @@
+#
+# Calibration of the chunk size and pipeline depth for a debug port link
+#
+# The best packet size varies a lot between a local USB serial port and a remote
+# TCP bridge. Calibration writes a test pattern to a scratch area of the target's
+# RAM with each combination of chunk size and pipeline depth, and keeps the
+# fastest. Results are saved per port and target in ~/.foenixmgr/calibration.json.
+#
+
+import json
+import os
+import time
+import foenix
+
+CALIBRATION_FILE = os.path.expanduser('~/.foenixmgr/calibration.json')
+CHUNK_SIZES = [256, 512, 1024, 2048, 4096, 8192, 16384, 32768]
+PIPELINE_DEPTHS = [1, 2, 4, 8]
+TEST_SIZE = 65536
+
+def measure(machine, address, chunk_size, depth, total=TEST_SIZE):
+    """Return the rate (in bytes per second) of writing 'total' bytes in chunk_size packets."""
+    block = (bytes(range(256)) * (chunk_size // 256 + 1))[:chunk_size]
+    writer = foenix.PipelinedWriter(machine, depth)
+    start = time.perf_counter()
+    for offset in range(0, total, chunk_size):
+        writer.write_block(address + offset, block[:min(chunk_size, total - offset)])
+    writer.flush()
+    return total / (time.perf_counter() - start)
+
+def calibrate(machine, address, report=print):
+    """Try each chunk size and pipeline depth, writing to RAM at 'address'.
+
+    Returns a dictionary with the best chunk_size, pipeline_depth and bytes_per_s,
+    along with the results of every trial. If a trial fails (the link may not take
+    packets that large), the link is brought back into step with the requests and
+    the larger chunk sizes are skipped at that pipeline depth.
+    """
+    results = []
+    for depth in PIPELINE_DEPTHS:
+        for chunk_size in CHUNK_SIZES:
+            try:
+                rate = measure(machine, address, chunk_size, depth)
+            except Exception as e:
+                report("chunk size {:>6}, pipeline depth {}: failed, skipping larger chunks: {}".format(chunk_size, depth, e))
+                machine.resync()
+                break
+            results.append({"chunk_size": chunk_size, "pipeline_depth": depth, "bytes_per_s": rate})
+            report("chunk size {:>6}, pipeline depth {}: {:>8.1f} KB/s".format(chunk_size, depth, rate / 1024))
+
+    if not results:
+        return None
+
+    best = max(results, key=lambda result: result["bytes_per_s"])
+    return {
+        "chunk_size": best["chunk_size"],
+        "pipeline_depth": best["pipeline_depth"],
+        "bytes_per_s": best["bytes_per_s"],
+        "results": results,
+    }
+
+def calibration_key(port, target):
+    return "{}|{}".format(port, target)
+
+def read_calibrations():
+    try:
+        with open(CALIBRATION_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def load(port, target):
+    """Return the saved calibration for the port and target, or None if there is none."""
+    return read_calibrations().get(calibration_key(port, target))
+
+def save(port, target, calibration):
+    """Save the calibration for the port and target, keeping those for other links."""
+    calibrations = read_calibrations()
+    calibrations[calibration_key(port, target)] = calibration
+    os.makedirs(os.path.dirname(CALIBRATION_FILE), exist_ok=True)
+    with open(CALIBRATION_FILE, "w") as f:
+        json.dump(calibrations, f, indent=2)
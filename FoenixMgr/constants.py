@@ -15,6 +15,13 @@ CMD_REVISION = 0xFE
 DELAY_ERASE_SECTOR = 1          # Number of seconds to wait after issueing an ERASE_SECTOR command
 DELAY_PROGRAM_SECTOR = 2        # Number of seconds to wait after issueing an PROGRAM_SECTOR command
 
+FLASH_POLL_MIN = 0.005          # Initial delay (in seconds) between polls of a busy flash chip
+FLASH_POLL_MAX = 0.2            # Longest delay (in seconds) between polls of a busy flash chip
+
+RESPONSE_TIMEOUT = 0.25         # Seconds to allow for a memory request's response, beyond the time its data takes on the link
+
+READ_MAX_LENGTH = 0xFFFC         # Largest read that fits the 16-bit length field (kept a multiple of 4)
+
 BOOT_SRC_RAM = 0x00             # For F256jr Rev A -- boot from RAM 
 BOOT_SRC_FLASH = 0x01           # For F256jr Rev A -- boot from Flash 
 
@@ -0,0 +1,63 @@
+#
+# CRC-32 as computed by the F256 firmware when copying files to the SD card
+#
+# This is the usual zip polynomial, but starting from zero and without the final
+# XOR that zlib applies. zlib's table-driven implementation can still be used by
+# inverting the value on the way in and on the way out.
+#
+
+import zlib
+
+def crc32(data, crc=0):
+    """Return the firmware's CRC-32 of data.
+
+    To compute the CRC of a stream a piece at a time, pass the result for the data
+    so far as 'crc' along with the next piece.
+    """
+    return zlib.crc32(data, crc ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+#
+#define poly 0xEDB88320
+#/* Some compilers need
+#   #define poly 0xEDB88320uL
+# */
+#
+#/* On entry, addr=>start of data
+#             num = length of data
+#             crc = incoming CRC     */
+#int crc32(char *addr, int num, int crc)
+#{
+#int i;
+#
+#for (; num>0; num--)              /* Step through bytes in memory */
+#  {
+#  crc = crc ^ *addr++;            /* Fetch byte from memory, XOR into CRC */
+#  for (i=0; i<8; i++)             /* Prepare to rotate 8 bits */
+#  {
+#    if (crc & 1)                  /* b0 is set... */
+#      crc = (crc >> 1) ^ poly;    /* rotate and XOR with ZIP polynomic */
+#    else                          /* b0 is clear... */
+#      crc >>= 1;                  /* just rotate */
+#  /* Some compilers need:
+#    crc &= 0xFFFFFFFF;
+#   */
+#    }                             /* Loop for 8 bits */
+#  }                               /* Loop until num=0 */
+#  return(crc);                    /* Return updated CRC */
+#}
+def mycrc(data):
+    """Reference bit-by-bit implementation of the firmware's CRC-32 (slow)."""
+    length = len(data)
+    crc = 0
+    index = 0
+    poly = 0xEDB88320 
+    while index < length:
+        crc = crc ^ data[ index ]
+        index+=1
+        for i in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ poly
+            else:
+                crc >>= 1
+
+    return(crc)
@@ -0,0 +1,47 @@
+#
+# Record of what was last programmed into each sector of a target's flash
+#
+# Used to skip sectors that already hold the data to be flashed on machines
+# where the flash cannot simply be read back through the debug port.
+#
+
+import hashlib
+import json
+import os
+import re
+
+MANIFEST_DIRECTORY = os.path.expanduser('~/.foenixmgr/flash')
+
+class FlashManifest:
+    """Hashes of the data programmed into each 8KB flash sector on one port and target."""
+
+    def __init__(self, port, target):
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', "{}-{}".format(port, target))
+        self.filename = os.path.join(MANIFEST_DIRECTORY, name + ".json")
+        try:
+            with open(self.filename, "r") as f:
+                self.hashes = json.load(f)
+        except (OSError, ValueError):
+            self.hashes = {}
+
+    def digest(self, data):
+        return hashlib.sha256(data).hexdigest()
+
+    def matches(self, sector, data):
+        """Return true if the sector was last programmed with exactly this data."""
+        return self.hashes.get("{:02X}".format(sector)) == self.digest(data)
+
+    def record(self, sector, data):
+        """Note that the sector has been programmed with the data."""
+        self.hashes["{:02X}".format(sector)] = self.digest(data)
+        self.save()
+
+    def clear(self):
+        """Forget every sector, as after the whole flash is erased or reprogrammed."""
+        self.hashes = {}
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with open(self.filename, "w") as f:
+            json.dump(self.hashes, f, indent=2, sort_keys=True)
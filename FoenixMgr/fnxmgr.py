@@ -10,22 +10,35 @@ import foenix
 import foenix_config
 import constants
 import srec
-import re
 import sys
 import argparse
 import os
 import os.path
 import pgz
 import pgx
+import image
+import crc
+import stats
+import calibration
+import flash_manifest
+import multiboard
+import verify
+import hexdump
+import labels
 import csv
-import zlib
+import json
 import time
+import threading
 import keyboard
 
 from serial.tools import list_ports
 
 STOP_FILE_NAME = "f256.stp"
 
+FLASH_STAGING_WINDOWS = [0x0000, 0x2000]    # RAM the next flash sector is uploaded to, alternately, when double buffering
+COPY_BUFFER_ADDRESS = 0x10000               # Where --copy loads the file and its header
+COPY_MAX_SIZE = (7*65536)-(9*1024)          # Largest file the copy buffer can hold
+
 label_file = ""
 to_send = ""
 port = ""
@@ -33,9 +46,24 @@ start_address = ""
 count = ""
 label = ""
 quiet_mode = False
+delta_mode = False
+port_stats = None
+skip_unchanged = False
+verify_mode = False
+dump_format = "hex"
+board_results = None
+assume_yes = False
+confirm_lock = threading.Lock()
+confirm_answers = {}
 
 def confirm(question):
-    return input(question).lower().strip()[:1] == "y"
+    """Ask a yes or no question. When several boards are being programmed, the question is only asked once."""
+    if assume_yes:
+        return True
+    with confirm_lock:
+        if question not in confirm_answers:
+            confirm_answers[question] = input(question).lower().strip()[:1] == "y"
+        return confirm_answers[question]
 
 def set_stop_indicator():
     """Create a file in the file system to indicate that the F256 is stopped."""
@@ -54,6 +82,13 @@ def is_stopped():
     """Return true if the F256 is stopped."""
     return os.path.isfile(STOP_FILE_NAME)
 
+def debug_port():
+    """Create the object used to talk to the debug port, with instrumentation if requested."""
+    machine = foenix.FoenixDebugPort(config.profile())
+    board = multiboard.current_board()
+    machine.stats = port_stats if board is None else board.stats
+    return machine
+
 def enter_debug(machine):
     """Send the command to enter debug mode"""
     if not is_stopped():
@@ -68,7 +103,7 @@ def exit_debug(machine):
 
 def stop_cpu(port):
     """Stop the CPU from processing instructions (F256 only)."""
-    c256 = foenix.FoenixDebugPort()
+    c256 = debug_port()
     try:
         c256.open(port)
         c256.stop_cpu()
@@ -78,17 +113,19 @@ def stop_cpu(port):
 
 def start_cpu(port):
     """Restart the CPU processing instructions after a stop (F256 only)."""
-    c256 = foenix.FoenixDebugPort()
+    c256 = debug_port()
     try:
         c256.open(port)
         c256.start_cpu()
         clear_stop_indicator()
+        # The program now running may change its own memory
+        forget_uploaded_image(port)
     finally:
         c256.close()
 
 def revision(port):
     """Get the version code for the debug port."""
-    c256 = foenix.FoenixDebugPort()
+    c256 = debug_port()
     try:
         c256.open(port)
         enter_debug(c256)
@@ -102,7 +139,7 @@ def revision(port):
 
 def inject_keyboard_snapshots(port, snapshots):
     """Inject optical keyboard snapshots without stopping the running CPU."""
-    c256 = foenix.FoenixDebugPort()
+    c256 = debug_port()
     try:
         c256.open(port)
         for snapshot in snapshots:
@@ -117,7 +154,7 @@ def inject_keyboard_snapshots(port, snapshots):
 
 def inject_keyboard_scan_codes(port, scan_codes):
     """Inject raw PS/2 Set-2 bytes without stopping the running CPU."""
-    c256 = foenix.FoenixDebugPort()
+    c256 = debug_port()
     try:
         c256.open(port)
         c256.inject_keyboard_scan_codes(scan_codes)
@@ -141,43 +178,40 @@ def parse_scan_codes(values):
 
 def upload_binary(port, filename, address):
     """Upload a binary file into the C256 memory."""
+    memory = image.SparseImage()
     with open(filename, "rb") as f:
-        c256 = foenix.FoenixDebugPort()
-        try:
-            c256.open(port)
-            enter_debug(c256)
-            try:
-                current_addr = int(address, 16)
-                block = f.read(config.chunk_size())
-                while block:
-                    c256.write_block(current_addr, block)
-                    current_addr += len(block)
-                    block = f.read(config.chunk_size())
-            finally:
-                exit_debug(c256)
-        finally:
-            c256.close()
+        memory.add(int(address, 16), f.read())
+
+    upload_image(port, memory)
 
 def run_m68k_bin(port, filename, address):
 	"""Upload a binary into the RAM, and load its first 2 long words into the address 0."""
+	forget_uploaded_image(port)
 	with open(filename, "rb") as f:
-		a2560 = foenix.FoenixDebugPort()
+		a2560 = debug_port()
 		try:
 			a2560.open(port)
 			enter_debug(a2560)
 			try:
 				current_addr = int(address, 16)
-				first_block = f.read(config.chunk_size())
+				memory = image.SparseImage()
+				writer = foenix.PipelinedWriter(a2560, a2560.profile.pipeline_depth)
+				first_block = f.read(a2560.profile.chunk_size)
 				block = first_block
 				while block:
 					block_len = len(block)
 					# print("Writting {} bytes at address {}".format(block_len,hex(current_addr)))
-					a2560.write_block(current_addr, block)
+					writer.write_block(current_addr, block)
+					memory.add(current_addr, block)
 					current_addr += len(block)
-					block = f.read(config.chunk_size())
+					block = f.read(a2560.profile.chunk_size)
+				writer.flush()
 				# Write the 68k initial stack and reset vector
 				vectors = first_block[:8]
 				a2560.write_block(0,vectors)
+				memory.add(0, vectors)
+				if verify_mode:
+					check_upload(a2560, memory)
 			finally:
 				exit_debug(a2560)
 		finally:
@@ -186,71 +220,138 @@ def run_m68k_bin(port, filename, address):
 
 def program_flash_sector(port, filename, sector):
     """Program an 8KB sector of the flash memory using the contents of the C256's RAM."""
+    forget_uploaded_image(port)
           
-    if config.flash_page_size() == 0 or config.flash_sector_size() == 0:
+    profile = config.profile()
+    if profile.flash_page_size == 0 or profile.flash_sector_size == 0:
         print("Unable to flash a sector for the current target machine.")
         print("If your machine supports programming flash sectors, use the --target option.")
         sys.exit(1)
 
     # Sectors are always programmed from the contents of 0x00000 - 0x01FFF
-    address = 0     
-    page_size = config.flash_page_size()            # Get the number of bytes we'll write to flash at a time
-    sector_size = config.flash_sector_size()        # Get the number of bytes in "sector" of flash
+    page_size = profile.flash_page_size            # Get the number of bytes we'll write to flash at a time
+    sector_size = profile.flash_sector_size        # Get the number of bytes in "sector" of flash
     pages = int(sector_size / page_size)            # Total number of pages per sector
     sector_nbr = int(sector, 16)                    # Get the desired sector to write to
     page_nbr = sector_nbr * pages                   # Convert that to a page number
 
-    written = 0                                     # Number of bytes written to flash so far
-
     print("About to upload image to sector 0x{:02X}".format(sector_nbr), flush=True)
 
     if confirm("Are you sure you want to reprogram the flash sector? (y/n): "):           
         with open(filename, "rb") as f:
-            c256 = foenix.FoenixDebugPort()
+            c256 = debug_port()
             try:
                 c256.open(port)
                 enter_debug(c256)
                 try:
-                    to_read = min(config.chunk_size(), sector_size * 1024 - written)
-                    block = f.read(to_read)
-                    while block and written < sector_size * 1024:
-                        c256.write_block(address, block)
-                        written += len(block)
-                        address += len(block)
-                        if address >= config.ram_size() * 1024:
-                            c256.erase_flash_sector(page_nbr)
-                            print("Flash page {} erased...".format(page_nbr), flush=True)
-                            c256.program_flash_sector(page_nbr)
-                            print("Flash page {} programmed...".format(page_nbr))
-                            page_nbr = page_nbr + 1
-                            address = 0
-                                
-                        to_read = min(config.chunk_size(), sector_size * 1024 - written)
-                        block = f.read(to_read)
-
-                    if address > 0:
-                        c256.erase_flash_sector(page_nbr)
-                        print("Flash page {} erased...".format(page_nbr), flush=True)
-                        c256.program_flash_sector(page_nbr)
-                        print("Flash page {} programmed...".format(page_nbr))
+                    manifest = flash_manifest.FlashManifest(port, config.target())
+                    page_bytes = profile.ram_size * 1024
+                    data = f.read(sector_size * 1024)
+                    pages_to_flash = []
+                    for offset in range(0, len(data), page_bytes):
+                        page = data[offset:offset + page_bytes]
+                        if skip_unchanged and flash_unchanged(c256, manifest, page_nbr, page):
+                            print("Flash page {} unchanged, skipped...".format(page_nbr))
+                        else:
+                            pages_to_flash.append((page_nbr, page))
+                        page_nbr = page_nbr + 1
+
+                    flash_sectors(c256, pages_to_flash, manifest, True)
                 finally:
                     exit_debug(c256)
             finally:
                 c256.close()
 
+def stage_flash(c256, data, address=0):
+    """Load data into the RAM the flash sector commands program from (0x00000 by default)."""
+    writer = foenix.PipelinedWriter(c256, c256.profile.pipeline_depth)
+    chunk_size = c256.profile.chunk_size
+    for offset in range(0, len(data), chunk_size):
+        writer.write_block(address + offset, data[offset:offset + chunk_size])
+    writer.flush()
+
+    if verify_mode:
+        # Check the data before it goes into flash, so a bad upload is not programmed
+        staged = image.SparseImage()
+        staged.add(address, data)
+        check_upload(c256, staged)
+
+def check_flash(c256, blocks):
+    """Read back the flash after programming the (offset in flash, data) blocks, if the target allows it (--verify)."""
+    if c256.profile.flash_base is None:
+        print("The flash of this target cannot be read back, so only the data uploaded to RAM was verified.")
+        return
+
+    flash = image.SparseImage()
+    for (offset, data) in blocks:
+        flash.add(c256.profile.flash_base + offset, data)
+    check_upload(c256, flash)
+
+def flash_sectors(c256, sectors, manifest, erase):
+    """Program each (sector number, data) in 'sectors' into flash, erasing each first if 'erase' is true.
+
+    If the firmware can program a sector from a given RAM address (flash_double_buffer),
+    the data for the next sector is uploaded to the other staging window while the current
+    sector is being programmed. Otherwise, each sector is uploaded to 0x00000 and then
+    erased and programmed, one step after another.
+    """
+    double_buffer = c256.profile.flash_double_buffer
+    if double_buffer and sectors:
+        stage_flash(c256, sectors[0][1], FLASH_STAGING_WINDOWS[0])
+
+    for (i, (sector_nbr, data)) in enumerate(sectors):
+        if double_buffer:
+            source = FLASH_STAGING_WINDOWS[i % 2]
+        else:
+            source = 0
+            stage_flash(c256, data)
+            print("Binary file uploaded...", flush=True)
+
+        if erase:
+            c256.erase_flash_sector(sector_nbr)
+            print("Flash sector 0x{:02X} erased...".format(sector_nbr), flush=True)
+
+        started = time.perf_counter()
+        c256.program_flash_sector(sector_nbr, data, source, wait=not double_buffer)
+        if double_buffer:
+            if i + 1 < len(sectors):
+                stage_flash(c256, sectors[i + 1][1], FLASH_STAGING_WINDOWS[(i + 1) % 2])
+            c256.wait_program_sector(sector_nbr, data, started)
+
+        print("Flash sector 0x{:02X} programmed...".format(sector_nbr), flush=True)
+        manifest.record(sector_nbr, data)
+
+    if verify_mode and sectors:
+        check_flash(c256, [(sector_nbr * 0x2000, data) for (sector_nbr, data) in sectors])
+
+def flash_unchanged(c256, manifest, sector_nbr, data):
+    """Return true if the 8KB flash sector already holds data.
+
+    If the target's flash can be read through the debug port, the sector is read back
+    and compared. Otherwise, the manifest of what was last programmed there is used.
+    """
+    if c256.profile.flash_base is not None:
+        return c256.read_block(c256.profile.flash_base + sector_nbr * 0x2000, len(data)) == data
+    return manifest.matches(sector_nbr, data)
+
 def program_flash_bulk(port, csv_file, pre_erase):
     """Program the flash sector by sector, given a CSV file mapping sectors to files."""
+    forget_uploaded_image(port)
 
     with open(csv_file, "r") as bulk_mapping:
-        c256 = foenix.FoenixDebugPort()
+        c256 = debug_port()
         try:
             c256.open(port)
             enter_debug(c256)
             try:
+                manifest = flash_manifest.FlashManifest(port, config.target())
                 if pre_erase:
                     c256.erase_flash()
+                    manifest.clear()
                     print("Flash memory erased...", flush=True)
 				
+                # Check every sector before programming any, since the flash cannot be read while it is busy
+                sectors = []
                 bulk_reader = csv.reader(bulk_mapping)
                 for row in bulk_reader:
                     sector_id = row[0]
@@ -260,19 +361,15 @@ def program_flash_bulk(port, csv_file, pre_erase):
                     print("Attempting to program sector 0x{0:02X} with {1}".format(sector_nbr, sector_file))
 
                     with open(sector_file, "rb") as f:
-                        address = 0
-                        block = f.read(config.chunk_size())
-                        while block:
-                            c256.write_block(address, block)
-                            address += len(block)
-                            block = f.read(config.chunk_size())
+                        data = f.read()
 
-                        print("Binary file uploaded...", flush=True)
-                        if not pre_erase:
-                            c256.erase_flash_sector(sector_nbr)
-                            print("Flash sector erased...", flush=True)
-                        c256.program_flash_sector(sector_nbr)
-                        print("Flash sector programmed...")
+                    if skip_unchanged and not pre_erase and flash_unchanged(c256, manifest, sector_nbr, data):
+                        print("Flash sector unchanged, skipped...")
+                        continue
+
+                    sectors.append((sector_nbr, data))
+
+                flash_sectors(c256, sectors, manifest, not pre_erase)
             finally:
                 exit_debug(c256)
         finally:
@@ -282,12 +379,13 @@ def erase_flash(port):
     """Erase the flash memory."""
 
     if confirm("Are you sure you want to erase the flash memory? (y/n): "):
-        c256 = foenix.FoenixDebugPort()
+        c256 = debug_port()
         try:
             c256.open(port)
             enter_debug(c256)
             try:
                 c256.erase_flash()
+                flash_manifest.FlashManifest(port, config.target()).clear()
                 print("Flash memory erased...", flush=True)
             finally:
                 exit_debug(c256)
@@ -296,6 +394,7 @@ def erase_flash(port):
 
 def program_flash(port, filename, hex_address):
     """Program the flash memory using the contents of the C256's RAM."""
+    forget_uploaded_image(port)
 
     base_address = int(hex_address, 16)
     address = base_address
@@ -304,22 +403,34 @@ def program_flash(port, filename, hex_address):
     if (1) or (os.path.getsize(filename) == config.flash_size()):
         if confirm("Are you sure you want to reprogram the flash memory? (y/n): "):
             with open(filename, "rb") as f:
-                c256 = foenix.FoenixDebugPort()
+                c256 = debug_port()
                 try:
                     c256.open(port)
                     enter_debug(c256)
                     try:
-                        block = f.read(config.chunk_size())
+                        memory = image.SparseImage()
+                        writer = foenix.PipelinedWriter(c256, c256.profile.pipeline_depth)
+                        block = f.read(c256.profile.chunk_size)
                         while block:
-                            c256.write_block(address, block)
+                            writer.write_block(address, block)
+                            memory.add(address, block)
                             address += len(block)
-                            block = f.read(config.chunk_size())
+                            block = f.read(c256.profile.chunk_size)
+                        writer.flush()
 
                         print("Binary file uploaded...", flush=True)
+                        if verify_mode:
+                            # Check the data before it goes into flash, so a bad upload is not programmed
+                            check_upload(c256, memory)
+
                         c256.erase_flash()
+                        flash_manifest.FlashManifest(port, config.target()).clear()
                         print("Flash memory erased...", flush=True)
                         c256.program_flash(base_address)
                         print("Flash memory programmed...")
+
+                        if verify_mode:
+                            check_flash(c256, [(start - base_address, data) for (start, data) in memory.chunks(verify.READ_CHUNK_SIZE)])
                     finally:
                         exit_debug(c256)
                 finally:
@@ -327,283 +438,465 @@ def program_flash(port, filename, hex_address):
     else:
         print("The provided flash file is not the right size.")
 
-def dereference(port, file, label):
-    """Get the address contained in the pointer with the label in the label file."""
-    c256 = foenix.FoenixDebugPort()
+def find_labels(file, patterns):
+    """Return the (label, address) of every label in the label file matching one of the patterns."""
+    index = labels.load(file)
+    found = []
+    for pattern in patterns:
+        matches = index.search(pattern)
+        if not matches:
+            sys.stderr.write("Could not find a definition for {}.\n".format(pattern))
+            sys.exit(2)
+        found.extend(matches)
+    return found
+
+def show_labels(port, file, patterns, length, deref, filename=None):
+    """Display the memory at each label matching the patterns, over a single connection.
+
+    If 'deref' is true, each label is the address of a 24-bit pointer, and the memory
+    displayed is the memory it points to.
+    """
+    found = find_labels(file, patterns)
+    if filename is not None and len(found) > 1:
+        print("Only one label can be saved to a dump file, but {} labels match.".format(len(found)))
+        sys.exit(1)
+
+    count = int(length, 16)
+    c256 = debug_port()
     try:
-        address = lookup(file, label)
         c256.open(port)
         enter_debug(c256)
         try:
-            data = c256.read_block(int(address, 16), 3)
-            deref = data[2] << 16 | data[1] << 8 | data[0]
-            return "%X" % deref
+            for (label, address) in found:
+                if deref:
+                    data = c256.read_block(address, 3)
+                    address = data[2] << 16 | data[1] << 8 | data[0]
+                if len(found) > 1:
+                    print("{} ({}${:X}):".format(label, "-> " if deref else "", address))
+                show_memory(c256, address, count, filename)
         finally:
             exit_debug(c256)
     finally:
         c256.close()
 
-def lookup(file, label):
-    """Return the hex address linked to the passed label in the label file."""
-    with open(file) as f:
-        for line in f:
-            match = re.match(r'^(\S+)\s*\=\s*\$(\S+)', line)
-            if match:
-                if match.group(1) == label:
-                    return match.group(2)
-        sys.stderr.write("Could not find a definition for that label.\n")
-        sys.exit(2)
-
-def display(base_address, data):
-    """Write a block of data to the console in a nice, hexadecimal format."""
-
-    text_buff = ""
-    for i in range(0, len(data)):
-        if (i % 16) == 0:
-            if text_buff != "":
-                sys.stdout.write(" {}\n".format(text_buff))
-            text_buff = ""
-            sys.stdout.write("{:06X}: ".format(base_address + i))
-        elif (i % 8) == 0:
-            sys.stdout.write(" ")
-        sys.stdout.write("{:02X}".format(data[i]))
-
-        b = bytearray(1)
-        b[0] = data[i]
-        if (b[0] & 0x80 == 0):
-            c = b.decode('ascii')
-            if c.isprintable():
-                text_buff = text_buff + c
-            else:
-                text_buff = text_buff + "."
+def list_labels(file, patterns):
+    """Print the address of every label matching the patterns."""
+    for (label, address) in find_labels(file, patterns):
+        print("{} = ${:X}".format(label, address))
+
+def list_symbols(file, addresses):
+    """Print the label at, or nearest below, each address (in hex)."""
+    index = labels.load(file)
+    for text in addresses:
+        address = int(text, 16)
+        nearest = index.nearest(address)
+        if nearest is None:
+            print("${:X}: no label at or below this address".format(address))
+        elif nearest[1] == address:
+            print("${:X} = {}".format(address, nearest[0]))
         else:
-            text_buff = text_buff + "."
-
-    sys.stdout.write(' {}\n'.format(text_buff))
-
-#
-#define poly 0xEDB88320
-#/* Some compilers need
-#   #define poly 0xEDB88320uL
-# */
-#
-#/* On entry, addr=>start of data
-#             num = length of data
-#             crc = incoming CRC     */
-#int crc32(char *addr, int num, int crc)
-#{
-#int i;
-#
-#for (; num>0; num--)              /* Step through bytes in memory */
-#  {
-#  crc = crc ^ *addr++;            /* Fetch byte from memory, XOR into CRC */
-#  for (i=0; i<8; i++)             /* Prepare to rotate 8 bits */
-#  {
-#    if (crc & 1)                  /* b0 is set... */
-#      crc = (crc >> 1) ^ poly;    /* rotate and XOR with ZIP polynomic */
-#    else                          /* b0 is clear... */
-#      crc >>= 1;                  /* just rotate */
-#  /* Some compilers need:
-#    crc &= 0xFFFFFFFF;
-#   */
-#    }                             /* Loop for 8 bits */
-#  }                               /* Loop until num=0 */
-#  return(crc);                    /* Return updated CRC */
-#}
-def mycrc(data):
-    length = len(data)
-    crc = 0
-    index = 0
-    poly = 0xEDB88320 
-    while index < length:
-        crc = crc ^ data[ index ]
-        index+=1
-        for i in range(8):
-            if crc & 1:
-                crc = (crc >> 1) ^ poly
-            else:
-                crc >>= 1
+            print("${:X} = {}+${:X}".format(address, nearest[0], address - nearest[1]))
 
-    return(crc)
+def display(base_address, data):
+    """Write a block of data to the console in the format chosen with --dump-format (hexadecimal by default)."""
+    hexdump.write(sys.stdout, base_address, data, dump_format)
 
 def copy_file(port, filename):
     """Copy the data in 'filename' to the F256jr SDCard."""
-    with open(filename, "rb") as f:
-        filesize = os.path.getsize(filename);
+    forget_uploaded_image(port)
+    filesize = os.path.getsize(filename)
 
-        if filesize < ((7*65536)-(9*1024)):
-            c256 = foenix.FoenixDebugPort()
+    if filesize < COPY_MAX_SIZE:
+        with open(filename, "rb") as f:
+            c256 = debug_port()
             try:
-                blocks = f.read(filesize)
-                crc32 = mycrc(blocks)
-
                 c256.open(port)
                 enter_debug(c256)
-
-                # Load Filedata into RAM
-
                 try:
-                    current_addr = 0x10000
-                    # Filename to char array
-                    filename_block = bytes(os.path.basename(filename), "utf-8")
-                    # extend, zero terminate
-                    zero_block = bytes([ 0x00 ])
-
-                    # place the 0 terminated filename in RAM
-                    c256.write_block(current_addr, filename_block)
-                    current_addr += len(filename_block)
-                    c256.write_block(current_addr, zero_block)
-                    current_addr += len(zero_block)
-
-                    # follow with crc32
-                    crc_block = bytes([ crc32 & 0xff, (crc32>>8)&0xff, (crc32>>16)&0xff, (crc32>>24)&0xff])
-                    c256.write_block(current_addr, crc_block)
-                    current_addr += len(crc_block)
-                    # follow with 24 bit data length
-                    len_block = bytes([ filesize & 0xff, (filesize>>8)&0xff, (filesize>>16)&0xff])
-                    c256.write_block(current_addr, len_block)
-                    current_addr += len(len_block)
-
-                    block_size = config.chunk_size()
-
-                    # upload the file data
-                    total_length = len(blocks)
-                    chunk_offset = 0
-                    while total_length > 0:
-                        if total_length < block_size:
-                            block_size = total_length
-                        c256.write_block(current_addr, blocks[chunk_offset:chunk_offset+block_size])
-                        current_addr += block_size
-                        total_length -= block_size
-                        chunk_offset += block_size
-
-                    # Let Firmware know we have a copy request
-                    # "COPYFILE"
-                    c256.write_block(0x0080, bytes([0x43,0x4f,0x50,0x59,0x46,0x49,0x4c,0x45]))
-
+                    stage_copy(c256, f, os.path.basename(filename))
                 finally:
                     exit_debug(c256)
             finally:
                 c256.close()
+    else:
+        print(f"File too large: {filename} {filesize}")
+
+def copy_list(paths):
+    """Expand the --copy arguments into a list of files.
+
+    Each argument may be a file, a directory (every file in it is copied, apart from hidden
+    files and editor backups), or a manifest: a text file named with a leading '@', listing
+    one file per line. Relative paths in a manifest are relative to the manifest itself.
+    """
+    filenames = []
+    for path in paths:
+        if path.startswith("@"):
+            directory = os.path.dirname(path[1:])
+            with open(path[1:], "r") as manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        filenames.append(os.path.join(directory, line))
+        elif os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.startswith(".") or name.endswith("~"):
+                    continue
+                if os.path.isfile(os.path.join(path, name)):
+                    filenames.append(os.path.join(path, name))
         else:
-            print(f"File too large: {filename} {filesize}")
+            filenames.append(path)
+    return filenames
+
+def copy_files(port, filenames):
+    """Copy several files to the F256jr SDCard over one connection to the debug port.
+
+    The firmware only acts on a copy request when the F256 restarts, so each file still
+    needs its own enter/exit of debug mode, and time for the firmware to write it to the
+    card before the next one is loaded. The debug port cannot tell when the firmware is
+    done, so that time is a fixed guess (copy_delay), to be raised if files go missing.
+    """
+    if is_stopped():
+        print("The CPU is stopped, so the firmware cannot copy the files. Use --start first.")
+        sys.exit(1)
+
+    forget_uploaded_image(port)
+    total_bytes = 0
+    total_time = 0
+    copied = 0
+    c256 = debug_port()
+    try:
+        c256.open(port)
+        for filename in filenames:
+            filesize = os.path.getsize(filename)
+            if filesize >= COPY_MAX_SIZE:
+                print(f"File too large: {filename} {filesize}")
+                continue
+
+            if copied > 0:
+                # Give the firmware time to write the previous file to the card
+                time.sleep(config.copy_delay())
+
+            start = time.perf_counter()
+            with open(filename, "rb") as f:
+                enter_debug(c256)
+                try:
+                    sent = stage_copy(c256, f, os.path.basename(filename))
+                finally:
+                    exit_debug(c256)
+            elapsed = time.perf_counter() - start
+
+            copied += 1
+            total_bytes += sent
+            total_time += elapsed
+            print("{}: {} bytes in {:.2f} s ({:.1f} KB/s)".format(filename, sent, elapsed, sent / 1024 / max(elapsed, 1e-6)))
+    finally:
+        c256.close()
+
+    print("Copied {} files, {} bytes, uploaded at {:.1f} KB/s".format(copied, total_bytes, total_bytes / 1024 / max(total_time, 1e-6)))
+
+def stage_copy(c256, f, name):
+    """Load the file 'f' into the F256's RAM, along with a request for the firmware to copy it.
+
+    The request starts at 0x10000 with the zero terminated file name, then the CRC-32 of
+    the data (4 bytes) and its length (3 bytes), then the data itself. The data is streamed
+    first, with its CRC computed as it is read, so the header can follow as a single block.
+    """
+    filename_block = bytes(name, "utf-8") + bytes([0x00])
+    header_size = len(filename_block) + 4 + 3
+    current_addr = COPY_BUFFER_ADDRESS + header_size
+
+    writer = foenix.PipelinedWriter(c256, c256.profile.pipeline_depth)
+    buffer = bytearray(c256.profile.chunk_size)
+    view = memoryview(buffer)
+    crc32 = 0
+    filesize = 0
+
+    # upload the file data
+    length = f.readinto(buffer)
+    while length:
+        block = view[:length]
+        crc32 = crc.crc32(block, crc32)
+        writer.write_block(current_addr, block)
+        current_addr += length
+        filesize += length
+        length = f.readinto(buffer)
+
+    # the 0 terminated filename, followed with crc32 and the 24 bit data length
+    header = filename_block + crc32.to_bytes(4, byteorder='little') + filesize.to_bytes(3, byteorder='little')
+    writer.write_block(COPY_BUFFER_ADDRESS, header)
+
+    # Let Firmware know we have a copy request
+    # "COPYFILE"
+    writer.write_block(0x0080, bytes([0x43,0x4f,0x50,0x59,0x46,0x49,0x4c,0x45]))
+    writer.flush()
+    return filesize
 
 
 def send_pgx(port, filename):
     """Send the data in the PGX file 'filename' to the C256 on the given serial port."""
-    infile = pgx.PGXBinFile()
-    c256 = foenix.FoenixDebugPort()
+    memory = image.SparseImage()
+    infile = pgx.PGXBinFile(config.profile())
+    infile.open(filename)
     try:
-        c256.open(port)
-        infile.open(filename)
-        try:
-            infile.set_handler(lambda address, data: c256.write_block(address, data))
-            enter_debug(c256)
-            try:
-                # Process the lines in the hex file
-                infile.read_blocks()
-            finally:
-                exit_debug(c256)
-        finally:
-            infile.close()
+        infile.set_handler(memory.add)
+        # Process the blocks in the PGX file
+        infile.read_blocks()
     finally:
-        c256.close()
+        infile.close()
+
+    upload_image(port, memory)
 
 def send_pgz(port, filename):
     """Send the data in the PGZ file 'filename' to the C256 on the given serial port."""
-    infile = pgz.PGZBinFile()
-    c256 = foenix.FoenixDebugPort()
+    memory = image.SparseImage()
+    infile = pgz.PGZBinFile(config.profile())
+    infile.open(filename)
     try:
-        c256.open(port)
-        infile.open(filename)
-        try:
-            infile.set_handler(lambda address, data: c256.write_block(address, data))
-            enter_debug(c256)
-            try:
-                # Process the lines in the hex file
-                infile.read_blocks()
-            finally:
-                exit_debug(c256)
-        finally:
-            infile.close()
+        infile.set_handler(memory.add)
+        # Process the blocks in the PGZ file
+        infile.read_blocks()
     finally:
-        c256.close()
+        infile.close()
+
+    upload_image(port, memory)
 
 def send_wdc(port, filename):
     """Send the data in the hex file 'filename' to the C256 on the given serial port."""
+    memory = image.SparseImage()
     infile = wdc.WdcBinFile()
-    c256 = foenix.FoenixDebugPort()
+    infile.open(filename)
     try:
-        c256.open(port)
-        infile.open(filename)
-        try:
-            infile.set_handler(lambda address, data: c256.write_block(address, data))
-            enter_debug(c256)
-            try:
-                # Process the lines in the hex file
-                infile.read_blocks()
-            finally:
-                exit_debug(c256)
-        finally:
-            infile.close()
+        infile.set_handler(memory.add)
+        # Process the blocks in the WDC file
+        infile.read_blocks()
     finally:
-        c256.close()
+        infile.close()
+
+    upload_image(port, memory)
 
 def send_srec(port, filename):
     """Send the data in the SREC hex file 'filename' to the C256 on the given serial port."""
+    memory = image.SparseImage()
     infile = srec.SRECFile()
-    c256 = foenix.FoenixDebugPort()
+    infile.open(filename)
+    try:
+        infile.set_handler(lambda address, data: memory.add(address, bytes.fromhex(data)))
+        # Process the lines in the SREC file
+        infile.read_lines()
+    finally:
+        infile.close()
+
+    upload_image(port, memory)
+
+def send(port, filename):
+    """Send the data in the hex file 'filename' to the C256 on the given serial port."""
+    memory = image.SparseImage()
+    infile = intelhex.HexFile()
+    infile.open(filename)
+    try:
+        infile.set_handler(lambda address, data: memory.add(address, bytes.fromhex(data)))
+        # Process the lines in the hex file
+        infile.read_lines()
+    finally:
+        infile.close()
+
+    upload_image(port, memory)
+
+def upload_image(port, memory):
+    """Upload a sparse memory image to the C256, coalesced into as few packets as possible.
+
+    In delta mode, chunks that are identical to the image last uploaded to this port
+    and target are skipped. That image is only remembered while the CPU is stopped (with
+    --stop), since a running program may change its own memory behind FoenixMgr's back.
+    """
+    cache_file = image.cache_filename(port, config.target())
+    previous = None
+    if delta_mode:
+        previous = image.SparseImage()
+        if not previous.load(cache_file):
+            previous = None
+
+    # Until this upload completes, the C256's memory matches neither image
+    image.forget(cache_file)
+
+    sent = 0
+    c256 = debug_port()
     try:
         c256.open(port)
-        infile.open(filename)
+        enter_debug(c256)
         try:
-            infile.set_handler(lambda address, data: c256.write_block(address, bytes.fromhex(data)))
-            enter_debug(c256)
-            try:
-                # Process the lines in the hex file
-                infile.read_lines()
-            finally:
-                exit_debug(c256)
+            writer = foenix.PipelinedWriter(c256, c256.profile.pipeline_depth)
+            for (address, block) in memory.chunks(c256.profile.chunk_size):
+                if previous is not None and previous.read(address, len(block)) == block:
+                    continue
+                writer.write_block(address, block)
+                sent += len(block)
+            writer.flush()
+
+            if verify_mode:
+                check_upload(c256, memory)
         finally:
-            infile.close()
+            exit_debug(c256)
     finally:
         c256.close()
 
-def send(port, filename):
-    """Send the data in the hex file 'filename' to the C256 on the given serial port."""
-    infile = intelhex.HexFile()
-    c256 = foenix.FoenixDebugPort()
+    if delta_mode:
+        if is_stopped():
+            memory.save(cache_file)
+        elif not quiet_mode:
+            print("The CPU is running, so the next --delta upload will send everything (use --stop to keep it still).")
+        if not quiet_mode:
+            print("Sent {} of {} bytes".format(sent, memory.size()))
+
+def check_upload(c256, memory):
+    """Read back a SparseImage just written to the C256 and stop if its memory does not match (--verify)."""
+    result = verify.verify_image(c256, memory, c256.profile.pipeline_depth)
+    if not result.ok():
+        print(result.report())
+        sys.exit(1)
+    elif not quiet_mode:
+        print(result.report())
+
+def forget_uploaded_image(port):
+    """Note that the C256's RAM no longer holds the image last uploaded to it."""
+    image.forget(image.cache_filename(port, config.target()))
+
+def get(port, address, length, filename=None):
+    """Read a block of data from the C256 and display it, or save it to a binary file."""
+    c256 = debug_port()
     try:
         c256.open(port)
-        infile.open(filename)
+        enter_debug(c256)
         try:
-            infile.set_handler(lambda address, data: c256.write_block(address, bytes.fromhex(data)))
+            show_memory(c256, int(address, 16), int(length, 16), filename)
+        finally:
+            exit_debug(c256)
+    finally:
+        c256.close()
+
+def show_memory(c256, start, count, filename=None):
+    """Read 'count' bytes from 'start' and display them, or save them to a binary file.
+
+    The block may be of any size: it is read in the largest requests the debug port
+    allows, with as many in flight at once as the pipeline depth.
+    """
+    reader = foenix.PipelinedReader(c256, c256.profile.pipeline_depth)
+    blocks = reader.read_range(start, count)
+    if filename is None:
+        data = bytearray()
+        for (_, block) in blocks:
+            data.extend(block)
+        display(start, data)
+    else:
+        save_dump(blocks, filename)
+
+def parse_watch_range(text, default_count):
+    """Parse a range to watch, given as ADDRESS or ADDRESS:COUNT (in hex), into (address, count)."""
+    (address, _, count) = text.partition(":")
+    try:
+        return (int(address, 16), int(count or default_count, 16))
+    except ValueError:
+        raise ValueError("invalid range {!r}: expected ADDRESS or ADDRESS:COUNT in hex".format(text))
+
+def watch(port, ranges, interval, live):
+    """Poll ranges of memory over one connection, showing the bytes that change, until interrupted.
+
+    Each range is an (address, count). All of the reads for one poll are pipelined. If 'live'
+    is true, the CPU keeps running; otherwise the C256 is held in debug mode while watching.
+    """
+    c256 = debug_port()
+    try:
+        c256.open(port)
+        if not live:
             enter_debug(c256)
+        try:
+            reader = foenix.PipelinedReader(c256, c256.profile.pipeline_depth)
+            # Each range keeps its own blocks, since ranges may overlap or be given more than once
+            range_blocks = [[(start, min(constants.READ_MAX_LENGTH, address + count - start))
+                             for start in range(address, address + count, constants.READ_MAX_LENGTH)]
+                            for (address, count) in ranges]
+            blocks = [block for each_range in range_blocks for block in each_range]
+
+            highlight = sys.stdout.isatty()
+            previous = None
+            polls = 0
+            started = time.perf_counter()
             try:
-                # Process the lines in the hex file
-                infile.read_lines()
-            finally:
-                exit_debug(c256)
+                while True:
+                    polled_at = time.perf_counter()
+                    contents = [data for (_, data) in reader.read_blocks(blocks)]
+                    current = []
+                    for each_range in range_blocks:
+                        current.append(b"".join(contents[:len(each_range)]))
+                        del contents[:len(each_range)]
+                    polls += 1
+
+                    if previous is None:
+                        for ((address, count), data) in zip(ranges, current):
+                            display(address, data)
+                    else:
+                        lines = []
+                        for ((address, count), old, new) in zip(ranges, previous, current):
+                            lines.extend(hexdump.changed_lines(address, old, new, highlight))
+                        if lines:
+                            sys.stdout.write("".join("[{:8.3f}] {}".format(polled_at - started, line) for line in lines))
+                            sys.stdout.flush()
+                    previous = current
+
+                    time.sleep(max(0, polled_at + interval - time.perf_counter()))
+            except KeyboardInterrupt:
+                pass
+
+            elapsed = time.perf_counter() - started
+            if not quiet_mode and elapsed > 0:
+                print("{} polls in {:.1f} s ({:.1f} polls/s)".format(polls, elapsed, polls / elapsed))
         finally:
-            infile.close()
+            if not live:
+                exit_debug(c256)
     finally:
         c256.close()
 
-def get(port, address, length):
-    """Read a block of data from the C256."""
-    c256 = foenix.FoenixDebugPort()
+def save_dump(blocks, filename):
+    """Write the (address, data) blocks read from the C256 to a binary file as they arrive."""
+    written = 0
+    started = time.perf_counter()
+    with open(filename, "wb") as f:
+        for (_, block) in blocks:
+            f.write(block)
+            written += len(block)
+
+    if not quiet_mode:
+        elapsed = time.perf_counter() - started
+        print("Saved {} bytes to {} in {:.2f} s ({:.1f} KB/s)".format(
+            written, filename, elapsed, written / 1024 / elapsed if elapsed > 0 else 0))
+
+def calibrate(port, address):
+    """Find the fastest chunk size and pipeline depth for the port and save them."""
+    question = "Calibrating overwrites {} bytes of RAM at 0x{}. Are you sure? (y/n): ".format(calibration.TEST_SIZE, address)
+    if not confirm(question):
+        return
+
+    forget_uploaded_image(port)
+    c256 = debug_port()
     try:
         c256.open(port)
         enter_debug(c256)
         try:
-            data = c256.read_block(int(address, 16), int(length, 16))
-
-            display(int(address, 16), data)
+            print("Calibrating using RAM at 0x{}...".format(address))
+            result = calibration.calibrate(c256, int(address, 16))
         finally:
             exit_debug(c256)
     finally:
         c256.close()
 
+    if result is None:
+        print("Calibration failed.")
+        sys.exit(1)
+
+    calibration.save(port, config.target(), result)
+    print("Best: chunk size {}, pipeline depth {} ({:.1f} KB/s)".format(
+        result["chunk_size"], result["pipeline_depth"], result["bytes_per_s"] / 1024))
+
 def list_serial_ports():
     serial_ports = list_ports.comports()
 
@@ -617,6 +910,20 @@ def list_serial_ports():
         print(f"   Product: {serial_port.product}")
         print()
 
+def run_on_boards(ports):
+    """Carry out the command on every board at once, then report which boards passed."""
+    global board_results
+
+    stats_factory = None
+    if port_stats is not None:
+        stats_factory = lambda: stats.PortStatistics(trace=port_stats.trace is not None)
+
+    started = time.perf_counter()
+    board_results = multiboard.run_on_boards(ports, run_command, stats_factory)
+    print(multiboard.report(board_results, time.perf_counter() - started))
+    if not all(board.ok for board in board_results):
+        sys.exit(1)
+
 def tcp_bridge(tcp_host_port, serial_port):
     """ Listen for TCP socket connections and relay messages to Foenix via serial port """
     parsed_host_port = tcp_host_port.split(":")
@@ -627,7 +934,7 @@ def tcp_bridge(tcp_host_port, serial_port):
 
 def set_boot_source(port, source):
     """For F256jr RevA only: set the boot source for the machine"""
-    c256 = foenix.FoenixDebugPort()
+    c256 = debug_port()
     try:
         c256.open(port)
         enter_debug(c256)
@@ -646,17 +953,141 @@ def set_boot_source(port, source):
     finally:
         c256.close()
 
-# Load the configuration file...
-config = foenix_config.FoenixConfig()
+def run_command(port):
+    """Carry out the command given on the command line with the board on 'port'."""
+    if options.boot_source:
+        source = options.boot_source.lower()
+        set_boot_source(port, source)
+        
+    elif options.stop:
+        stop_cpu(port)
+        print("Stopping the CPU...")
+
+    elif options.start:
+        start_cpu(port)
+        print("Starting the CPU...")
+
+    elif options.keyboard_keys:
+        try:
+            snapshots = []
+            for key_name in options.keyboard_keys:
+                snapshots.extend(keyboard.encode_optical_key(key_name))
+        except ValueError as error:
+            parser.error(str(error))
+        inject_keyboard_snapshots(port, snapshots)
+
+    elif options.keyboard_text is not None:
+        try:
+            snapshots = keyboard.encode_optical_text(options.keyboard_text)
+        except ValueError as error:
+            parser.error(str(error))
+        inject_keyboard_snapshots(port, snapshots)
+
+    elif options.keyboard_scan_codes:
+        try:
+            scan_codes = parse_scan_codes(options.keyboard_scan_codes)
+        except ValueError as error:
+            parser.error(str(error))
+        inject_keyboard_scan_codes(port, scan_codes)
+
+    elif options.copy_file:
+        filenames = copy_list(options.copy_file)
+        if len(filenames) == 1:
+            copy_file(port, filenames[0])
+        else:
+            copy_files(port, filenames)
+            
+    elif options.hex_file:
+        send(port, options.hex_file)
+
+    elif options.pgz_file:
+        send_pgz(port, options.pgz_file)
+
+    elif options.pgx_file:
+        send_pgx(port, options.pgx_file)
+
+    elif options.wdc_file:
+        send_wdc(port, options.wdc_file)
+
+    elif options.srec_file:
+        send_srec(port, options.srec_file)
+
+    elif options.deref_name and options.label_file:
+        show_labels(port, options.label_file, options.deref_name, options.count, True, options.dump_file)
+
+    elif options.lookup_name and options.label_file:
+        show_labels(port, options.label_file, options.lookup_name, options.count, False, options.dump_file)
+
+    elif options.find_labels and options.label_file:
+        list_labels(options.label_file, options.find_labels)
+
+    elif options.symbol_addresses and options.label_file:
+        list_symbols(options.label_file, options.symbol_addresses)
+
+    elif options.watch_ranges:
+        try:
+            ranges = [parse_watch_range(text, options.count) for text in options.watch_ranges]
+        except ValueError as error:
+            parser.error(str(error))
+        watch(port, ranges, options.interval, options.live or config.live_access())
+
+    elif options.dump_address:
+        get(port, options.dump_address, options.count, options.dump_file)
+
+    elif options.calibrate:
+        calibrate(port, options.address)
+
+    elif options.revision:
+        rev = revision(port)
+        print(rev)
+
+    elif options.address and options.binary_file:
+        upload_binary(port, options.binary_file, options.address)
+
+    elif options.address and options.run_m68k_bin:
+        run_m68k_bin(port, options.run_m68k_bin, options.address)
+
+    elif options.address and options.flash_file:
+        if options.flash_sector:
+            # If sector number provided, program just that sector
+            program_flash_sector(port, options.flash_file, options.flash_sector)
+        else:
+            # Otherwise, program the entire flash memory
+            program_flash(port, options.flash_file, options.address)
+
+    elif options.tcp_host_port:
+        tcp_bridge(options.tcp_host_port, port)
+
+    elif options.bulk_file:
+        if options.erase_flash:
+            # Erase all of flash before writing the bulk files
+            program_flash_bulk(port, options.bulk_file, True)
+        else:
+            # Erase each sector individually before writing the sector
+            # Erase only those sectors to be written
+            program_flash_bulk(port, options.bulk_file, False)
+        
+    elif options.erase_flash:
+        erase_flash(port)
+        
+    else:
+        parser.print_help()
+
+
+# The configuration, loaded by main() (so that importing this module reads no files)
+config = None
 
 parser = argparse.ArgumentParser(description='Manage the C256 Foenix through its debug port.')
-parser.add_argument("--port", dest="port", default=config.port(),
+parser.add_argument("--port", dest="port",
                     help="Specify the serial port to use to access the C256 debug port.")
 
+parser.add_argument("--ports", metavar="PORT", dest="ports", nargs="+",
+                    help="run the command on several boards at once, given their serial ports or bridges (HOST:PORT)")
+
 parser.add_argument("--list-ports", dest="list_ports", action="store_true",
                     help="List available serial ports.")
 
-parser.add_argument("--label-file", dest="label_file", default=config.label_file(),
+parser.add_argument("--label-file", dest="label_file",
                     help="Specify the label file to use for dereference and lookup")
 
 parser.add_argument("--count", dest="count", default="10", help="the number of bytes to read")
@@ -664,11 +1095,32 @@ parser.add_argument("--count", dest="count", default="10", help="the number of b
 parser.add_argument("--dump", metavar="ADDRESS", dest="dump_address",
                     help="Read memory from the C256's memory and display it.")
 
-parser.add_argument("--deref", metavar="LABEL", dest="deref_name",
-                    help="Lookup the address stored at LABEL and display the memory there.")
+parser.add_argument("--dump-file", metavar="BINARY FILE", dest="dump_file",
+                    help="With --dump, --deref or --lookup, save the memory read to a binary file instead of displaying it.")
+
+parser.add_argument("--dump-format", dest="dump_format", choices=hexdump.FORMATS, default="hex",
+                    help="How --dump, --deref and --lookup display memory: hex (the default), xxd, c (a C array) or raw.")
+
+parser.add_argument("--watch", metavar="RANGE", dest="watch_ranges", nargs="+",
+                    help="Keep reading memory ranges (ADDRESS or ADDRESS:COUNT, in hex) and show the bytes that change. Stop with Ctrl-C.")
 
-parser.add_argument("--lookup", metavar="LABEL", dest="lookup_name",
-                    help="Display the memory starting at the address indicated by the label.")
+parser.add_argument("--interval", metavar="SECONDS", dest="interval", type=float, default=0.25,
+                    help="With --watch, the time between reads (0 to read as fast as the link allows).")
+
+parser.add_argument("--live", action="store_true", dest="live",
+                    help="With --watch, read memory without entering debug mode, so the machine keeps running and is not reset. This is the default on the F256jr and F256k.")
+
+parser.add_argument("--deref", metavar="LABEL", dest="deref_name", nargs="+",
+                    help="Lookup the address stored at LABEL and display the memory there. Wildcards (* ? [...]) match several labels.")
+
+parser.add_argument("--lookup", metavar="LABEL", dest="lookup_name", nargs="+",
+                    help="Display the memory starting at the address indicated by the label. Wildcards (* ? [...]) match several labels.")
+
+parser.add_argument("--find", metavar="LABEL", dest="find_labels", nargs="+",
+                    help="List the labels matching LABEL (which may use wildcards) and their addresses.")
+
+parser.add_argument("--symbol", metavar="ADDRESS", dest="symbol_addresses", nargs="+",
+                    help="Show the label at, or nearest below, each address (in hex).")
 
 parser.add_argument("--revision", action="store_true", dest="revision",
                     help="Display the revision code of the debug interface.")
@@ -691,11 +1143,10 @@ parser.add_argument("--binary", metavar="BINARY FILE", dest="binary_file",
 parser.add_argument("--run-m68k-bin", metavar="BINARY FILE", dest="run_m68k_bin",
 					help="Send a binary file to a A2560's RAM for execution. The binary must start with initial stack and reset address.")
 
-parser.add_argument("--copy", metavar="COPY FILE", dest="copy_file",
-                    help="Copy a file to F256jr SDCARD.")
+parser.add_argument("--copy", metavar="COPY FILE", dest="copy_file", nargs="+",
+                    help="Copy files to F256jr SDCARD. Each may be a file, a directory, or @manifest listing files.")
 
 parser.add_argument("--address", metavar="ADDRESS", dest="address",
-                    default=config.address(),
                     help="Provide the starting address of the memory block to use in flashing memory.")
 
 parser.add_argument("--upload", metavar="HEX FILE", dest="hex_file",
@@ -738,124 +1189,116 @@ parser.add_argument("--type", metavar="TEXT", dest="keyboard_text",
 parser.add_argument("--scancodes", metavar="BYTE", dest="keyboard_scan_codes", nargs="+",
                     help="Inject raw hexadecimal PS/2 Set-2 bytes into the K2/JR2 keyboard FIFO.")
 
-parser.add_argument("--quiet", action="store_true", dest="quiet",
-                    help="Suppress some printed messages.")
+parser.add_argument("--pipeline", metavar="DEPTH", dest="pipeline_depth", type=int,
+                    help="Keep up to DEPTH write requests in flight on the debug port while uploading.")
 
-options = parser.parse_args()
+parser.add_argument("--delta", action="store_true", dest="delta",
+                    help="Only upload the parts of an image that changed since it was last uploaded to this port and target.")
 
-try:
-    if options.quiet:
-        quiet_mode = True
-        
-    if options.list_ports:
-        list_serial_ports()
+parser.add_argument("--verify", action="store_true", dest="verify",
+                    help="Read back what was uploaded or flashed and check that it matches.")
 
-    elif options.port != "":
-        if options.target_machine:
-            config.set_target(options.target_machine)
-        else:
-            config.set_target("unknown")
+parser.add_argument("--skip-unchanged", action="store_true", dest="skip_unchanged",
+                    help="With --flash-sector or --flash-bulk, skip sectors that already hold the data to be flashed.")
 
-        if options.boot_source:
-            source = options.boot_source.lower()
-            set_boot_source(options.port, source)
-            
-        elif options.stop:
-            stop_cpu(options.port)
-            print("Stopping the CPU...")
+parser.add_argument("--calibrate", action="store_true", dest="calibrate",
+                    help="Measure the fastest chunk size and pipeline depth for the port, using RAM at --address as scratch space.")
 
-        elif options.start:
-            start_cpu(options.port)
-            print("Starting the CPU...")
+parser.add_argument("--no-calibration", action="store_true", dest="no_calibration",
+                    help="Ignore the chunk size and pipeline depth saved by --calibrate for the port.")
 
-        elif options.keyboard_keys:
-            try:
-                snapshots = []
-                for key_name in options.keyboard_keys:
-                    snapshots.extend(keyboard.encode_optical_key(key_name))
-            except ValueError as error:
-                parser.error(str(error))
-            inject_keyboard_snapshots(options.port, snapshots)
-
-        elif options.keyboard_text is not None:
-            try:
-                snapshots = keyboard.encode_optical_text(options.keyboard_text)
-            except ValueError as error:
-                parser.error(str(error))
-            inject_keyboard_snapshots(options.port, snapshots)
+parser.add_argument("--stats", action="store_true", dest="stats",
+                    help="Print the counts, sizes, and latencies of the debug port requests when done.")
 
-        elif options.keyboard_scan_codes:
-            try:
-                scan_codes = parse_scan_codes(options.keyboard_scan_codes)
-            except ValueError as error:
-                parser.error(str(error))
-            inject_keyboard_scan_codes(options.port, scan_codes)
+parser.add_argument("--trace", metavar="JSON FILE", dest="trace_file",
+                    help="Save the statistics and a trace of every debug port request to a JSON file.")
 
-        elif options.copy_file:
-            copy_file(options.port, options.copy_file)
-                
-        elif options.hex_file:
-            send(options.port, options.hex_file)
-
-        elif options.pgz_file:
-            send_pgz(options.port, options.pgz_file)
+parser.add_argument("--quiet", action="store_true", dest="quiet",
+                    help="Suppress some printed messages.")
 
-        elif options.pgx_file:
-            send_pgx(options.port, options.pgx_file)
+parser.add_argument("--yes", action="store_true", dest="assume_yes",
+                    help="Answer yes to any confirmation questions (for unattended flashing).")
 
-        elif options.wdc_file:
-            send_wdc(options.port, options.wdc_file)
+options = None
 
-        elif options.srec_file:
-            send_srec(options.port, options.srec_file)
+def main(argv=None):
+    """Run FoenixMgr with the command line arguments in argv (or sys.argv)."""
+    global options, quiet_mode, skip_unchanged, assume_yes, verify_mode, dump_format
+    global port_stats, delta_mode, config
 
-        elif options.deref_name and options.label_file:
-            address = dereference(options.port, options.label_file, options.deref_name)
-            get(options.port, address, options.count)
+    # Load the configuration file...
+    config = foenix_config.load()
+    parser.set_defaults(port=config.port(), label_file=config.label_file(), address=config.address())
+    options = parser.parse_args(argv)
 
-        elif options.lookup_name and options.label_file:
-            address = lookup(options.label_file, options.lookup_name)
-            get(options.port, address, options.count)
+    try:
+        if options.quiet:
+            quiet_mode = True
 
-        elif options.dump_address:
-            get(options.port, options.dump_address, options.count)
+        if options.skip_unchanged:
+            skip_unchanged = True
 
-        elif options.revision:
-            rev = revision(options.port)
-            print(rev)
+        if options.assume_yes:
+            assume_yes = True
 
-        elif options.address and options.binary_file:
-            upload_binary(options.port, options.binary_file, options.address)
+        if options.verify:
+            verify_mode = True
 
-        elif options.address and options.run_m68k_bin:
-            run_m68k_bin(options.port, options.run_m68k_bin, options.address)
+        dump_format = options.dump_format
 
-        elif options.address and options.flash_file:
-            if options.flash_sector:
-                # If sector number provided, program just that sector
-                program_flash_sector(options.port, options.flash_file, options.flash_sector)
-            else:
-                # Otherwise, program the entire flash memory
-                program_flash(options.port, options.flash_file, options.address)
+        if options.stats or options.trace_file:
+            port_stats = stats.PortStatistics(trace=options.trace_file is not None)
 
-        elif options.tcp_host_port:
-            tcp_bridge(options.tcp_host_port, options.port)
+        if options.delta:
+            delta_mode = True
+        
+        if options.list_ports:
+            list_serial_ports()
 
-        elif options.bulk_file:
-            if options.erase_flash:
-                # Erase all of flash before writing the bulk files
-                program_flash_bulk(options.port, options.bulk_file, True)
+        elif options.ports or options.port != "":
+            if options.target_machine:
+                config.set_target(options.target_machine)
             else:
-                # Erase each sector individually before writing the sector
-                # Erase only those sectors to be written
-                program_flash_bulk(options.port, options.bulk_file, False)
-            
-        elif options.erase_flash:
-            erase_flash(options.port)
-            
+                config.set_target("unknown")
+
+            ports = options.ports if options.ports else [options.port]
+            if len(ports) == 1:
+                # Use the chunk size and pipeline depth found by --calibrate for this port, if any
+                tuning = None if options.no_calibration or options.calibrate else calibration.load(ports[0], config.target())
+                if tuning is not None:
+                    config.set_chunk_size(tuning["chunk_size"])
+                    config.set_pipeline_depth(tuning["pipeline_depth"])
+                    if not quiet_mode:
+                        print("Using chunk size {} and pipeline depth {} from --calibrate (--no-calibration to ignore them)".format(
+                            tuning["chunk_size"], tuning["pipeline_depth"]))
+
+            if options.pipeline_depth:
+                config.set_pipeline_depth(options.pipeline_depth)
+
+            if len(ports) == 1:
+                run_command(ports[0])
+            elif options.tcp_host_port or options.calibrate:
+                parser.error("--tcp-bridge and --calibrate work with a single port")
+            else:
+                run_on_boards(ports)
         else:
             parser.print_help()
-    else:
-        parser.print_help()
-finally:
-    print
+    finally:
+        if board_results is not None and port_stats is not None:
+            # Each board had its own statistics
+            for board in board_results:
+                if options.stats:
+                    print("{}:".format(board.port))
+                    print(board.stats.summary())
+            if options.trace_file:
+                with open(options.trace_file, "w") as f:
+                    json.dump({board.port: board.stats.as_dict() for board in board_results}, f, indent=2)
+
+        elif port_stats is not None:
+            if options.stats:
+                print(port_stats.summary())
+            if options.trace_file:
+                port_stats.write_json(options.trace_file)
+
+if __name__ == "__main__":
+    main()
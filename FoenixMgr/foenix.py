@@ -1,9 +1,23 @@
 from abc import ABC, abstractmethod
+import asyncio
+from collections import deque
 import serial
 import socket
 import time
 import constants
 import foenix_config
+import packet
+
+ERASED_BLOCK = bytes([0xFF]) * 0x1000     # What a 4KB block of flash reads as once it is erased
+READ_BUFFER_SIZE = 0x10000                # Most bytes to take from the connection in one read
+RESYNC_QUIET_TIME = 0.05                  # Seconds without input that show a failed response has been drained
+RETRYABLE_COMMANDS = (constants.CMD_READ_MEM, constants.CMD_WRITE_MEM)     # Commands that are safe to send twice
+
+class ResponseError(Exception):
+    """
+    A response that did not arrive in time, stopped short, or failed its LRC check.
+    Memory reads and writes that fail this way can be sent again.
+    """
 
 class FoenixDebugPort:
     """Provide the connection to a C256 Foenix debug port."""
@@ -15,15 +29,27 @@ class FoenixDebugPort:
     status0 = 0
     status1 = 0
 
+    def __init__(self, profile=None):
+        self.profile = profile or foenix_config.DEFAULT_PROFILE      # TargetProfile of the machine being talked to
+        self.stats = None               # PortStatistics to record each request in, if any
+        self.in_flight = deque()        # (command, address, bytes sent, time sent) awaiting a response
+        # Address where the flash can be read, to poll it while it is busy (None to wait a fixed time instead)
+        self.flash_base = self.profile.flash_base if self.profile.flash_poll else None
+        self.reader = None              # ResponseReader for the current connection
+
+        if self.profile.aligned_writes:
+            # For 68040 and 68060 machines, every write must be 32-bit aligned on both the start and finish
+            self.write_block = self.write_block32
+
     def open(self, port):
         """Open a connection to the C256 Foenix."""
 
         if ':' in port:
             # A pretty weak test, looking for something like '192.168.1.114:2560'
-            self.connection = SocketFoenixConnection()
+            self.connection = SocketFoenixConnection(self.profile)
         else:
             # Otherwise assume it's a serial connection
-            self.connection = SerialFoenixConnection()
+            self.connection = SerialFoenixConnection(self.profile)
 
         self.connection.open(port=port)
 
@@ -37,7 +63,6 @@ class FoenixDebugPort:
     def enter_debug(self):
         """Send the command to make the C256 Foenix enter its debug mode."""
 
-        config = foenix_config.FoenixConfig()
         self.transfer(constants.CMD_ENTER_DEBUG, 0, 0, 0)
 
     def exit_debug(self):
@@ -65,9 +90,9 @@ class FoenixDebugPort:
         # NOTE: This code is written assuming that sectors are 8KB blocks, but that the
         #       physical hardware is erasing two consecutive 4KB blocks
         self.transfer(constants.CMD_ERASE_SECTOR, (sector * 2) << 16, 0, 0)
-        time.sleep(constants.DELAY_ERASE_SECTOR)
+        self.wait_flash(sector * 0x2000, constants.DELAY_ERASE_SECTOR, ERASED_BLOCK)
         self.transfer(constants.CMD_ERASE_SECTOR, (sector * 2 + 1) << 16, 0, 0)
-        time.sleep(constants.DELAY_ERASE_SECTOR)
+        self.wait_flash(sector * 0x2000 + 0x1000, constants.DELAY_ERASE_SECTOR, ERASED_BLOCK)
 
     def get_revision(self):
         """Gets the revision code for the debug interface.
@@ -75,12 +100,65 @@ class FoenixDebugPort:
         self.transfer(constants.CMD_REVISION, 0, 0, 0)
         return self.status1
 
-    def program_flash_sector(self, sector):
-        """Send the command to have the Foenix reprogram an 8KB sector of its flash memory."""
+    def program_flash_sector(self, sector, data=None, source=0, wait=True):
+        """Send the command to have the Foenix reprogram an 8KB sector of its flash memory.
+        If the data being programmed is given, the flash is polled until it holds it,
+        rather than waiting for the worst case time.
+
+        'source' is the RAM address to program from, for firmware that accepts one in the
+        low 16 bits of the address. If 'wait' is false, this returns as soon as the command
+        is accepted, and wait_program_sector must be called before the next flash command."""
+
+        # NOTE: Without a source address, the data to program must already be loaded into 0x00000 - 0x02000 in system RAM.
+        self.transfer(constants.CMD_PROGRAM_SECTOR, ((sector * 2) << 16) | source, 0, 0)
+        if wait:
+            self.wait_program_sector(sector, data)
+
+    def wait_program_sector(self, sector, data=None, started=None):
+        """Wait for the programming of a flash sector to finish (see program_flash_sector).
+        'started' is the time.perf_counter() value when the command was sent, if it was a while ago."""
+        self.wait_flash(sector * 0x2000, constants.DELAY_PROGRAM_SECTOR, None if data is None else data[:0x2000], started)
+
+    def wait_flash(self, offset, delay, expected=None, started=None):
+        """Wait for the flash to finish an erase or program operation at 'offset' within the flash.
+
+        If the flash can be read through the debug port and the contents it should end up
+        with are known, it is polled until it holds them. Otherwise this waits until the
+        worst case 'delay' (in seconds) has passed since 'started' (or from now).
+
+        Polling never waits past the worst case either: if the flash does not hold the expected
+        contents by then (say, because the sector was not erased first), this carries on just as
+        it would have without polling, and any difference is left for --verify to find.
+        """
+        if started is None:
+            remaining = delay
+        else:
+            remaining = max(0, started + delay - time.perf_counter())
+
+        if self.flash_base is None or expected is None:
+            time.sleep(remaining)
+        else:
+            self.wait_flash_ready(self.flash_base + offset, expected, remaining)
+
+    def wait_flash_ready(self, address, expected, timeout):
+        """Poll the flash at 'address' until it reads back as 'expected'.
+
+        While the flash chip is busy it returns status bits instead of data, so the contents
+        only match once the erase or program operation is complete. The delay between polls
+        backs off from FLASH_POLL_MIN to FLASH_POLL_MAX. Returns the time spent waiting, or
+        None if the flash still does not hold 'expected' after 'timeout' seconds.
+        """
+        start = time.perf_counter()
+        delay = constants.FLASH_POLL_MIN
+        while self.read_block(address, len(expected)) != expected:
+            elapsed = time.perf_counter() - start
+            if elapsed >= timeout:
+                return None
 
-        # NOTE: this command assumes the data to program is already loaded into 0x00000 - 0x02000 in system RAM.
-        self.transfer(constants.CMD_PROGRAM_SECTOR, (sector * 2) << 16, 0, 0)
-        time.sleep(constants.DELAY_PROGRAM_SECTOR)
+            time.sleep(min(delay, timeout - elapsed))
+            delay = min(delay * 2, constants.FLASH_POLL_MAX)
+
+        return time.perf_counter() - start
 
     def program_flash(self, address):
         """Send the command to have the C256 Foenix reprogram its flash memory.
@@ -114,18 +192,11 @@ class FoenixDebugPort:
             self.transfer(constants.CMD_WRITE_MEM, adjusted_address, block, 0)
 
     def write_block(self, address, data):
-        """Write a block of data to the specified starting address in the C256's memory."""
-
-        # If the CPU is a 680x0 (32-bit architecture) make sure the data is a multiple of 4 bytes
-        # Data on these CPUs must be loaded as 32-bit words, so save them in memory blocks
-        # These memory blocks will be output to the debug port just before closing it
-        config = foenix_config.FoenixConfig()
-        if config.cpu_is_m68k_32():
-            # For 68040 and 68060 machines, make sure the data is 32-aligned on both the start and finish
-            self.write_block32(address, data)
-        else:
-            # Otherwise, just send the data
-            self.transfer(constants.CMD_WRITE_MEM, address, data, 0)
+        """Write a block of data to the specified starting address in the C256's memory.
+
+        On machines needing aligned writes, this is replaced by write_block32 when the port is made.
+        """
+        self.transfer(constants.CMD_WRITE_MEM, address, data, 0)
 
     def read_block(self, address, length):
         """Read a block of data of the specified length from the specified starting address of the C256's memory."""
@@ -155,86 +226,340 @@ class FoenixDebugPort:
         elif source == constants.BOOT_SRC_FLASH:
             return self.transfer(constants.CMD_BOOT_FLASH, 0, 0, 0)
 
-    def readbyte(self):
-        b = self.connection.read(1)
-        return b[0]
+    def response_reader(self):
+        """Return the ResponseReader for the connection, making a new one if the connection has changed."""
+        if self.reader is None or self.reader.connection is not self.connection:
+            self.reader = ResponseReader(self.connection, self.profile.response_timeout)
+        return self.reader
 
     def transfer(self, command, address, data, read_length):
-        """Send a command to the C256 Foenix"""
+        """Send a command to the C256 Foenix and return its response.
 
-        self.status0 = 0
-        self.status1 = 0
-        lrc = 0
-        length = 0
-        if data == 0:
-            length = read_length
-        else:
-            length = len(data)
+        If the response to a memory read or write is lost or corrupted, the request is
+        sent again, up to the number of retries in the profile. Other commands may take
+        the Foenix a while (erasing the flash, for one), so their responses are waited
+        for as long as the profile's timeout allows.
+        """
+
+        wait = None if command in RETRYABLE_COMMANDS else self.profile.timeout
+        attempts = 0
+        while True:
+            self.send_request(command, address, data, read_length)
+            try:
+                response = self.read_response(read_length, wait)
+                if command in RETRYABLE_COMMANDS:
+                    self.check_status()
+                return response
+            except ResponseError:
+                if command not in RETRYABLE_COMMANDS or attempts >= self.profile.retries:
+                    raise
+                attempts += 1
+                self.prepare_retry(command)
+
+    def prepare_retry(self, command):
+        """
+        Get ready to send requests again after a bad or missing response to 'command'.
+        Whatever remains of the responses in flight can no longer be matched to their
+        requests, so it is drained from the connection and thrown away.
+        """
+        self.resync()
+        if self.stats is not None:
+            self.stats.record_retry(command)
+
+    def resync(self):
+        """Throw away any responses still to come, so that the next response read is to the next request sent."""
+        self.response_reader().buffer.clear()
+        self.connection.discard_input(RESYNC_QUIET_TIME)
+        self.in_flight.clear()
+
+    def send_request(self, command, address, data, read_length):
+        """Send a request packet to the Foenix without waiting for its response."""
 
         # if command == 0x80:
         #     print('Switching to debug mode')
         # elif command == 0x81:
         #     print('Resetting')
         # else:
-        #     print('Writing data of length {:X} to {:X}'.format(length, address))
-
-        command_bytes = command.to_bytes(1, byteorder='big')
-        address_bytes = address.to_bytes(3, byteorder='big')
-        length_bytes = length.to_bytes(2, byteorder='big')
-
-        header = bytearray(7)
-        header[0] = constants.REQUEST_SYNC_BYTE
-        header[1] = command_bytes[0]
-        header[2] = address_bytes[0]
-        header[3] = address_bytes[1]
-        header[4] = address_bytes[2]
-        header[5] = length_bytes[0]
-        header[6] = length_bytes[1]
-
-        for i in range(0, 6):
-            lrc = lrc ^ header[i]
-
-        if data:
-            for i in range(0, length):
-                lrc = lrc ^ data[i]
-
-        lrc_bytes = lrc.to_bytes(1, byteorder='big')
-
-        if data:
-            packet = header + data + lrc_bytes
-            written = self.connection.write(packet)
-            if written != len(packet):
-                raise Exception("Could not write packet correctly.")
-        else:
-            packet = header + lrc_bytes
-            written = self.connection.write(packet)
-            if written != len(packet):
-                raise Exception("Could not write packet correctly.")
-        # print('Sent [{}]'.format(packet.hex()))
+        #     print('Writing data of length {:X} to {:X}'.format(len(data) if data else read_length, address))
 
-        c = 0
-        while c != constants.RESPONSE_SYNC_BYTE:
-            c = self.readbyte()
+        request = packet.encode_request(command, address, data, read_length)
+        self.send_packet(command, address, request)
+        # print('Sent [{}]'.format(request.hex()))
+        return request
 
-        read_bytes = 0
+    def send_packet(self, command, address, request):
+        """Send a request packet already built by send_request (to send it again, for example)."""
 
-        if c == constants.RESPONSE_SYNC_BYTE:
+        written = self.connection.write(request)
+        if written != len(request):
+            raise Exception("Could not write packet correctly.")
+        if self.stats is not None:
+            self.in_flight.append((command, address, len(request), time.perf_counter()))
+
+    def check_status(self):
+        """Raise a ResponseError if the last response to a memory read or write reported an error.
+
+        The first status byte is zero when a memory request succeeds. (The second carries
+        information for some commands, such as the revision, so it is not checked.)
+        """
+        if self.status0 != 0:
+            raise ResponseError("The debug port reported an error (status 0x{:02X}, 0x{:02X}).".format(self.status0, self.status1))
+
+    def read_response(self, read_length, wait=None):
+        """Wait for the response to the oldest outstanding request and return any data read.
+
+        If 'wait' is given, the response is waited for up to that many seconds, rather than
+        being treated as lost once the connection times out.
+        """
 
-            # print('Got 0xAA')
+        self.status0 = 0
+        self.status1 = 0
+        read_started_at = time.perf_counter() if self.stats is not None else 0
+        reader = self.response_reader()
+        reads_before = reader.reads
 
-            self.status0 = self.readbyte()
-            self.status1 = self.readbyte()
+        reader.sync(wait)
+        sync_at = time.perf_counter() if self.stats is not None else 0
 
-            if read_length > 0:
-                read_bytes = self.connection.read(read_length)
+        # The status bytes, any data and the LRC all come in one piece
+        response = reader.take(read_length + 3)
+        self.status0 = response[0]
+        self.status1 = response[1]
+        read_bytes = response[2:-1] if read_length > 0 else 0
+        read_lrc = response[-1]
 
-            read_lrc = self.readbyte()
+        if self.profile.check_lrc:
+            expected_lrc = packet.lrc(response[2:-1], self.status0 ^ self.status1)
+            if read_lrc != expected_lrc:
+                raise ResponseError("Bad LRC in response: expected 0x{:02X}, got 0x{:02X}.".format(expected_lrc, read_lrc))
 
         # print("Status: 0x{:02X}, 0x{:02X}".format(self.status0, self.status1))
 
+        if self.stats is not None and self.in_flight:
+            (command, address, bytes_sent, sent_at) = self.in_flight.popleft()
+            bytes_received = 4 + (len(read_bytes) if read_length > 0 else 0)
+            self.stats.record(command, address, bytes_sent, bytes_received,
+                              sent_at, sync_at, time.perf_counter(), read_started_at,
+                              reads=reader.reads - reads_before)
+
         return read_bytes
 
 
+class PipelinedWriter:
+    """Write blocks to the Foenix's memory with several requests in flight at once.
+
+    The debug port answers requests strictly in the order they were sent, so
+    the writer can queue up to 'depth' write packets before it has to stop and
+    collect the oldest response. A depth of 1 behaves exactly like write_block.
+
+    If a response is lost or corrupted, the writes still in flight (the failed one
+    and those after it) are sent again, rather than failing the whole upload.
+    """
+
+    def __init__(self, port, depth):
+        self.port = port
+        self.depth = max(1, depth)
+        self.pending = deque()
+        self.results = []
+        self.aligned_writes = port.profile.aligned_writes
+
+    def write_block(self, address, data):
+        """Queue a block of data to be written to the specified starting address."""
+
+        if self.aligned_writes and (address % 4 != 0 or len(data) % 4 != 0):
+            # Unaligned blocks need a read-modify-write, so nothing may be in flight
+            self.flush()
+            self.port.write_block(address, data)
+            self.results.append((address, len(data), self.port.status0, self.port.status1))
+            return
+
+        # Keep the packet itself, as the caller may reuse its buffer before the write is acknowledged
+        request = self.port.send_request(constants.CMD_WRITE_MEM, address, data, 0)
+        self.pending.append((address, len(data), request))
+        if len(self.pending) >= self.depth:
+            self.drain_one()
+
+    def drain_one(self):
+        """Collect the response to the oldest outstanding write."""
+
+        (address, length, _) = self.pending[0]
+        attempts = 0
+        while True:
+            try:
+                self.port.read_response(0)
+                self.port.check_status()
+                break
+            except ResponseError as e:
+                if attempts < self.port.profile.retries:
+                    attempts += 1
+                    self.resend()
+                    continue
+                self.fail(e)
+            except Exception as e:
+                self.fail(e)
+
+        self.pending.popleft()
+        self.results.append((address, length, self.port.status0, self.port.status1))
+
+    def resend(self):
+        """Send every outstanding write again, after a response was lost or corrupted."""
+
+        self.port.prepare_retry(constants.CMD_WRITE_MEM)
+        for (address, _, request) in self.pending:
+            self.port.send_packet(constants.CMD_WRITE_MEM, address, request)
+
+    def fail(self, e):
+        """Abandon the outstanding writes after the oldest one failed."""
+
+        (address, length, _) = self.pending.popleft()
+        outstanding = len(self.pending)
+        self.pending.clear()
+        raise Exception("Write of {} bytes to 0x{:06X} failed ({} more requests abandoned): {}"
+            .format(length, address, outstanding, e)) from e
+
+    def flush(self):
+        """Wait for every outstanding write to be acknowledged.
+
+        Returns the list of (address, length, status0, status1) for each request written so far.
+        """
+
+        while self.pending:
+            self.drain_one()
+        return self.results
+
+
+class PipelinedReader:
+    """Read blocks of the Foenix's memory with several requests in flight at once.
+
+    This is the read counterpart of PipelinedWriter: up to 'depth' read requests
+    are sent before the oldest response is collected, so the link stays busy
+    while the data already received is being processed. As with the writer, the
+    reads in flight are sent again if a response is lost or corrupted.
+    """
+
+    def __init__(self, port, depth):
+        self.port = port
+        self.depth = max(1, depth)
+        self.pending = deque()
+
+    def read_blocks(self, blocks):
+        """Yield (address, data) for each (address, length) in 'blocks', in the same order.
+
+        The generator must be run to the end, or the responses still in flight will be
+        left unread on the link.
+        """
+
+        for (address, length) in blocks:
+            self.port.send_request(constants.CMD_READ_MEM, address, 0, length)
+            self.pending.append((address, length))
+            if len(self.pending) >= self.depth:
+                yield self.receive_one()
+
+        while self.pending:
+            yield self.receive_one()
+
+    def read_range(self, address, length, chunk_size=constants.READ_MAX_LENGTH):
+        """Yield (address, data) for 'length' bytes of memory from 'address', read in chunk_size requests.
+        Ranges of any size can be read this way, since each request is kept within the length field's limit."""
+
+        return self.read_blocks((start, min(chunk_size, address + length - start))
+                                for start in range(address, address + length, chunk_size))
+
+    def receive_one(self):
+        """Collect the response to the oldest outstanding read."""
+
+        (address, length) = self.pending[0]
+        attempts = 0
+        while True:
+            try:
+                data = self.port.read_response(length)
+                self.port.check_status()
+                if len(data) != length:
+                    raise Exception("only {} bytes arrived".format(len(data)))
+                break
+            except ResponseError as e:
+                if attempts < self.port.profile.retries:
+                    attempts += 1
+                    self.resend()
+                    continue
+                self.fail(e)
+            except Exception as e:
+                self.fail(e)
+
+        self.pending.popleft()
+        return (address, data)
+
+    def resend(self):
+        """Send every outstanding read again, after a response was lost or corrupted."""
+
+        self.port.prepare_retry(constants.CMD_READ_MEM)
+        for (address, length) in self.pending:
+            self.port.send_request(constants.CMD_READ_MEM, address, 0, length)
+
+    def fail(self, e):
+        """Abandon the outstanding reads after the oldest one failed."""
+
+        (address, length) = self.pending.popleft()
+        outstanding = len(self.pending)
+        self.pending.clear()
+        raise Exception("Read of {} bytes from 0x{:06X} failed ({} more requests abandoned): {}"
+            .format(length, address, outstanding, e)) from e
+
+class ResponseReader:
+    """Frame responses out of the bytes arriving on a FoenixConnection.
+
+    Rather than reading the sync byte, the status bytes, the data and the LRC one
+    call at a time, the reader takes everything the connection already has waiting
+    into a buffer and cuts each response out of it. Bytes belonging to the responses
+    that follow (when requests are pipelined) stay in the buffer for next time.
+    """
+
+    def __init__(self, connection, timeout=None):
+        self.connection = connection
+        self.timeout = timeout      # Seconds to hunt for a sync byte through line noise before giving up
+        self.buffer = bytearray()
+        self.reads = 0              # Number of reads made on the connection so far
+
+    def fill(self, num_bytes):
+        """Read until the buffer holds num_bytes, returning false if the connection runs dry first."""
+        while len(self.buffer) < num_bytes:
+            needed = num_bytes - len(self.buffer)
+            data = self.connection.read_available(needed, max(needed, READ_BUFFER_SIZE))
+            self.reads += 1
+            if not data:
+                return False
+            self.buffer += data
+        return True
+
+    def sync(self, wait=None):
+        """Discard everything up to and including the next response sync byte.
+
+        This gives up when the connection times out with nothing more arriving, unless
+        'wait' is given, in which case the connection is read until 'wait' seconds have passed.
+        """
+        timeout = self.timeout if wait is None else wait
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+        while True:
+            position = self.buffer.find(constants.RESPONSE_SYNC_BYTE)
+            if position >= 0:
+                del self.buffer[:position + 1]
+                return
+            self.buffer.clear()
+            if deadline is not None and time.perf_counter() > deadline:
+                raise ResponseError("No response from the debug port within {} seconds.".format(timeout))
+            if not self.fill(1) and wait is None:
+                raise ResponseError("Timed out waiting for a response from the debug port.")
+
+    def take(self, num_bytes):
+        """Remove and return the next num_bytes of the response."""
+        if not self.fill(num_bytes):
+            raise ResponseError("Timed out waiting for a response from the debug port: only {} of {} bytes arrived."
+                .format(len(self.buffer), num_bytes))
+        data = bytes(self.buffer[:num_bytes])
+        del self.buffer[:num_bytes]
+        return data
+
+
 class FoenixConnection(ABC):
     @abstractmethod
     def open(self, port):
@@ -252,6 +577,17 @@ class FoenixConnection(ABC):
     def read(self, num_bytes):
         pass
 
+    def read_available(self, num_bytes, limit):
+        """
+        Return up to limit bytes: the num_bytes needed (or fewer, if that is all that arrives) and
+        any more that are already waiting. An empty result means the connection timed out or closed.
+        """
+        return self.read(num_bytes)
+
+    def discard_input(self, quiet_time):
+        """Throw away anything arriving on the connection until it has been quiet for quiet_time seconds."""
+        pass
+
     @abstractmethod
     def write(self, data):
         pass
@@ -261,15 +597,17 @@ class SerialFoenixConnection(FoenixConnection):
     """ Connects to Foenix via local serial port """
     serial_port = None
 
+    def __init__(self, profile=None):
+        self.profile = profile or foenix_config.DEFAULT_PROFILE
+
     def open(self, port):
-        config = foenix_config.FoenixConfig()
         self.serial_port = serial.Serial(port=port,
-            baudrate=config.data_rate(),
+            baudrate=self.profile.data_rate,
             bytesize=serial.EIGHTBITS,
             parity=serial.PARITY_NONE,
             stopbits=serial.STOPBITS_ONE,
-            timeout=config.timeout(),
-            write_timeout=config.timeout())
+            timeout=self.profile.response_timeout,
+            write_timeout=self.profile.timeout)
         try:
             self.serial_port.open()
         except:
@@ -285,6 +623,18 @@ class SerialFoenixConnection(FoenixConnection):
     def read(self, num_bytes):
         return self.serial_port.read(num_bytes)
 
+    def read_available(self, num_bytes, limit):
+        return self.serial_port.read(max(num_bytes, min(limit, self.serial_port.in_waiting)))
+
+    def discard_input(self, quiet_time):
+        timeout = self.serial_port.timeout
+        self.serial_port.timeout = quiet_time
+        try:
+            while self.serial_port.read(READ_BUFFER_SIZE):
+                pass
+        finally:
+            self.serial_port.timeout = timeout
+
     def log_send(self, data):
         """Display the message sent to the debug port in a truncated format."""
         data_s = data.hex()
@@ -299,16 +649,24 @@ class SerialFoenixConnection(FoenixConnection):
 
 class SocketFoenixConnection(FoenixConnection):
     """ Connects to Foenix via TCP-serial bridge """
-    tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # AF_INET = IPv4, SOCK_STREAM = TCP socket
+    tcp_socket = None
     _is_open = False
 
+    def __init__(self, profile=None):
+        self.profile = profile or foenix_config.DEFAULT_PROFILE
+
     def open(self, port):
         parsed_host_port = port.split(":")
         tcp_host = parsed_host_port[0]
-        tcp_port = int(parsed_host_port[1]) if len(parsed_host_port) > 0 else 2560
+        tcp_port = int(parsed_host_port[1]) if len(parsed_host_port) > 1 and parsed_host_port[1] else 2560
 
+        # Each connection needs its own socket, so that several boards can be driven at once
+        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # AF_INET = IPv4, SOCK_STREAM = TCP socket
         print("Connecting to remote Foenix at {}:{}...".format(tcp_host, tcp_port), end="")
         self.tcp_socket.connect(tuple([tcp_host, tcp_port]))
+        # TCP loses nothing, but requests may queue at the bridge behind other clients',
+        # so a slow response is waited for rather than treated as lost and sent again
+        self.tcp_socket.settimeout(self.profile.timeout)
         print(" ✓")
         self._is_open = True
 
@@ -320,9 +678,33 @@ class SocketFoenixConnection(FoenixConnection):
         return self._is_open
 
     def read(self, num_bytes):
-        bytes_read = self.tcp_socket.recv(num_bytes)
+        # A socket hands back whatever has arrived so far, but callers expect all of the
+        # bytes asked for (as from a serial port), so keep reading until they are here
+        bytes_read = self.read_available(num_bytes, num_bytes)
+        while bytes_read and len(bytes_read) < num_bytes:
+            more = self.read_available(num_bytes - len(bytes_read), num_bytes - len(bytes_read))
+            if not more:
+                break
+            bytes_read += more
         return bytes_read
 
+    def read_available(self, num_bytes, limit):
+        # recv returns as soon as anything has arrived; the caller reads again if that is not enough
+        try:
+            return self.tcp_socket.recv(limit)
+        except socket.timeout:
+            return b''
+
+    def discard_input(self, quiet_time):
+        self.tcp_socket.settimeout(quiet_time)
+        try:
+            while self.tcp_socket.recv(READ_BUFFER_SIZE):
+                pass
+        except socket.timeout:
+            pass
+        finally:
+            self.tcp_socket.settimeout(self.profile.timeout)
+
     def write(self, data):
         self.tcp_socket.sendall(data)
         return len(data)
@@ -334,85 +716,231 @@ class FoenixTcpBridge():
         self.tcp_host = tcp_host
         self.tcp_port = tcp_port
         self.serial_port = serial_port
+        self.serial_connection = None
+        self.opened_before = False
+        self.reopen_count = 0
+        self.clients = deque()
+        self.session_owner = None
+        self.work_available = None
+
+    def open_serial(self):
+        """ Return the serial connection to the Foenix, opening it if it is not already open """
+        if self.serial_connection is None:
+            self.serial_connection = serial.Serial(port=self.serial_port, baudrate=6000000, timeout=60,
+                                                   write_timeout=60)
+            if self.opened_before:
+                self.reopen_count += 1
+                print("Reopened serial port {} ({} reopens so far)".format(self.serial_port, self.reopen_count))
+            self.opened_before = True
+        return self.serial_connection
+
+    def close_serial(self):
+        """ Close the serial connection, so the next request will reopen it """
+        if self.serial_connection is not None:
+            try:
+                self.serial_connection.close()
+            except serial.SerialException:
+                pass
+            self.serial_connection = None
+
+    def relay(self, request, command, data_length):
+        """ Pass a complete request along to the Foenix and return its complete response.
+
+        The serial port stays open between requests. If it fails, it is reopened and a
+        memory read or write is tried once more before giving up. Other commands (flash
+        erasing and programming, leaving debug mode...) are not safe to send twice, so
+        they fail, and the port is reopened for the next request.
+        """
+        try:
+            return self.relay_once(request, command, data_length)
+        except serial.SerialException as e:
+            print("Serial port error: {}".format(e))
+            self.close_serial()
+            if command not in RETRYABLE_COMMANDS:
+                raise
+            return self.relay_once(request, command, data_length)
+
+    def relay_once(self, request, command, data_length):
+        serial_connection = self.open_serial()
+        try:
+            num_bytes_written = serial_connection.write(request)
 
-    def recv_bytes(self, num_bytes):
-        total_bytes_received = self.tcp_connection.recv(num_bytes)
-        if not total_bytes_received: # Client hung up
-            return total_bytes_received
-        total_bytes_received = bytearray(total_bytes_received)
-        while len(total_bytes_received) < num_bytes:
-            bytes_received = self.tcp_connection.recv(num_bytes - len(total_bytes_received))
-            total_bytes_received.extend(bytes_received)
+            # Probably should handle this situation a bit more elegantly
+            if num_bytes_written != len(request):
+                raise serial.SerialException("Serial port error - tried writing {} bytes, was only able to write {}"
+                    .format(len(request), num_bytes_written))
 
-        return bytes(total_bytes_received)
+            # Read until we get the start of the response
+            response_sync_byte = serial_connection.read(1)
 
+            # The two status bytes, the data payload (if requested) and the LRC byte follow in one read
+            remaining = 3
+            if command == constants.CMD_READ_MEM:
+                remaining += data_length
+            response_rest = serial_connection.read(remaining)
+
+        except (serial.SerialException, OSError) as e:
+            self.close_serial()
+            raise serial.SerialException(str(e)) from e
+
+        # Construct the response
+        response = bytearray(response_sync_byte)
+        response.extend(response_rest)
+        return response
 
     def listen(self):
         """ Listen for TCP socket connections and relay messages to Foenix via serial port """
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.close_serial()
+
+    async def serve(self):
+        """ Accept any number of clients and feed their requests through to the serial port """
+        self.work_available = asyncio.Event()
+        server = await asyncio.start_server(self.handle_client, self.tcp_host, self.tcp_port, reuse_address=True)
+        print("Listening for connections to {} on port {}".format(self.tcp_host, self.tcp_port))
+        async with server:
+            worker = asyncio.create_task(self.process_requests())
+            try:
+                await server.serve_forever()
+            finally:
+                worker.cancel()
+
+    async def read_request(self, reader):
+        """ Read one complete request from a client, or return None if the client hung up """
+        try:
+            # First get the 7-byte request header
+            header = await reader.readexactly(7)
+
+            command = header[1]
+
+            # The data size comes from bytes 5 and 6 in the header
+            data_length = int.from_bytes(header[5:7], byteorder="big")
+
+            request = bytearray(header)
+
+            # The data payload only comes along with a write command
+            if command == constants.CMD_WRITE_MEM:
+                request.extend(await reader.readexactly(data_length))
+
+            # The LRC byte is required and denotes the end of the request
+            request.extend(await reader.readexactly(1))
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+        return (request, command, data_length)
+
+    async def handle_client(self, reader, writer):
+        """ Queue up a client's requests as they arrive, while its responses are returned in order """
+        peer = writer.get_extra_info("peername")
+        client = BridgeClient("{}:{}".format(peer[0], peer[1]) if peer else "unknown")
+        print("Received connection from {}".format(client.name))
+        self.clients.append(client)
+
+        responses = asyncio.Queue()
+        responder = asyncio.create_task(self.send_responses(client, responses, writer))
+        try:
+            while not responder.done():
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                future = asyncio.get_running_loop().create_future()
+                client.requests.append(request + (future,))
+                self.work_available.set()
+                await responses.put(future)
+        finally:
+            await responses.put(None)
+            await responder
+            self.drop_client(client)
+            writer.close()
+            print("Connection from {} closed".format(client.name))
+
+    async def send_responses(self, client, responses, writer):
+        """ Return each response to the client in the order its requests were sent """
+        try:
+            while True:
+                future = await responses.get()
+                if future is None:
+                    return
+                response = await future
+                writer.write(response)
+                await writer.drain()
+        except Exception as e:
+            print("Could not relay request from {}, dropping connection: {}".format(client.name, e))
+            for request in client.requests:
+                request[-1].cancel()
+            client.requests.clear()
+            writer.close()
+
+    def drop_client(self, client):
+        """ Forget a client that has disconnected, releasing its session if it held one """
+        for request in client.requests:
+            request[-1].cancel()
+        client.requests.clear()
+        self.clients.remove(client)
+        if self.session_owner is client:
+            print("Session held by {} released".format(client.name))
+            self.session_owner = None
+            self.work_available.set()
+
+    def next_client(self):
+        """ Pick the client whose request goes next.
+
+        While a client holds the session, only its requests are relayed. Otherwise clients
+        take turns, one request each, so a long upload cannot starve anyone else.
+        """
+        if self.session_owner is not None:
+            return self.session_owner if self.session_owner.requests else None
+
+        for _ in range(len(self.clients)):
+            client = self.clients[0]
+            self.clients.rotate(-1)
+            if client.requests:
+                return client
+
+        return None
+
+    async def process_requests(self):
+        """ Relay queued requests to the Foenix, one at a time """
+        loop = asyncio.get_running_loop()
         while True:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s: # AF_INET=IPv4, SOCK_STREAM=TCP
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                s.bind((self.tcp_host, self.tcp_port))
-                s.listen()
-                print("Listening for connections to {} on port {}".format(self.tcp_host, self.tcp_port))
-
-                self.tcp_connection, tcp_address = s.accept()
-                print("Received connection from {}".format(tcp_address[0]))
-                with self.tcp_connection:
-                    while True:
-                        # First get the 7-byte request header
-                        header = self.recv_bytes(7)
-                        if not header:
-                            print("Connection from {} closed".format(tcp_address[0]))
-                            break
-
-                        command = header[1]
-
-                        # The data size comes from bytes 5 and 6 in the header
-                        data_length = int.from_bytes(header[5:7], byteorder="big")
-
-                        # The data payload only comes along with a write command
-                        data = None
-                        if command == constants.CMD_WRITE_MEM:
-                            data = self.recv_bytes(data_length)
-
-                        # The LRC byte is required and denotes the end of the request
-                        request_lrc_byte = self.recv_bytes(1)
-
-                        # TCP request is now complete, time to pass along to Foenix
-                        bytes_to_write = bytearray(header)
-                        if data is not None:
-                            bytes_to_write.extend(data)
-                        bytes_to_write.extend(request_lrc_byte)
-
-                        with serial.Serial(port=self.serial_port, baudrate=6000000, timeout=60,
-                                        write_timeout=60) as serial_connection:
-                            num_bytes_written = serial_connection.write(bytes_to_write)
-
-                            # Probably should handle this situation a bit more elegantly
-                            if num_bytes_written != len(bytes_to_write):
-                                raise Exception("Serial port error - tried writing {} bytes, was only able to write {}"
-                                    .format(len(bytes_to_write), num_bytes_written))
-
-                            # Read until we get the start of the response
-                            response_sync_byte = serial_connection.read(1)
-
-                            # Next two bytes are the status bytes
-                            response_status_bytes = serial_connection.read(2)
-
-                            # Read the data payload if requested
-                            response_data = None
-                            if command == constants.CMD_READ_MEM and data_length > 0:
-                                response_data = serial_connection.read(data_length)
-
-                            response_lrc_byte = serial_connection.read(1)
-
-                            # Construct the response
-                            response = bytearray(response_sync_byte)
-                            response.extend(response_status_bytes)
-                            if response_data is not None:
-                                response.extend(response_data)
-                            response.extend(response_lrc_byte)
-
-                            # Return the response back to the TCP client
-                            self.tcp_connection.sendall(response)
+            client = self.next_client()
+            if client is None:
+                self.work_available.clear()
+                await self.work_available.wait()
+                continue
+
+            (request, command, data_length, future) = client.requests.popleft()
+            if future.cancelled():
+                continue
+
+            try:
+                # The serial port blocks, so keep it off the event loop
+                response = await loop.run_in_executor(None, self.relay, request, command, data_length)
+            except Exception as e:
+                # Fail this client's request, but keep relaying everyone else's
+                if not future.cancelled():
+                    future.set_exception(e)
+                continue
+
+            # Entering debug mode holds the session until the client exits debug mode
+            if command == constants.CMD_ENTER_DEBUG:
+                if self.session_owner is not client:
+                    print("Session held by {}".format(client.name))
+                self.session_owner = client
+            elif command == constants.CMD_EXIT_DEBUG:
+                if self.session_owner is client:
+                    print("Session held by {} released".format(client.name))
+                    self.session_owner = None
+
+            if not future.cancelled():
+                future.set_result(response)
+
+
+class BridgeClient():
+    """ A client of the TCP bridge and the requests it has waiting for the serial port """
+    def __init__(self, name):
+        self.name = name
+        self.requests = deque()
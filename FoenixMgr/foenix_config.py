@@ -1,36 +1,89 @@
 import configparser
 import os
 import sys
+from collections import namedtuple
+import constants
+
+class TargetProfile(namedtuple("TargetProfile", [
+        "target", "cpu", "is_680X0", "aligned_writes", "chunk_size", "pipeline_depth",
+        "data_rate", "timeout", "response_timeout", "retries", "check_lrc",
+        "flash_page_size", "flash_sector_size", "flash_base", "flash_poll", "flash_double_buffer", "ram_size"])):
+    """
+    The settings that the debug port and the file loaders need, resolved once from the configuration
+    and the target machine. Being a tuple, a profile cannot change once it is made.
+    FoenixMgr's commands read these settings from the profile of the port they use, not from
+    the FoenixConfig, so a port and the code driving it always agree.
+
+    aligned_writes is true if writes to memory must be whole 32-bit words on 32-bit boundaries.
+    """
+    __slots__ = ()
+
+_loaded = None
+
+def load():
+    """Return the FoenixConfig for this process, reading the foenixmgr.ini files the first time only.
+
+    Only the command line tools should call this: everything else is given a TargetProfile.
+    """
+    global _loaded
+    if _loaded is None:
+        _loaded = FoenixConfig()
+    return _loaded
 
 class FoenixConfig:
     """Configuration data for the FoenixMgr. Exposes the foenix.ini file."""
 
-    def __init__(self):
-        """Attempt to read and process the config file."""
-        config = configparser.ConfigParser()
-        config.read(['foenixmgr.ini', os.path.expandvars('$FOENIXMGR/foenixmgr.ini'), os.path.expanduser('~/foenixmgr.ini')])
+    def __init__(self, settings=None):
+        """Attempt to read and process the config file.
 
-        if not config.items("DEFAULT"):
-            print("No proper foenixmgr.ini file found.")
-            sys.exit(1)
-
-        self._flash_size = int(config['DEFAULT'].get('flash_size', '524288'), 10)
-        self._port = config['DEFAULT'].get('port', 'COM3')
-        self._chunk_size = int(config['DEFAULT'].get('chunk_size', '4096'), 10)
-        self._data_rate = int(config['DEFAULT'].get('data_rate', '6000000'), 10)
-        self._label_file = config['DEFAULT'].get('labels', 'basic8')
-        self._address = config['DEFAULT'].get('address', '380000')
-        self._timeout = int(config['DEFAULT'].get('timeout', '60'), 10)
-        self._cpu = config['DEFAULT'].get('cpu', '65c02')
+        If 'settings' is given (a mapping of option names to values, as in the file), it is used
+        instead, and no file is read. Options it leaves out take their default values.
+        """
+        if settings is None:
+            config = configparser.ConfigParser()
+            config.read(['foenixmgr.ini', os.path.expandvars('$FOENIXMGR/foenixmgr.ini'), os.path.expanduser('~/foenixmgr.ini')])
+
+            if not config.items("DEFAULT"):
+                print("No proper foenixmgr.ini file found.")
+                sys.exit(1)
+
+            settings = config['DEFAULT']
+
+        self._flash_size = int(settings.get('flash_size', '524288'), 10)
+        self._port = settings.get('port', 'COM3')
+        self._chunk_size = int(settings.get('chunk_size', '4096'), 10)
+        self._data_rate = int(settings.get('data_rate', '6000000'), 10)
+        self._label_file = settings.get('labels', 'basic8')
+        self._address = settings.get('address', '380000')
+        self._timeout = int(settings.get('timeout', '60'), 10)
+        self._response_timeout = float(settings['response_timeout']) if 'response_timeout' in settings else None
+        self._retries = int(settings.get('retries', '3'), 10)
+        self._check_lrc = settings.get('check_lrc', '0') != '0'
+        self._cpu = settings.get('cpu', '65c02')
+        self._pipeline_depth = int(settings.get('pipeline_depth', '1'), 10)
+        self._target = "unknown"
+        self._flash_page_size = 0
+        self._flash_sector_size = 0
+        self._ram_size = 8
+        self._flash_base = None
+        self._live_access = False
+        self._copy_delay = float(settings.get('copy_delay', '2'))
+        self._flash_poll = settings.get('flash_poll', '0') != '0'
+        self._flash_double_buffer = settings.get('flash_double_buffer', '0') != '0'
+        self._profile = None
 
     def set_target(self, machine_name):
         """Set the name of the target machine."""
 
         machine_name = machine_name.lower()
+        self._target = machine_name
+        self._profile = None
 
         self._flash_page_size = 0
         self._flash_sector_size = 0
         self._ram_size = 8
+        self._flash_base = None
+        self._live_access = False
 
         if machine_name == "fnx1591":
             self._flash_page_size = 8
@@ -41,6 +94,19 @@ class FoenixConfig:
             self._flash_page_size = 8
             self._ram_size = 8
             self._flash_sector_size = 8
+            self._flash_base = 0x080000
+            self._live_access = True
+
+    def target(self):
+        """Return the name of the target machine."""
+        return self._target
+
+    def live_access(self):
+        """
+        Return true if the debug port can read and write memory while the CPU is running,
+        without entering debug mode (which resets the machine when it is left).
+        """
+        return self._live_access
 
     def flash_size(self):
         """Return the required size of the flash binary file in bytes."""
@@ -50,6 +116,16 @@ class FoenixConfig:
         """Return the size of the data packet that gets sent over the debug port."""
         return self._chunk_size
 
+    def set_pipeline_depth(self, depth):
+        """Override the number of write requests that may be in flight at once."""
+        self._pipeline_depth = depth
+        self._profile = None
+
+    def set_chunk_size(self, chunk_size):
+        """Override the size of the data packet sent over the debug port."""
+        self._chunk_size = chunk_size
+        self._profile = None
+
     def data_rate(self):
         """Return the data rate in bits per second that the serial port should use."""
         return self._data_rate
@@ -70,6 +146,13 @@ class FoenixConfig:
         """Return the timeout to allow for serial communications (in seconds)."""
         return self._timeout
 
+    def copy_delay(self):
+        """
+        Return the time (in seconds) to let the firmware save one copied file before sending the next.
+        This is a guess: nothing reports when the firmware has finished writing the file to the card.
+        """
+        return self._copy_delay
+
     def cpu(self):
         """Return the CPU of the target machine."""
         return self._cpu
@@ -106,4 +189,36 @@ class FoenixConfig:
         """
         Number of bytes in RAM that can be used to write to flash (in KB)
         """
-        return self._ram_size
\ No newline at end of file
+        return self._ram_size
+
+    def profile(self):
+        """Return the TargetProfile for the current settings (made again only after they are changed)."""
+        if self._profile is None:
+            response_timeout = self._response_timeout
+            if response_timeout is None:
+                # Allow for the requests in flight ahead of a response to cross the link (at 10 bits a byte)
+                link_time = self._pipeline_depth * (self._chunk_size + 8) * 10 / self._data_rate
+                response_timeout = constants.RESPONSE_TIMEOUT + link_time
+
+            self._profile = TargetProfile(
+                target=self._target,
+                cpu=self._cpu,
+                is_680X0=self.cpu_is_680X0(),
+                aligned_writes=self.cpu_is_m68k_32(),
+                chunk_size=self._chunk_size,
+                pipeline_depth=self._pipeline_depth,
+                data_rate=self._data_rate,
+                timeout=self._timeout,
+                response_timeout=response_timeout,
+                retries=self._retries,
+                check_lrc=self._check_lrc,
+                flash_page_size=self._flash_page_size,
+                flash_sector_size=self._flash_sector_size,
+                flash_base=self._flash_base,
+                flash_poll=self._flash_poll and self._flash_base is not None,
+                flash_double_buffer=self._flash_double_buffer,
+                ram_size=self._ram_size)
+        return self._profile
+
+# The profile of an unknown target with every setting at its default, for ports and loaders made without one
+DEFAULT_PROFILE = FoenixConfig({}).profile()
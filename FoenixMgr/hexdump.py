@@ -0,0 +1,106 @@
+#
+# Formatting of memory dumps
+#
+# Each line is built with whole-slice operations (bytes.hex for the hex digits and
+# bytes.translate with a precomputed table for the text column) rather than one
+# byte at a time, and the lines are written to the console in large batches.
+#
+# Formats:
+#   hex     FoenixMgr's own layout:   000010: 0001020304050607 08090A0B0C0D0E0F ................
+#   xxd     the layout of 'xxd':      00000010: 0001 0203 0405 0607 0809 0a0b 0c0d 0e0f  ................
+#   c       a C array definition
+#   raw     the bytes themselves
+#
+
+FORMATS = ["hex", "xxd", "c", "raw"]
+LINE_BYTES = 16                 # Bytes per line of the hex and xxd formats
+C_LINE_BYTES = 12               # Bytes per line of a C array
+LINES_PER_WRITE = 4096          # Lines gathered up before each write to the console
+
+# Printable ASCII characters stand for themselves in the text column; everything else is a '.'
+TEXT_TABLE = bytes(b if 0x20 <= b < 0x7F else ord('.') for b in range(256))
+
+C_BYTES = ["0x{:02X}".format(b) for b in range(256)]
+
+HIGHLIGHT_ON = "\x1b[7m"        # ANSI reverse video, for changed bytes
+HIGHLIGHT_OFF = "\x1b[0m"
+
+def text_column(data):
+    """Return the printable text for a line of data."""
+    return bytes(data).translate(TEXT_TABLE).decode('ascii')
+
+def hex_lines(base_address, data):
+    """Yield the lines of a dump in FoenixMgr's own format."""
+    if len(data) == 0:
+        yield " \n"            # What the original display() printed for no data
+    for offset in range(0, len(data), LINE_BYTES):
+        line = bytes(data[offset:offset + LINE_BYTES])
+        digits = line[0:8].hex().upper()
+        if len(line) > 8:
+            digits += " " + line[8:].hex().upper()
+        yield "{:06X}: {} {}\n".format(base_address + offset, digits, text_column(line))
+
+def xxd_lines(base_address, data):
+    """Yield the lines of a dump in the same format as 'xxd' (with 'xxd -o' style addresses)."""
+    for offset in range(0, len(data), LINE_BYTES):
+        line = bytes(data[offset:offset + LINE_BYTES])
+        digits = line.hex(' ', -2)
+        yield "{:08x}: {:<39}  {}\n".format(base_address + offset, digits, text_column(line))
+
+def c_lines(base_address, data):
+    """Yield the lines of a C array definition holding the data."""
+    yield "/* {} bytes read from 0x{:06X} */\n".format(len(data), base_address)
+    yield "const unsigned char data_{:06X}[{}] = {{\n".format(base_address, len(data))
+    for offset in range(0, len(data), C_LINE_BYTES):
+        line = data[offset:offset + C_LINE_BYTES]
+        yield "    {},\n".format(", ".join([C_BYTES[b] for b in line]))
+    yield "};\n"
+
+def changed_lines(base_address, old, new, highlight=False):
+    """Yield a line, in the hex format, for each line of 'new' that differs from 'old'.
+
+    If 'highlight' is true, the whole line is shown with the changed bytes in reverse
+    video (for a terminal). Otherwise only the changed bytes are shown, with '..' in
+    place of the bytes that are the same.
+    """
+    for offset in range(0, len(new), LINE_BYTES):
+        line = bytes(new[offset:offset + LINE_BYTES])
+        before = bytes(old[offset:offset + LINE_BYTES])
+        if line == before:
+            continue
+
+        digits = ""
+        for (i, b) in enumerate(line):
+            if i == 8:
+                digits += " "
+            if i < len(before) and before[i] == b:
+                digits += "{:02X}".format(b) if highlight else ".."
+            elif highlight:
+                digits += "{}{:02X}{}".format(HIGHLIGHT_ON, b, HIGHLIGHT_OFF)
+            else:
+                digits += "{:02X}".format(b)
+        yield "{:06X}: {} {}\n".format(base_address + offset, digits, text_column(line))
+
+def write(out, base_address, data, format="hex"):
+    """Write a dump of data, read from base_address, to the text stream 'out' in the given format."""
+    if format == "raw":
+        out.flush()
+        out.buffer.write(data)
+        out.buffer.flush()
+        return
+
+    if format == "xxd":
+        lines = xxd_lines(base_address, data)
+    elif format == "c":
+        lines = c_lines(base_address, data)
+    else:
+        lines = hex_lines(base_address, data)
+
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= LINES_PER_WRITE:
+            out.write("".join(batch))
+            batch = []
+    out.write("".join(batch))
+    out.flush()
@@ -0,0 +1,146 @@
+#
+# Sparse image of the Foenix's memory
+#
+# The loaders hand over their data one record at a time, which for Intel HEX and
+# SREC files is only 16 to 32 bytes. Collecting the records here first lets the
+# upload send as few, and as large, packets as possible.
+#
+
+import os
+import re
+from bisect import bisect_right
+
+CACHE_DIRECTORY = os.path.expanduser('~/.foenixmgr/images')
+CACHE_SIGNATURE = b'FNXI'
+
+class SparseImage:
+    """A collection of non-overlapping, non-adjacent blocks of memory contents."""
+
+    def __init__(self):
+        self.starts = []            # Start address of each segment, in ascending order
+        self.segments = []          # Contents of each segment (bytearray)
+
+    def add(self, address, data):
+        """Add a block of data at the given address.
+
+        Where the block overlaps data already in the image, the new data wins, just
+        as it would if the blocks were written to memory in order. Blocks that touch
+        or overlap are merged into a single segment.
+        """
+        if len(data) == 0:
+            return
+
+        # Most files are laid out in ascending order, so check for a simple append first
+        if self.starts and self.starts[-1] + len(self.segments[-1]) == address:
+            self.segments[-1].extend(data)
+            return
+
+        end = address + len(data)
+
+        # Find the first segment that ends at or after the start of the new block...
+        first = bisect_right(self.starts, address) - 1
+        if first < 0 or self.starts[first] + len(self.segments[first]) < address:
+            first += 1
+
+        # ... and the last segment that starts at or before its end
+        last = bisect_right(self.starts, end) - 1
+
+        if first > last:
+            # Nothing to merge with
+            self.starts.insert(first, address)
+            self.segments.insert(first, bytearray(data))
+            return
+
+        merged_start = min(self.starts[first], address)
+        merged_end = max(end, self.starts[last] + len(self.segments[last]))
+        merged = bytearray(merged_end - merged_start)
+        for i in range(first, last + 1):
+            offset = self.starts[i] - merged_start
+            merged[offset:offset + len(self.segments[i])] = self.segments[i]
+        merged[address - merged_start:end - merged_start] = data
+
+        self.starts[first:last + 1] = [merged_start]
+        self.segments[first:last + 1] = [merged]
+
+    def ranges(self):
+        """Return a list of (address, length) for each segment in the image."""
+        return [(start, len(segment)) for (start, segment) in zip(self.starts, self.segments)]
+
+    def size(self):
+        """Return the total number of bytes in the image."""
+        return sum(len(segment) for segment in self.segments)
+
+    def chunks(self, chunk_size):
+        """Yield (address, data) for the whole image in blocks of at most chunk_size bytes.
+
+        The data are memoryviews into the image, so no bytes are copied.
+        """
+        for (start, segment) in zip(self.starts, self.segments):
+            view = memoryview(segment)
+            for offset in range(0, len(segment), chunk_size):
+                yield (start + offset, view[offset:offset + chunk_size])
+
+    def read(self, address, length):
+        """Return the 'length' bytes at 'address', or None if the image does not hold all of them."""
+        i = bisect_right(self.starts, address) - 1
+        if i < 0:
+            return None
+        offset = address - self.starts[i]
+        if offset + length > len(self.segments[i]):
+            return None
+        return memoryview(self.segments[i])[offset:offset + length]
+
+    def save(self, filename):
+        """Write the image to a file.
+
+        The file is the signature 'FNXI', then for each segment a 4-byte address and
+        4-byte length (little endian) followed by the segment's contents.
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "wb") as f:
+            f.write(CACHE_SIGNATURE)
+            for (start, segment) in zip(self.starts, self.segments):
+                f.write(start.to_bytes(4, byteorder='little'))
+                f.write(len(segment).to_bytes(4, byteorder='little'))
+                f.write(segment)
+
+    def load(self, filename):
+        """Replace the contents of the image with those saved to a file.
+        Returns False if the file does not exist or is not a saved image."""
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+        except OSError:
+            return False
+
+        if data[0:4] != CACHE_SIGNATURE:
+            return False
+
+        starts = []
+        segments = []
+        offset = 4
+        while offset < len(data):
+            start = int.from_bytes(data[offset:offset+4], byteorder='little')
+            length = int.from_bytes(data[offset+4:offset+8], byteorder='little')
+            offset += 8
+            if offset + length > len(data):
+                return False
+            starts.append(start)
+            segments.append(bytearray(data[offset:offset+length]))
+            offset += length
+
+        self.starts = starts
+        self.segments = segments
+        return True
+
+def cache_filename(port, target):
+    """Return the file recording the last image uploaded to the target on a port."""
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', "{}-{}".format(port, target))
+    return os.path.join(CACHE_DIRECTORY, name + ".img")
+
+def forget(filename):
+    """Remove a cached image, since the target's memory no longer matches it."""
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
@@ -0,0 +1,98 @@
+#
+# Index of the symbols in a label file
+#
+# Label files are lines of the form 'NAME = $ADDRESS'. Kernel builds produce
+# tens of thousands of them, so rather than scanning the file for each lookup,
+# it is parsed once into a dictionary (for lookups by name) and a sorted list of
+# addresses (for finding the symbol nearest an address). The parsed labels are
+# cached in ~/.foenixmgr/labels, and reused for as long as the label file's
+# modification time and size are unchanged.
+#
+
+import json
+import os
+import re
+from bisect import bisect_right
+from fnmatch import fnmatchcase
+
+CACHE_DIRECTORY = os.path.expanduser('~/.foenixmgr/labels')
+LABEL_PATTERN = re.compile(r'^(\S+)[ \t]*\=[ \t]*\$(\S+)', re.MULTILINE)
+
+class LabelIndex:
+    """The labels of one label file, by name and by address."""
+
+    def __init__(self, labels):
+        self.labels = labels        # Address of each label, by name
+        self.addresses = None       # Every label's address in ascending order, built on first use...
+        self.names = None           # ... and the label at each of those addresses
+
+    def lookup(self, name):
+        """Return the address of the label, or None if there is no such label."""
+        return self.labels.get(name)
+
+    def search(self, pattern):
+        """Return the (name, address) of every label matching the pattern, in order of address.
+
+        The pattern may use the shell wildcards '*', '?' and '[...]' (so 'VKY_*' finds
+        every label starting with 'VKY_'). A pattern without wildcards matches just that label.
+        """
+        if not any(c in pattern for c in "*?["):
+            address = self.lookup(pattern)
+            return [] if address is None else [(pattern, address)]
+
+        matches = [(name, address) for (name, address) in self.labels.items() if fnmatchcase(name, pattern)]
+        return sorted(matches, key=lambda match: (match[1], match[0]))
+
+    def nearest(self, address):
+        """Return the (name, address) of the label at or closest below the address, or None if there is none."""
+        if self.addresses is None:
+            by_address = sorted((a, name) for (name, a) in self.labels.items())
+            self.addresses = [a for (a, _) in by_address]
+            self.names = [name for (_, name) in by_address]
+
+        i = bisect_right(self.addresses, address) - 1
+        if i < 0:
+            return None
+        return (self.names[i], self.addresses[i])
+
+def parse(text):
+    """Return the dictionary of label addresses defined in the text of a label file.
+    If a label is defined more than once, the first definition is used."""
+    labels = {}
+    for (name, value) in LABEL_PATTERN.findall(text):
+        try:
+            labels.setdefault(name, int(value, 16))
+        except ValueError:
+            pass
+    return labels
+
+def cache_filename(filename):
+    """Return the file caching the parsed labels of a label file."""
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', os.path.abspath(filename))
+    return os.path.join(CACHE_DIRECTORY, name + ".json")
+
+def load(filename):
+    """Return the LabelIndex for a label file, parsing it only if it has changed since it was cached."""
+    status = os.stat(filename)
+    key = [status.st_mtime_ns, status.st_size]
+    cache_file = cache_filename(filename)
+
+    try:
+        with open(cache_file, "r") as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return LabelIndex(cached["labels"])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    with open(filename, "r") as f:
+        labels = parse(f.read())
+
+    try:
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        with open(cache_file, "w") as f:
+            json.dump({"key": key, "labels": labels}, f)
+    except OSError:
+        pass
+
+    return LabelIndex(labels)
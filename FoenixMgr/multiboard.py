@@ -0,0 +1,119 @@
+#
+# Running the same job on several boards at once
+#
+# Each board gets its own thread, and so its own FoenixDebugPort, so the total
+# time is that of the slowest board rather than the sum of all of them. While
+# the job runs, everything a thread prints is prefixed with its board's port,
+# so the progress of every board can be followed in one console.
+#
+
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_local = threading.local()
+
+class Board:
+    """The state and outcome of running a job on one board."""
+
+    def __init__(self, port, stats=None):
+        self.port = port
+        self.stats = stats          # PortStatistics for this board's debug port, if collecting them
+        self.ok = False
+        self.error = None
+        self.elapsed = 0.0
+
+def current_board():
+    """Return the Board whose job is running in this thread, or None outside of a job."""
+    return getattr(_local, "board", None)
+
+class PrefixedOutput:
+    """A stand-in for sys.stdout that labels each line written by a job with its board's port.
+
+    Lines are collected per thread and written whole, so the output of two boards
+    is never mixed within a line. Threads not running a job write straight through.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        board = current_board()
+        if board is None:
+            return self.stream.write(text)
+
+        pending = getattr(_local, "pending", "") + text
+        lines = pending.split("\n")
+        _local.pending = lines.pop()
+        if lines:
+            with self.lock:
+                for line in lines:
+                    self.stream.write("[{}] {}\n".format(board.port, line))
+                self.stream.flush()
+        return len(text)
+
+    def finish_line(self):
+        """Write out whatever partial line this thread has left."""
+        if getattr(_local, "pending", ""):
+            self.write("\n")
+
+    def flush(self):
+        # A partial line is only flushed when asked for, as with a prompt for input
+        board = current_board()
+        pending = getattr(_local, "pending", "")
+        if board is not None and pending:
+            _local.pending = ""
+            with self.lock:
+                self.stream.write("[{}] {}".format(board.port, pending))
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def run_on_boards(ports, job, stats_factory=None):
+    """Call job(port) for every port at the same time, and return the list of Boards.
+
+    A board fails if its job raises an exception or calls sys.exit. If stats_factory
+    is given, each board gets its own statistics object from it.
+    """
+    boards = [Board(port, stats_factory() if stats_factory else None) for port in ports]
+
+    def run(board):
+        _local.board = board
+        started = time.perf_counter()
+        try:
+            job(board.port)
+            board.ok = True
+        except SystemExit as e:
+            board.error = "exited with status {}".format(e.code)
+        except Exception as e:
+            board.error = str(e) or type(e).__name__
+            print("Failed: {}".format(board.error))
+        finally:
+            board.elapsed = time.perf_counter() - started
+            if isinstance(sys.stdout, PrefixedOutput):
+                sys.stdout.finish_line()
+            _local.board = None
+
+    original_stdout = sys.stdout
+    sys.stdout = PrefixedOutput(original_stdout)
+    try:
+        with ThreadPoolExecutor(max_workers=len(boards)) as executor:
+            list(executor.map(run, boards))
+    finally:
+        sys.stdout = original_stdout
+
+    return boards
+
+def report(boards, elapsed):
+    """Return a printable pass/fail table for the boards."""
+    width = max(len(board.port) for board in boards)
+    lines = []
+    for board in boards:
+        outcome = "PASS" if board.ok else "FAIL: {}".format(board.error)
+        lines.append("{:<{}}  {:>8.1f} s  {}".format(board.port, width, board.elapsed, outcome))
+    passed = sum(1 for board in boards if board.ok)
+    lines.append("{} of {} boards passed in {:.1f} s".format(passed, len(boards), elapsed))
+    return "\n".join(lines)
@@ -0,0 +1,56 @@
+#
+# Encoding of debug port request packets
+#
+# A request is a 7 byte header, an optional data payload, and an LRC byte:
+#
+#       0x55 CMD A2 A1 A0 L1 L0 d...d LRC
+#
+# The LRC is the XOR of the first six header bytes and every payload byte.
+# (The low byte of the length is not included; the firmware expects it that way.)
+#
+
+import constants
+
+HEADER_SIZE = 7
+
+def lrc(data, value=0):
+    """Return 'value' XORed with every byte of 'data'.
+
+    Rather than visiting each byte in Python, the data is turned into one large
+    integer and folded in half until a single byte is left, so all of the work
+    happens inside the interpreter's big integer routines.
+    """
+    width = len(data)
+    if width == 0:
+        return value
+
+    folded = int.from_bytes(data, byteorder='little')
+    while width > 1:
+        half = (width + 1) // 2
+        folded = (folded & ((1 << (half * 8)) - 1)) ^ (folded >> (half * 8))
+        width = half
+
+    return value ^ folded
+
+def encode_request(command, address, data, read_length):
+    """Build the request packet for a command in a single preallocated buffer.
+
+    If 'data' is supplied (anything other than 0), it is the payload to send and
+    sets the length field; otherwise the length field is 'read_length'.
+    """
+    if data == 0:
+        data = b''
+        length = read_length
+    else:
+        length = len(data)
+
+    packet = bytearray(HEADER_SIZE + len(data) + 1)
+    packet[0] = constants.REQUEST_SYNC_BYTE
+    packet[1] = command
+    packet[2:5] = address.to_bytes(3, byteorder='big')
+    packet[5:7] = length.to_bytes(2, byteorder='big')
+
+    view = memoryview(packet)
+    view[HEADER_SIZE:HEADER_SIZE + len(data)] = data
+    packet[-1] = lrc(data, lrc(view[0:HEADER_SIZE - 1]))
+    return packet
@@ -13,12 +13,11 @@ class PGXBinFile:
     data = 0
     handler = 0
     cpu = ""
-    config = 0
+    profile = None
 
-    def __init__(self):
-        self.config = foenix_config.FoenixConfig()
-        self.cpu = self.config.cpu()
-        pass
+    def __init__(self, profile=None):
+        self.profile = profile or foenix_config.DEFAULT_PROFILE
+        self.cpu = self.profile.cpu
 
     def open(self, filename):
         self.data = Path(filename).read_bytes()
@@ -53,7 +52,7 @@ class PGXBinFile:
                 print("PGX is built for the wrong CPU.")
                 sys.exit(1)
         elif pgx_cpu == constants.PGX_CPU_680X0:
-            if not self.config.cpu_is_680X0():
+            if not self.profile.is_680X0:
                 print("PGX is built for the wrong CPU.")
                 sys.exit(1)
         else:
@@ -95,6 +94,6 @@ class PGXBinFile:
             # Pass 0 to the kernel args extlen, at least until someone implements argument passing
             self.handler(0x00FA, bytes([0x00, 0x00]))
 
-        elif self.config.cpu_is_680X0():
+        elif self.profile.is_680X0:
             # Point the reset vector to our reset routine
             self.handler(0x00000004, bytes([(addr>>24) & 0xff, (addr>>16) & 0xff, (addr>>8) & 0xff, addr & 0xff]))
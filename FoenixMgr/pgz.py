@@ -11,12 +11,12 @@ class PGZBinFile:
     data = 0
     handler = 0
     cpu = ""
-    config = 0
+    profile = None
 
-    def __init__(self):
-        self.config = foenix_config.FoenixConfig()
-        self.cpu = self.config.cpu()
-        pass
+    def __init__(self, profile=None):
+        self.profile = profile or foenix_config.DEFAULT_PROFILE
+        self.cpu = self.profile.cpu
+        self.chunk_size = self.profile.chunk_size
 
     def open(self, filename):
         self.data = Path(filename).read_bytes()
@@ -74,7 +74,7 @@ class PGZBinFile:
                     # Pass 0 to the kernel args extlen, at least until someone implements argument passing
                     self.handler(0x00FA, bytes([0x00, 0x00]))
               
-                elif self.config.cpu_is_680X0():
+                elif self.profile.is_680X0:
                     print("CPU m68k")
                     # Point the reset vector to our reset routine
                     print("Starting address {:x}".format(addr))
@@ -82,7 +82,7 @@ class PGZBinFile:
 
             elif addr > 0:
                 # JGA Support for large blocks
-                block_size = 1024
+                block_size = self.chunk_size
                 if len(block) > block_size:
                     #print("do block sizes =",block_size)
                     total_length = len(block)
@@ -0,0 +1,391 @@
+#
+# A software Foenix target for the debug port
+#
+# The simulator answers the same request packets as a real Foenix (see packet.py),
+# keeping a model of the machine's memory and flash, so that FoenixMgr can be
+# tested and benchmarked without hardware. It can be reached in three ways:
+#
+#   SimulatorConnection   in the same process, as a FoenixConnection
+#   serve_tcp             on a local TCP port, like a TCP bridge
+#   serve_pty             through a pseudo-terminal, like a USB serial port (Linux and macOS)
+#
+# The link can be given a per-request latency and a per-byte transfer time, so
+# that timings are realistic. Responses leave in order, each no sooner than the
+# latency after its request arrived, and the link carries one byte at a time, so
+# pipelined requests overlap their latencies just as they do on real hardware.
+#
+# usage: python FoenixMgr/simulator.py [--tcp HOST:PORT | --pty] [--latency MS] [--baud RATE]
+#
+
+import argparse
+import os
+import queue
+import socket
+import threading
+import time
+import constants
+import foenix
+import packet
+
+MEMORY_SIZE = 0x1000000         # The whole 24-bit address space
+FLASH_SIZE = 0x80000            # 512KB of flash
+FLASH_BASE = 0x080000           # Where the F256's flash can be read (None if it cannot be read)
+FLASH_BLOCK_SIZE = 0x1000       # Bytes erased by one ERASE_SECTOR command
+FLASH_SECTOR_SIZE = 0x2000      # Bytes programmed by one PROGRAM_SECTOR command
+
+STATUS_OK = 0x00
+STATUS_BAD_LRC = 0x01           # Status 0 when a request's LRC is wrong (a convention of the simulator)
+STATUS_UNKNOWN_COMMAND = 0x02   # Status 0 for a command the simulator does not know
+
+class FoenixSimulator:
+    """The model of a Foenix machine behind its debug port."""
+
+    def __init__(self, revision=0, flash_base=FLASH_BASE, flash_busy_time=0.0):
+        self.memory = bytearray(MEMORY_SIZE)
+        self.flash = bytearray([0xFF]) * FLASH_SIZE
+        self.flash_base = flash_base
+        self.flash_busy_time = flash_busy_time  # Seconds the flash stays busy after an erase or program
+        self.flash_busy_until = 0.0
+        self.flash_toggle = 0
+        self.revision = revision
+        self.debug_mode = False
+        self.cpu_running = True
+        self.boot_source = constants.BOOT_SRC_FLASH
+        self.resets = 0
+        self.lock = threading.Lock()
+        self.commands = {}          # Number of requests handled, by command
+
+    def handle(self, request):
+        """Carry out one complete request packet and return the complete response packet."""
+        command = request[1]
+        address = int.from_bytes(request[2:5], byteorder='big')
+        length = int.from_bytes(request[5:7], byteorder='big')
+        data = request[packet.HEADER_SIZE:-1]
+
+        status0 = STATUS_OK
+        status1 = 0
+        result = b''
+
+        with self.lock:
+            self.commands[command] = self.commands.get(command, 0) + 1
+
+            if packet.lrc(data, packet.lrc(request[0:packet.HEADER_SIZE - 1])) != request[-1]:
+                status0 = STATUS_BAD_LRC
+                if command == constants.CMD_READ_MEM:
+                    result = bytes(length)
+
+            elif command == constants.CMD_READ_MEM:
+                result = self.read(address, length)
+
+            elif command == constants.CMD_WRITE_MEM:
+                self.write(address, data)
+
+            elif command == constants.CMD_ERASE_FLASH:
+                self.flash[:] = bytes([0xFF]) * FLASH_SIZE
+                self.flash_busy()
+
+            elif command == constants.CMD_PROGRAM_FLASH:
+                self.program(0, self.memory[address:address + FLASH_SIZE])
+
+            elif command == constants.CMD_ERASE_SECTOR:
+                offset = (address >> 16) * FLASH_BLOCK_SIZE
+                self.flash[offset:offset + FLASH_BLOCK_SIZE] = bytes([0xFF]) * FLASH_BLOCK_SIZE
+                self.flash_busy()
+
+            elif command == constants.CMD_PROGRAM_SECTOR:
+                # The low 16 bits give the RAM to program from (see flash_double_buffer)
+                source = address & 0xFFFF
+                self.program((address >> 16) * FLASH_BLOCK_SIZE, self.memory[source:source + FLASH_SECTOR_SIZE])
+
+            elif command == constants.CMD_STOP_CPU:
+                self.cpu_running = False
+
+            elif command == constants.CMD_START_CPU:
+                self.cpu_running = True
+
+            elif command == constants.CMD_ENTER_DEBUG:
+                self.debug_mode = True
+
+            elif command == constants.CMD_EXIT_DEBUG:
+                # Leaving debug mode resets the machine
+                self.debug_mode = False
+                self.resets += 1
+
+            elif command == constants.CMD_BOOT_RAM:
+                self.boot_source = constants.BOOT_SRC_RAM
+
+            elif command == constants.CMD_BOOT_FLASH:
+                self.boot_source = constants.BOOT_SRC_FLASH
+
+            elif command == constants.CMD_REVISION:
+                status1 = self.revision
+
+            else:
+                status0 = STATUS_UNKNOWN_COMMAND
+
+        return encode_response(status0, status1, result)
+
+    def read(self, address, length):
+        """Return the contents of memory, with the flash showing through its window if it has one."""
+        data = bytearray(self.memory[address:address + length])
+        data.extend(bytes(length - len(data)))      # Reads past the end of the address space come back as 0
+
+        if self.flash_base is not None:
+            start = max(address, self.flash_base)
+            end = min(address + length, self.flash_base + FLASH_SIZE)
+            if start < end:
+                if time.perf_counter() < self.flash_busy_until:
+                    # A busy flash chip answers with status bits, one of which toggles on each read
+                    self.flash_toggle ^= 0x40
+                    data[start - address:end - address] = bytes([self.flash_toggle]) * (end - start)
+                else:
+                    data[start - address:end - address] = self.flash[start - self.flash_base:end - self.flash_base]
+
+        return bytes(data)
+
+    def write(self, address, data):
+        """Store data in RAM. Writes to the flash's window, and past the end of memory, are dropped."""
+        data = data[:max(0, MEMORY_SIZE - address)]
+        if self.flash_base is not None and address < self.flash_base + FLASH_SIZE and address + len(data) > self.flash_base:
+            for offset in range(len(data)):
+                if not self.flash_base <= address + offset < self.flash_base + FLASH_SIZE:
+                    self.memory[address + offset] = data[offset]
+        else:
+            self.memory[address:address + len(data)] = data
+
+    def program(self, offset, data):
+        """Program data into the flash at offset. As with real flash, programming can only clear bits."""
+        data = bytes(data[:FLASH_SIZE - offset])
+        current = int.from_bytes(self.flash[offset:offset + len(data)], byteorder='big')
+        programmed = current & int.from_bytes(data, byteorder='big')
+        self.flash[offset:offset + len(data)] = programmed.to_bytes(len(data), byteorder='big')
+        self.flash_busy()
+
+    def flash_busy(self):
+        self.flash_busy_until = time.perf_counter() + self.flash_busy_time
+
+def encode_response(status0, status1, data=b''):
+    """Build a response packet. The LRC is the XOR of the status bytes and the data."""
+    response = bytearray([constants.RESPONSE_SYNC_BYTE, status0, status1])
+    response.extend(data)
+    response.append(packet.lrc(data, status0 ^ status1))
+    return bytes(response)
+
+class RequestParser:
+    """Split a stream of bytes from the host into complete request packets."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Add bytes from the host, and return the list of requests they complete."""
+        self.buffer.extend(data)
+        requests = []
+        while True:
+            # Skip anything before the start of a request
+            start = self.buffer.find(bytes([constants.REQUEST_SYNC_BYTE]))
+            if start < 0:
+                self.buffer.clear()
+                break
+            del self.buffer[:start]
+
+            if len(self.buffer) < packet.HEADER_SIZE:
+                break
+            size = packet.HEADER_SIZE + 1
+            if self.buffer[1] == constants.CMD_WRITE_MEM:
+                size += int.from_bytes(self.buffer[5:7], byteorder='big')
+            if len(self.buffer) < size:
+                break
+
+            requests.append(bytes(self.buffer[:size]))
+            del self.buffer[:size]
+        return requests
+
+class LinkTiming:
+    """When each response may leave, given the link's latency and speed.
+
+    'latency' is the time (in seconds) from a request arriving to its response starting,
+    and 'byte_time' the time to carry one byte (10 / baud rate for a serial port).
+    """
+
+    def __init__(self, latency=0.0, byte_time=0.0):
+        self.latency = latency
+        self.byte_time = byte_time
+        self.request_link_free_at = 0.0     # Each direction carries one byte at a time
+        self.response_link_free_at = 0.0
+
+    def ready_at(self, arrived_at, request_size, response_size):
+        """Return the time the response to a request that started arriving at 'arrived_at' is complete."""
+        received = max(arrived_at, self.request_link_free_at) + request_size * self.byte_time
+        self.request_link_free_at = received
+        start = max(received + self.latency, self.response_link_free_at)
+        self.response_link_free_at = start + response_size * self.byte_time
+        return self.response_link_free_at
+
+def wait_until(moment):
+    delay = moment - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+
+class SimulatorConnection(foenix.FoenixConnection):
+    """A FoenixConnection to a simulator in the same process.
+
+    Requests are carried out as soon as they are written; the responses wait in a
+    buffer (until their time, if the link has a latency or speed) to be read.
+    """
+
+    def __init__(self, simulator, timing=None):
+        self.simulator = simulator
+        self.timing = timing if timing is not None else LinkTiming()
+        self.parser = RequestParser()
+        self.responses = bytearray()
+        self.ready = []             # (time, number of bytes in self.responses) as each response completes
+        self._is_open = False
+
+    def open(self, port):
+        self._is_open = True
+
+    def close(self):
+        self._is_open = False
+
+    def is_open(self):
+        return self._is_open
+
+    def timed(self):
+        return self.timing.latency > 0 or self.timing.byte_time > 0
+
+    def write(self, data):
+        now = time.perf_counter()
+        for request in self.parser.feed(data):
+            response = self.simulator.handle(request)
+            self.responses.extend(response)
+            if self.timed():
+                ready_at = self.timing.ready_at(now, len(request), len(response))
+                self.ready.append((ready_at, len(self.responses)))
+        return len(data)
+
+    def read(self, num_bytes):
+        num_bytes = min(num_bytes, len(self.responses))
+        data = bytes(self.responses[:num_bytes])
+        del self.responses[:num_bytes]
+
+        if self.ready:
+            # Wait for the response holding the last byte read, and forget those read in full
+            for (ready_at, available) in self.ready:
+                if available >= num_bytes:
+                    wait_until(ready_at)
+                    break
+            while self.ready and self.ready[0][1] <= num_bytes:
+                self.ready.pop(0)
+            self.ready = [(ready_at, available - num_bytes) for (ready_at, available) in self.ready]
+        return data
+
+def serve_stream(simulator, receive, send, timing):
+    """Answer the requests arriving through receive() with send(), until receive() returns nothing.
+
+    One thread reads and timestamps requests as they arrive, so that requests sent
+    back to back (pipelined) are timed from their arrival, not from when the previous
+    response was finished.
+    """
+    requests = queue.Queue()
+
+    def reader():
+        parser = RequestParser()
+        try:
+            while True:
+                data = receive()
+                if not data:
+                    break
+                now = time.perf_counter()
+                for request in parser.feed(data):
+                    requests.put((now, request))
+        except OSError:
+            pass
+        requests.put(None)
+
+    threading.Thread(target=reader, daemon=True).start()
+    while True:
+        item = requests.get()
+        if item is None:
+            return
+        (arrived_at, request) = item
+        response = simulator.handle(request)
+        wait_until(timing.ready_at(arrived_at, len(request), len(response)))
+        try:
+            send(response)
+        except OSError:
+            return
+
+def serve_tcp(simulator, host, port, latency=0.0, byte_time=0.0, ready=None):
+    """Accept connections on a TCP port and answer their requests, one connection at a time.
+    If 'ready' is given, it is called with the port number once the simulator is listening."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen()
+    if ready is not None:
+        ready(listener.getsockname()[1])
+
+    try:
+        while True:
+            (connection, _) = listener.accept()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with connection:
+                serve_stream(simulator, lambda: connection.recv(65536), connection.sendall, LinkTiming(latency, byte_time))
+    finally:
+        listener.close()
+
+def open_pty():
+    """Open a pseudo-terminal, returning the file descriptor of its master side and the name of the serial port."""
+    import tty
+    (master, slave) = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    return (master, os.ttyname(slave))
+
+def serve_pty(simulator, master, latency=0.0, byte_time=0.0):
+    """Answer the requests written to the serial port side of a pseudo-terminal."""
+    def send(data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(master, view):]
+
+    while True:
+        serve_stream(simulator, lambda: os.read(master, 65536), send, LinkTiming(latency, byte_time))
+        # The port was closed; wait for the next program to open it
+        time.sleep(0.1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a Foenix debug port.')
+    parser.add_argument("--tcp", metavar="HOST:PORT", dest="tcp_host_port",
+                        help="Listen on a TCP port, like a TCP bridge (the default is 127.0.0.1:2560).")
+    parser.add_argument("--pty", action="store_true", dest="pty",
+                        help="Appear as a serial port, through a pseudo-terminal.")
+    parser.add_argument("--latency", metavar="MS", dest="latency", type=float, default=0.0,
+                        help="Time from a request arriving to its response starting, in milliseconds.")
+    parser.add_argument("--baud", metavar="RATE", dest="baud", type=int, default=0,
+                        help="Speed of the link in bits per second (0 for as fast as possible).")
+    parser.add_argument("--revision", metavar="NUMBER", dest="revision", type=int, default=0,
+                        help="The revision code of the debug interface.")
+    parser.add_argument("--flash-busy", metavar="MS", dest="flash_busy", type=float, default=0.0,
+                        help="Time the flash stays busy after an erase or program operation, in milliseconds.")
+    options = parser.parse_args()
+
+    simulator = FoenixSimulator(options.revision, flash_busy_time=options.flash_busy / 1000)
+    latency = options.latency / 1000
+    byte_time = 10 / options.baud if options.baud else 0.0
+
+    if options.pty:
+        (master, name) = open_pty()
+        print("Simulated Foenix on serial port {}".format(name), flush=True)
+        serve_pty(simulator, master, latency, byte_time)
+    else:
+        (host, _, port) = (options.tcp_host_port or "127.0.0.1:2560").partition(":")
+        serve_tcp(simulator, host, int(port or 2560), latency, byte_time,
+                  lambda port: print("Simulated Foenix on {}:{}".format(host, port), flush=True))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
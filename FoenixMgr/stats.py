@@ -0,0 +1,171 @@
+#
+# Instrumentation for the debug port
+#
+# When a PortStatistics object is attached to a FoenixDebugPort, every request is
+# recorded: how many bytes went each way, how long the port waited for the 0xAA
+# sync byte of the response, the time from sending the request to having its
+# complete response, and how many reads of the connection that response took.
+#
+
+import json
+
+COMMAND_NAMES = {
+    0x00: "READ_MEM",
+    0x01: "WRITE_MEM",
+    0x10: "PROGRAM_FLASH",
+    0x11: "ERASE_FLASH",
+    0x12: "ERASE_SECTOR",
+    0x13: "PROGRAM_SECTOR",
+    0x20: "STOP_CPU",
+    0x21: "START_CPU",
+    0x80: "ENTER_DEBUG",
+    0x81: "EXIT_DEBUG",
+    0x90: "BOOT_RAM",
+    0x91: "BOOT_FLASH",
+    0xFE: "REVISION",
+}
+
+# Upper bounds (in milliseconds) of the round trip latency histogram buckets
+LATENCY_BUCKETS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+def command_name(command):
+    """Return the printable name of a debug port command."""
+    return COMMAND_NAMES.get(command, "0x{:02X}".format(command))
+
+class CommandStatistics:
+    """Totals for all the requests made with one command."""
+
+    def __init__(self):
+        self.count = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.sync_wait = 0.0
+        self.round_trip = 0.0
+        self.max_round_trip = 0.0
+        self.reads = 0
+        self.retries = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, bytes_sent, bytes_received, sync_wait, round_trip, reads=0):
+        self.count += 1
+        self.reads += reads
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        self.sync_wait += sync_wait
+        self.round_trip += round_trip
+        self.max_round_trip = max(self.max_round_trip, round_trip)
+
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and round_trip * 1000 > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+
+    def histogram_dict(self):
+        """Return the non-empty buckets of the latency histogram, labelled by their bounds in ms."""
+        histogram = {}
+        for (i, n) in enumerate(self.histogram):
+            if n > 0:
+                if i < len(LATENCY_BUCKETS):
+                    histogram["<={}".format(LATENCY_BUCKETS[i])] = n
+                else:
+                    histogram[">{}".format(LATENCY_BUCKETS[-1])] = n
+        return histogram
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "sync_wait_s": self.sync_wait,
+            "round_trip_s": self.round_trip,
+            "max_round_trip_s": self.max_round_trip,
+            "reads": self.reads,
+            "retries": self.retries,
+            "histogram_ms": self.histogram_dict(),
+        }
+
+class PortStatistics:
+    """Statistics for every request made over a debug port."""
+
+    def __init__(self, trace=False):
+        self.commands = {}
+        self.trace = [] if trace else None
+        self.first_request = None
+        self.last_response = None
+
+    def record(self, command, address, bytes_sent, bytes_received, sent_at, sync_at, done_at, read_started_at, reads=0):
+        """Record a completed request.
+
+        sent_at is when the request was written, read_started_at when the port started
+        reading its response, sync_at when the sync byte arrived, and done_at when the
+        response was complete (all from time.perf_counter). reads is the number of reads
+        of the connection made while collecting the response.
+        """
+        if self.first_request is None:
+            self.first_request = sent_at
+        self.last_response = done_at
+
+        sync_wait = sync_at - read_started_at
+        round_trip = done_at - sent_at
+        self.commands.setdefault(command, CommandStatistics()).add(bytes_sent, bytes_received, sync_wait, round_trip, reads)
+
+        if self.trace is not None:
+            self.trace.append({
+                "command": command_name(command),
+                "address": address,
+                "bytes_sent": bytes_sent,
+                "bytes_received": bytes_received,
+                "start_s": sent_at - self.first_request,
+                "sync_wait_s": sync_wait,
+                "round_trip_s": round_trip,
+                "reads": reads,
+            })
+
+    def record_retry(self, command):
+        """Record that a request was sent again after its response was lost or corrupted."""
+        self.commands.setdefault(command, CommandStatistics()).retries += 1
+
+    def elapsed(self):
+        """Return the time from the first request to the last response."""
+        if self.first_request is None:
+            return 0.0
+        return self.last_response - self.first_request
+
+    def total_bytes(self):
+        """Return the number of bytes sent and received over the port."""
+        return sum(c.bytes_sent + c.bytes_received for c in self.commands.values())
+
+    def summary(self):
+        """Return a printable table of the statistics."""
+        lines = ["{:<15} {:>7} {:>10} {:>10} {:>10} {:>10} {:>12} {:>10}".format(
+            "command", "count", "sent", "received", "avg ms", "max ms", "avg sync ms", "reads/req")]
+        for (command, c) in sorted(self.commands.items()):
+            count = max(c.count, 1)     # A command may only have been retried, never completed
+            lines.append("{:<15} {:>7} {:>10} {:>10} {:>10.2f} {:>10.2f} {:>12.2f} {:>10.2f}".format(
+                command_name(command), c.count, c.bytes_sent, c.bytes_received,
+                c.round_trip * 1000 / count, c.max_round_trip * 1000, c.sync_wait * 1000 / count, c.reads / count))
+            lines.append("    latency ms: " + " ".join("{}:{}".format(bound, n) for (bound, n) in c.histogram_dict().items()))
+            if c.retries:
+                lines.append("    retries: {}".format(c.retries))
+
+        elapsed = self.elapsed()
+        if elapsed > 0:
+            lines.append("{} bytes in {:.3f} s: {:.1f} KB/s".format(
+                self.total_bytes(), elapsed, self.total_bytes() / 1024 / elapsed))
+        return "\n".join(lines)
+
+    def as_dict(self):
+        result = {
+            "elapsed_s": self.elapsed(),
+            "total_bytes": self.total_bytes(),
+            "bytes_per_s": self.total_bytes() / self.elapsed() if self.elapsed() > 0 else 0,
+            "commands": {command_name(command): c.as_dict() for (command, c) in sorted(self.commands.items())},
+        }
+        if self.trace is not None:
+            result["trace"] = self.trace
+        return result
+
+    def write_json(self, filename):
+        """Save the statistics (and the trace of each request, if kept) as JSON."""
+        with open(filename, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
@@ -0,0 +1,60 @@
+#
+# Read-back verification of the Foenix's memory
+#
+# After an upload, the image is read back in large, pipelined READ_MEM requests
+# and each block is compared as soon as it arrives. Only blocks that differ are
+# examined byte by byte, to find the addresses that did not take.
+#
+
+import foenix
+
+READ_CHUNK_SIZE = 0x8000        # Bytes per read request (the length field tops out at 0xFFFF)
+MAX_REPORTED = 8                # Mismatching addresses to keep for the report
+
+class VerifyResult:
+    """The outcome of comparing an image with the Foenix's memory."""
+
+    def __init__(self):
+        self.bytes_checked = 0
+        self.mismatch_count = 0
+        self.mismatches = []        # (address, expected, actual) of the first MAX_REPORTED bad bytes
+
+    def ok(self):
+        return self.mismatch_count == 0
+
+    def add_block(self, address, expected, actual):
+        """Compare one block read back from 'address' with what it should hold."""
+        self.bytes_checked += len(expected)
+        if actual == expected:
+            return
+
+        for (i, (e, a)) in enumerate(zip(expected, actual)):
+            if e != a:
+                self.mismatch_count += 1
+                if len(self.mismatches) < MAX_REPORTED:
+                    self.mismatches.append((address + i, e, a))
+
+    def report(self):
+        """Return a printable description of the result."""
+        if self.ok():
+            return "Verified {} bytes.".format(self.bytes_checked)
+
+        lines = ["Verification failed: {} of {} bytes differ.".format(self.mismatch_count, self.bytes_checked)]
+        for (address, expected, actual) in self.mismatches:
+            lines.append("    0x{:06X}: expected 0x{:02X}, read 0x{:02X}".format(address, expected, actual))
+        if self.mismatch_count > len(self.mismatches):
+            lines.append("    ...")
+        return "\n".join(lines)
+
+def verify_image(port, memory, depth, chunk_size=READ_CHUNK_SIZE):
+    """Read back every byte of the SparseImage 'memory' from the Foenix and compare it.
+
+    Up to 'depth' reads are kept in flight. Returns a VerifyResult.
+    """
+    result = VerifyResult()
+    chunks = list(memory.chunks(chunk_size))
+    reader = foenix.PipelinedReader(port, depth)
+    blocks = reader.read_blocks((address, len(expected)) for (address, expected) in chunks)
+    for ((address, actual), (_, expected)) in zip(blocks, chunks):
+        result.add_block(address, expected, actual)
+    return result
@@ -0,0 +1,36 @@
+#
+# Benchmark for the CRC-32 used by --copy
+#
+# Compares the bit-by-bit reference implementation with the zlib-backed one on
+# a file of roughly the largest size --copy accepts.
+#
+# usage: python benchmarks/bench_crc.py
+#
+
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import crc
+
+def best_time(function, data, repeat=3):
+    """Return the best time in seconds for function(data)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    data = random.Random(0).randbytes(400 * 1024)
+    old = best_time(crc.mycrc, data, repeat=1)
+    new = best_time(crc.crc32, data)
+    print("{} KB: mycrc {:.3f} s, crc32 {:.6f} s ({:.0f}x)".format(len(data) // 1024, old, new, old / new))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#
+# Micro-benchmark for formatting memory dumps
+#
+# Reports the time needed to format a 64KB dump with the byte-at-a-time loop
+# display() used to have and with each of the hexdump formats, next to the time
+# the same 64KB takes to arrive over a 6 Mbaud serial port.
+#
+# usage: python benchmarks/bench_hexdump.py
+#
+
+import io
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import hexdump
+
+DUMP_SIZE = 64 * 1024
+BAUD_RATE = 6000000
+
+def loop_display(out, base_address, data):
+    """The dump formatting as originally written in fnxmgr.display."""
+    text_buff = ""
+    for i in range(0, len(data)):
+        if (i % 16) == 0:
+            if text_buff != "":
+                out.write(" {}\n".format(text_buff))
+            text_buff = ""
+            out.write("{:06X}: ".format(base_address + i))
+        elif (i % 8) == 0:
+            out.write(" ")
+        out.write("{:02X}".format(data[i]))
+
+        b = bytearray(1)
+        b[0] = data[i]
+        if (b[0] & 0x80 == 0):
+            c = b.decode('ascii')
+            if c.isprintable():
+                text_buff = text_buff + c
+            else:
+                text_buff = text_buff + "."
+        else:
+            text_buff = text_buff + "."
+
+    out.write(' {}\n'.format(text_buff))
+
+def best_time(format_dump, data, repeat=3):
+    """Return the best time in seconds to format the data into an in-memory stream."""
+    best = None
+    for _ in range(repeat):
+        out = io.TextIOWrapper(io.BytesIO(), encoding='ascii')
+        start = time.perf_counter()
+        format_dump(out, 0x010000, data)
+        out.flush()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    data = bytes(range(256)) * (DUMP_SIZE // 256)
+    transfer = DUMP_SIZE * 10 / BAUD_RATE        # 8 data bits, a start bit and a stop bit per byte
+
+    print("{:>10} {:>10} {:>14}".format("format", "ms/64KB", "vs. transfer"))
+    print("{:>10} {:>10.2f} {:>13.2f}x".format("transfer", transfer * 1000, 1.0))
+    elapsed = best_time(loop_display, data)
+    print("{:>10} {:>10.2f} {:>13.2f}x".format("loop", elapsed * 1000, elapsed / transfer))
+    for format in hexdump.FORMATS:
+        elapsed = best_time(lambda out, address, data: hexdump.write(out, address, data, format), data)
+        print("{:>10} {:>10.2f} {:>13.2f}x".format(format, elapsed * 1000, elapsed / transfer))
+
+if __name__ == "__main__":
+    main()
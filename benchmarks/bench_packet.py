@@ -0,0 +1,57 @@
+#
+# Micro-benchmark for debug port packet encoding
+#
+# Reports the time needed to encode one megabyte of write requests, split into
+# packets of the usual chunk sizes, with the current encoder and with the
+# byte-at-a-time loop transfer() used to have.
+#
+# usage: python benchmarks/bench_packet.py
+#
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import packet
+
+MEGABYTE = 1024 * 1024
+
+def loop_encode(command, address, data, read_length):
+    """Packet assembly as originally written in FoenixDebugPort.transfer."""
+    length = len(data)
+    header = bytearray(7)
+    header[0] = 0x55
+    header[1] = command
+    header[2:5] = address.to_bytes(3, byteorder='big')
+    header[5:7] = length.to_bytes(2, byteorder='big')
+    lrc = 0
+    for i in range(0, 6):
+        lrc = lrc ^ header[i]
+    for i in range(0, length):
+        lrc = lrc ^ data[i]
+    return header + data + lrc.to_bytes(1, byteorder='big')
+
+def time_per_megabyte(encode, chunk_size, repeat=3):
+    """Return the best time in seconds to encode 1MB in chunk_size packets."""
+    data = bytes(range(256)) * (chunk_size // 256)
+    packets = MEGABYTE // chunk_size
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(packets):
+            encode(0x01, i * chunk_size & 0xffffff, data, 0)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    print("{:>10} {:>14} {:>14} {:>8}".format("chunk", "loop ms/MB", "encoder ms/MB", "speedup"))
+    for chunk_size in [256, 1024, 4096, 16384]:
+        old = time_per_megabyte(loop_encode, chunk_size)
+        new = time_per_megabyte(packet.encode_request, chunk_size)
+        print("{:>10} {:>14.2f} {:>14.2f} {:>7.1f}x".format(chunk_size, old * 1000, new * 1000, old / new))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+#
+# Benchmark suite for FoenixMgr
+#
+# Times the file loaders, the CRC, the dump formatter and the debug port on
+# synthetic inputs of several sizes, then runs whole uploads (--binary, --upload
+# and --copy) through fnxmgr against the simulator on a local TCP port. The
+# results are written as JSON, so that runs from different commits can be
+# compared with --compare.
+#
+# usage: python benchmarks/bench_suite.py [--output results.json] [--compare baseline.json]
+#
+# Run it from the root of the repository, so that foenixmgr.ini is found.
+#
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import constants
+import crc
+import foenix
+import foenix_config
+import image
+import intelhex
+import pgx
+import pgz
+import simulator
+import srec
+import wdc
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import fnxmgr
+
+LOAD_ADDRESS = 0x010000
+SIZES = [1024, 64 * 1024, 1024 * 1024]
+REGRESSION_THRESHOLD = 0.9      # Flag results running at less than 90% of the baseline's speed
+
+def payload(size):
+    return (bytes(range(256)) * (size // 256 + 1))[:size]
+
+def record_checksum(values):
+    return (-sum(values)) & 0xFF
+
+def make_hex(data, address):
+    """Return an Intel HEX file holding data, in 16 byte records."""
+    lines = []
+    upper = None
+    for offset in range(0, len(data), 16):
+        current = address + offset
+        if current >> 16 != upper:
+            upper = current >> 16
+            values = [2, 0, 0, 4, upper >> 8, upper & 0xFF]
+            lines.append(":{}{:02X}".format(bytes(values).hex().upper(), record_checksum(values)))
+        chunk = data[offset:offset + 16]
+        values = [len(chunk), (current >> 8) & 0xFF, current & 0xFF, 0] + list(chunk)
+        lines.append(":{}{:02X}".format(bytes(values).hex().upper(), record_checksum(values)))
+    lines.append(":00000001FF")
+    return "\n".join(lines) + "\n"
+
+def make_srec(data, address):
+    """Return a Motorola SREC file holding data, in 32 byte S3 records."""
+    lines = []
+    for offset in range(0, len(data), 32):
+        chunk = data[offset:offset + 32]
+        values = [len(chunk) + 5] + list((address + offset).to_bytes(4, byteorder='big')) + list(chunk)
+        lines.append("S3{}{:02X}".format(bytes(values).hex().upper(), 0xFF - (sum(values) & 0xFF)))
+    return "\n".join(lines) + "\n"
+
+def make_pgz(data, address):
+    """Return a PGZ file (with 24-bit addresses) holding data and a start address."""
+    return (b'\x5a' + address.to_bytes(3, byteorder='little') + len(data).to_bytes(3, byteorder='little') + data
+            + address.to_bytes(3, byteorder='little') + bytes(3))
+
+def make_pgx(data, address, cpu):
+    """Return a PGX file holding data for the configured CPU."""
+    if cpu == "65816":
+        code = constants.PGX_CPU_65816
+    elif cpu.lower() == "65c02":
+        code = constants.PGX_CPU_65C02
+    else:
+        code = constants.PGX_CPU_680X0
+    return b'PGX' + bytes([code]) + address.to_bytes(4, byteorder='little') + data
+
+def make_wdc(data, address):
+    """Return a WDCTools binary file holding data."""
+    return b'Z' + address.to_bytes(3, byteorder='little') + len(data).to_bytes(3, byteorder='little') + data + bytes(6)
+
+def best_time(run, repeat):
+    """Return the best time in seconds of 'repeat' calls of run(), with its output discarded."""
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def load_file(loader, filename, by_lines):
+    """Run a loader over a file, collecting its blocks the way fnxmgr does."""
+    memory = image.SparseImage()
+    loader.open(filename)
+    try:
+        if by_lines:
+            loader.set_handler(lambda address, data: memory.add(address, bytes.fromhex(data)))
+            loader.read_lines()
+        else:
+            loader.set_handler(memory.add)
+            loader.read_blocks()
+    finally:
+        loader.close()
+    return memory
+
+class Suite:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def time(self, name, size, run, repeat=None):
+        seconds = best_time(run, repeat or self.repeat)
+        result = {"name": name, "bytes": size, "seconds": seconds,
+                  "bytes_per_s": size / seconds if seconds > 0 else None}
+        self.results.append(result)
+        print("{:<28} {:>9} {:>10.2f} ms {:>10.1f} KB/s".format(
+            name, size, seconds * 1000, size / 1024 / seconds if seconds > 0 else 0), file=sys.stderr)
+        return result
+
+def bench_loaders(suite, directory, size):
+    data = payload(size)
+    cpu = fnxmgr.config.profile().cpu
+    files = {
+        "hex": make_hex(data, LOAD_ADDRESS).encode('ascii'),
+        "srec": make_srec(data, LOAD_ADDRESS).encode('ascii'),
+        "pgz": make_pgz(data, LOAD_ADDRESS),
+        "pgx": make_pgx(data, LOAD_ADDRESS, cpu),
+        "wdc": make_wdc(data, LOAD_ADDRESS),
+    }
+    for (kind, contents) in files.items():
+        with open(os.path.join(directory, "bench.{}".format(kind)), "wb") as f:
+            f.write(contents)
+
+    path = lambda kind: os.path.join(directory, "bench.{}".format(kind))
+    suite.time("HexFile.read_lines", size, lambda: load_file(intelhex.HexFile(), path("hex"), True))
+    suite.time("SRECFile.read_lines", size, lambda: load_file(srec.SRECFile(), path("srec"), True))
+    suite.time("PGZBinFile.read_blocks", size, lambda: load_file(pgz.PGZBinFile(fnxmgr.config.profile()), path("pgz"), False))
+    suite.time("PGXBinFile.read_blocks", size, lambda: load_file(pgx.PGXBinFile(fnxmgr.config.profile()), path("pgx"), False))
+    suite.time("WdcBinFile.read_blocks", size, lambda: load_file(wdc.WdcBinFile(), path("wdc"), False))
+
+def bench_crc(suite, size):
+    data = payload(size)
+    if size <= 64 * 1024:
+        # The reference implementation visits every bit in Python, so keep it to small inputs
+        suite.time("mycrc", size, lambda: crc.mycrc(data))
+    suite.time("crc32", size, lambda: crc.crc32(data))
+
+def bench_display(suite, size):
+    data = payload(size)
+    suite.time("display", size, lambda: fnxmgr.display(LOAD_ADDRESS, data))
+
+def bench_transfer(suite, size):
+    """Time writing and reading the data through FoenixDebugPort.transfer, in chunk_size requests."""
+    data = payload(size)
+    chunk_size = fnxmgr.config.profile().chunk_size
+    port = foenix.FoenixDebugPort(fnxmgr.config.profile())
+    port.connection = simulator.SimulatorConnection(simulator.FoenixSimulator())
+
+    def write():
+        for offset in range(0, size, chunk_size):
+            port.transfer(constants.CMD_WRITE_MEM, LOAD_ADDRESS + offset, data[offset:offset + chunk_size], 0)
+
+    def read():
+        for offset in range(0, size, chunk_size):
+            port.transfer(constants.CMD_READ_MEM, LOAD_ADDRESS + offset, 0, min(chunk_size, size - offset))
+
+    suite.time("transfer (write)", size, write)
+    suite.time("transfer (read)", size, read)
+
+def start_simulator(latency, byte_time):
+    """Run the simulator on a local TCP port, returning the port name to give fnxmgr."""
+    listening = threading.Event()
+    ports = []
+    threading.Thread(target=simulator.serve_tcp, daemon=True,
+                     args=(simulator.FoenixSimulator(), "127.0.0.1", 0, latency, byte_time),
+                     kwargs={"ready": lambda port: (ports.append(port), listening.set())}).start()
+    listening.wait()
+    return "127.0.0.1:{}".format(ports[0])
+
+def bench_end_to_end(suite, directory, size, port):
+    data = payload(size)
+    binary = os.path.join(directory, "bench.bin")
+    with open(binary, "wb") as f:
+        f.write(data)
+
+    suite.time("upload_binary", size, lambda: fnxmgr.upload_binary(port, binary, "{:X}".format(LOAD_ADDRESS)))
+    suite.time("send", size, lambda: fnxmgr.send(port, os.path.join(directory, "bench.hex")))
+    if size < fnxmgr.COPY_MAX_SIZE:
+        suite.time("copy_file", size, lambda: fnxmgr.copy_file(port, binary))
+
+def compare(results, baseline_file):
+    """Print how each result compares with the same benchmark in a baseline run."""
+    with open(baseline_file, "r") as f:
+        baseline = {(r["name"], r["bytes"]): r for r in json.load(f)["results"]}
+
+    print("{:<28} {:>9} {:>10} {:>10} {:>8}".format("benchmark", "bytes", "base ms", "ms", "speed"), file=sys.stderr)
+    regressions = 0
+    for result in results:
+        before = baseline.get((result["name"], result["bytes"]))
+        if before is None or not result["seconds"]:
+            continue
+        speed = before["seconds"] / result["seconds"]
+        flag = ""
+        if speed < REGRESSION_THRESHOLD:
+            flag = "  SLOWER"
+            regressions += 1
+        print("{:<28} {:>9} {:>10.2f} {:>10.2f} {:>7.2f}x{}".format(
+            result["name"], result["bytes"], before["seconds"] * 1000, result["seconds"] * 1000, speed, flag), file=sys.stderr)
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parents[1]).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark FoenixMgr and write the results as JSON.')
+    parser.add_argument("--output", metavar="JSON FILE", dest="output",
+                        help="Write the results to a file (by default, they are printed).")
+    parser.add_argument("--compare", metavar="JSON FILE", dest="baseline",
+                        help="Compare the results with those of an earlier run, and exit with status 1 if any are slower.")
+    parser.add_argument("--sizes", metavar="KB", dest="sizes", type=int, nargs="+",
+                        help="Input sizes in KB (1, 64 and 1024 by default).")
+    parser.add_argument("--repeat", metavar="N", dest="repeat", type=int, default=3,
+                        help="Number of runs of each benchmark; the best is kept.")
+    parser.add_argument("--latency", metavar="MS", dest="latency", type=float, default=0.0,
+                        help="Latency of the simulated link for the end to end uploads, in milliseconds.")
+    parser.add_argument("--baud", metavar="RATE", dest="baud", type=int, default=0,
+                        help="Speed of the simulated link for the end to end uploads (0 for as fast as possible).")
+    options = parser.parse_args()
+
+    sizes = [kb * 1024 for kb in options.sizes] if options.sizes else SIZES
+    suite = Suite(options.repeat)
+
+    fnxmgr.quiet_mode = True
+    fnxmgr.config = foenix_config.load()
+    fnxmgr.config.set_target("unknown")
+    port = start_simulator(options.latency / 1000, 10 / options.baud if options.baud else 0.0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Keep the record of uploaded images out of the user's ~/.foenixmgr
+        image.CACHE_DIRECTORY = os.path.join(directory, "images")
+        for size in sizes:
+            bench_loaders(suite, directory, size)
+            bench_crc(suite, size)
+            bench_display(suite, size)
+            bench_transfer(suite, size)
+            bench_end_to_end(suite, directory, size, port)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "chunk_size": fnxmgr.config.profile().chunk_size,
+        "pipeline_depth": fnxmgr.config.profile().pipeline_depth,
+        "link": {"latency_ms": options.latency, "baud": options.baud},
+        "results": suite.results,
+    }
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if options.baseline and compare(suite.results, options.baseline) > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
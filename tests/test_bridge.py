@@ -0,0 +1,190 @@
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import Mock
+from unittest.mock import patch
+
+import serial
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import constants
+import foenix
+import packet
+import simulator
+
+
+class RelayTests(unittest.TestCase):
+    def setUp(self):
+        self.bridge = foenix.FoenixTcpBridge("127.0.0.1", 0, "/dev/null")
+        self.bridge.relay_once = Mock(side_effect=[serial.SerialException("unplugged"), b"\xAA\x00\x00\x00"])
+
+    def test_memory_requests_are_tried_again(self):
+        with patch("builtins.print"):
+            response = self.bridge.relay(b"request", constants.CMD_WRITE_MEM, 4)
+        self.assertEqual(response, b"\xAA\x00\x00\x00")
+        self.assertEqual(self.bridge.relay_once.call_count, 2)
+
+    def test_other_commands_fail_without_being_sent_again(self):
+        for command in (constants.CMD_ERASE_SECTOR, constants.CMD_PROGRAM_SECTOR, constants.CMD_EXIT_DEBUG):
+            with self.subTest(command=command):
+                self.setUp()
+                with patch("builtins.print"), self.assertRaises(serial.SerialException):
+                    self.bridge.relay(b"request", command, 0)
+                self.assertEqual(self.bridge.relay_once.call_count, 1)
+                self.assertIsNone(self.bridge.serial_connection)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "needs a pseudo-terminal")
+class BridgeTests(unittest.TestCase):
+    """Run a bridge in front of a simulator on a pseudo-terminal, and talk to it as several clients."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.simulator = simulator.FoenixSimulator()
+        cls.handled = []          # (command, address) of each request, in the order the simulator saw them
+        handle = cls.simulator.handle
+        def logged(request):
+            cls.handled.append((request[1], int.from_bytes(request[2:5], byteorder='big')))
+            return handle(request)
+        cls.simulator.handle = logged
+
+        (master, name) = simulator.open_pty()
+        # A little latency per request, so that requests from several clients queue up at the bridge
+        threading.Thread(target=simulator.serve_pty, args=(cls.simulator, master, 0.005), daemon=True).start()
+
+        # Keep the bridge's messages about each connection quiet
+        cls.print_patch = patch.object(foenix, "print", create=True)
+        cls.print_patch.start()
+
+        cls.port = free_port()
+        cls.bridge = bridge = foenix.FoenixTcpBridge("127.0.0.1", cls.port, name)
+        threading.Thread(target=bridge.listen, daemon=True).start()
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", cls.port)).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    @classmethod
+    def tearDownClass(cls):
+        time.sleep(0.1)         # Let the bridge notice the last clients leaving
+        cls.print_patch.stop()
+
+    def setUp(self):
+        self.handled.clear()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+
+    def connect(self):
+        client = socket.create_connection(("127.0.0.1", self.port))
+        client.settimeout(5)
+        self.clients.append(client)
+        return client
+
+    def send(self, client, command, address=0, data=0):
+        client.sendall(packet.encode_request(command, address, data, 0))
+
+    def receive(self, client):
+        """Return one response (to a request without data) from the bridge."""
+        response = b""
+        while len(response) < 4:
+            more = client.recv(4 - len(response))
+            self.assertTrue(more, "bridge closed the connection")
+            response += more
+        self.assertEqual(response[0], constants.RESPONSE_SYNC_BYTE)
+        return response
+
+    def assert_no_response(self, client, wait=0.2):
+        client.settimeout(wait)
+        try:
+            with self.assertRaises(socket.timeout):
+                client.recv(4)
+        finally:
+            client.settimeout(5)
+
+    def test_clients_take_turns(self):
+        a = self.connect()
+        b = self.connect()
+        for i in range(4):
+            self.send(a, constants.CMD_WRITE_MEM, 0xA000 + i, b"a")
+        for i in range(4):
+            self.send(b, constants.CMD_WRITE_MEM, 0xB000 + i, b"b")
+        for _ in range(4):
+            self.receive(a)
+            self.receive(b)
+
+        order = [address for (_, address) in self.handled]
+        self.assertEqual([a for a in order if a < 0xB000], [0xA000, 0xA001, 0xA002, 0xA003])
+        self.assertEqual([a for a in order if a >= 0xB000], [0xB000, 0xB001, 0xB002, 0xB003])
+        # b's requests are not left until all of a's are done
+        self.assertLess(order.index(0xB000), order.index(0xA003))
+        self.assertEqual(self.simulator.memory[0xA000:0xA004], b"aaaa")
+        self.assertEqual(self.simulator.memory[0xB000:0xB004], b"bbbb")
+
+    def test_debug_session_holds_off_other_clients(self):
+        a = self.connect()
+        b = self.connect()
+        self.send(a, constants.CMD_ENTER_DEBUG)
+        self.receive(a)
+
+        self.send(b, constants.CMD_WRITE_MEM, 0xC000, b"b")
+        self.assert_no_response(b)
+        self.send(a, constants.CMD_WRITE_MEM, 0xC001, b"a")
+        self.receive(a)
+        self.assert_no_response(b, 0.05)
+
+        self.send(a, constants.CMD_EXIT_DEBUG)
+        self.receive(a)
+        self.receive(b)
+        self.assertEqual(self.handled, [(constants.CMD_ENTER_DEBUG, 0), (constants.CMD_WRITE_MEM, 0xC001),
+                                        (constants.CMD_EXIT_DEBUG, 0), (constants.CMD_WRITE_MEM, 0xC000)])
+
+    def test_disconnect_releases_the_session(self):
+        a = self.connect()
+        b = self.connect()
+        self.send(a, constants.CMD_ENTER_DEBUG)
+        self.receive(a)
+
+        self.send(b, constants.CMD_WRITE_MEM, 0xD000, b"b")
+        self.assert_no_response(b)
+        a.close()
+        self.receive(b)
+        self.assertEqual(self.handled[-1], (constants.CMD_WRITE_MEM, 0xD000))
+
+    def test_unexpected_error_fails_only_that_request(self):
+        relay = self.bridge.relay
+        def failing(request, command, data_length):
+            if int.from_bytes(request[2:5], byteorder='big') == 0xE000:
+                raise ValueError("unexpected")
+            return relay(request, command, data_length)
+
+        a = self.connect()
+        b = self.connect()
+        with patch.object(self.bridge, "relay", failing):
+            self.send(a, constants.CMD_WRITE_MEM, 0xE000, b"a")
+            self.assertEqual(a.recv(4), b"")        # a's connection is dropped
+            self.send(b, constants.CMD_WRITE_MEM, 0xE001, b"b")
+            self.receive(b)
+        self.assertEqual(self.simulator.memory[0xE001], ord("b"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import calibration
+import foenix
+import foenix_config
+import simulator
+
+
+class SmallPacketConnection(simulator.SimulatorConnection):
+    """A link that loses any request carrying more than 16KB of data, and never answers it."""
+
+    def write(self, data):
+        if len(data) > 16384 + 8:
+            return len(data)
+        return super().write(data)
+
+
+class CalibrateTests(unittest.TestCase):
+    def test_failed_chunk_size_skips_only_larger_ones_at_that_depth(self):
+        machine = foenix.FoenixDebugPort(foenix_config.DEFAULT_PROFILE._replace(retries=0))
+        machine.connection = SmallPacketConnection(simulator.FoenixSimulator())
+        messages = []
+
+        result = calibration.calibrate(machine, 0x10000, report=messages.append)
+
+        tried = [(r["pipeline_depth"], r["chunk_size"]) for r in result["results"]]
+        self.assertEqual(tried, [(depth, size) for depth in calibration.PIPELINE_DEPTHS
+                                 for size in calibration.CHUNK_SIZES if size <= 16384])
+        self.assertEqual(len([m for m in messages if "failed" in m]), len(calibration.PIPELINE_DEPTHS))
+        self.assertLessEqual(result["chunk_size"], 16384)
+
+
+if __name__ == "__main__":
+    unittest.main()
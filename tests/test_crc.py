@@ -0,0 +1,35 @@
+import random
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import crc
+
+
+class FirmwareCrcTests(unittest.TestCase):
+    def test_matches_bitwise_reference(self):
+        rng = random.Random(7)
+        for size in [0, 1, 2, 15, 16, 17, 255, 4096]:
+            with self.subTest(size=size):
+                data = bytes(rng.randrange(256) for _ in range(size))
+                self.assertEqual(crc.crc32(data), crc.mycrc(data))
+
+    def test_known_values(self):
+        # No initial or final inversion, unlike zlib's CRC-32
+        self.assertEqual(crc.crc32(b""), 0)
+        self.assertEqual(crc.crc32(b"\x00\x00\x00\x00"), 0)
+        self.assertEqual(crc.crc32(b"123456789"), crc.mycrc(b"123456789"))
+        self.assertEqual(crc.crc32(b"123456789"), 0x2DFD2D88)
+
+    def test_incremental(self):
+        data = bytes(range(256)) * 10
+        value = 0
+        for offset in range(0, len(data), 100):
+            value = crc.crc32(data[offset:offset + 100], value)
+        self.assertEqual(value, crc.mycrc(data))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,354 @@
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import Mock
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import calibration
+import constants
+import crc
+import flash_manifest
+import foenix
+import foenix_config
+import image
+import simulator
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import fnxmgr
+
+
+class SimulatedBoardTest(unittest.TestCase):
+    """Run fnxmgr's commands against a simulator, with a fresh configuration and image cache."""
+
+    target = "f256k"
+    settings = {}
+
+    def setUp(self):
+        self.simulator = simulator.FoenixSimulator()
+        self.config = foenix_config.FoenixConfig(self.settings)
+        self.config.set_target(self.target)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        for (target, name, value) in [(fnxmgr, "config", self.config), (fnxmgr, "quiet_mode", True),
+                                      (fnxmgr, "debug_port", self.debug_port),
+                                      (image, "CACHE_DIRECTORY", self.directory.name),
+                                      (flash_manifest, "MANIFEST_DIRECTORY", self.directory.name)]:
+            patcher = patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def debug_port(self):
+        port = foenix.FoenixDebugPort(self.config.profile())
+        port.open = lambda name: None
+        port.connection = simulator.SimulatorConnection(self.simulator)
+        return port
+
+    def writes(self):
+        return self.simulator.commands.get(constants.CMD_WRITE_MEM, 0)
+
+    def reads(self):
+        return self.simulator.commands.get(constants.CMD_READ_MEM, 0)
+
+
+class DeltaUploadTests(SimulatedBoardTest):
+    def setUp(self):
+        super().setUp()
+        self.config.set_chunk_size(0x100)
+        self.config.set_pipeline_depth(4)
+        self.memory = image.SparseImage()
+        self.memory.add(0x10000, bytes(range(256)) * 8)
+
+    def upload(self, delta=True, stopped=True):
+        with patch.object(fnxmgr, "delta_mode", delta), patch.object(fnxmgr, "is_stopped", return_value=stopped):
+            fnxmgr.upload_image("test", self.memory)
+
+    def cached(self):
+        return os.path.exists(image.cache_filename("test", self.target))
+
+    def test_only_changed_chunks_are_sent(self):
+        self.upload()
+        self.assertEqual(self.writes(), 8)
+
+        self.memory.add(0x10345, b"changed")
+        self.upload()
+        self.assertEqual(self.writes(), 9)
+        self.assertEqual(self.simulator.memory[0x10345:0x1034C], b"changed")
+
+    def test_image_is_not_remembered_while_the_cpu_runs(self):
+        self.upload(stopped=False)
+        self.assertFalse(self.cached())
+        self.upload(stopped=False)
+        self.assertEqual(self.writes(), 16)
+
+    def test_starting_the_cpu_forgets_the_image(self):
+        self.upload()
+        self.assertTrue(self.cached())
+        with patch.object(fnxmgr, "clear_stop_indicator"):
+            fnxmgr.start_cpu("test")
+        self.assertFalse(self.cached())
+        self.upload()
+        self.assertEqual(self.writes(), 16)
+
+    def test_image_is_only_saved_in_delta_mode(self):
+        self.upload(delta=False)
+        self.assertFalse(self.cached())
+
+
+class CopyFileTests(SimulatedBoardTest):
+    def test_copy_request_layout(self):
+        self.config.set_chunk_size(0x100)
+        self.config.set_pipeline_depth(4)
+        data = bytes(random.Random(8).randrange(256) for _ in range(3000))
+        filename = os.path.join(self.directory.name, "GAME.PGZ")
+        with open(filename, "wb") as f:
+            f.write(data)
+
+        fnxmgr.copy_file("test", filename)
+
+        memory = self.simulator.memory
+        header = b"GAME.PGZ\x00" + crc.mycrc(data).to_bytes(4, byteorder='little') + len(data).to_bytes(3, byteorder='little')
+        self.assertEqual(memory[0x10000:0x10000 + len(header)], header)
+        self.assertEqual(memory[0x10000 + len(header):0x10000 + len(header) + len(data)], data)
+        self.assertEqual(memory[0x0080:0x0088], b"COPYFILE")
+
+
+class CopyListTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, *names):
+        return os.path.join(self.directory.name, *names)
+
+    def make(self, *names):
+        for name in names:
+            os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+            with open(self.path(name), "w") as f:
+                f.write(name)
+
+    def test_directory_skips_hidden_files_backups_and_folders(self):
+        self.make("assets/B.PGZ", "assets/A.PGZ", "assets/.DS_Store", "assets/A.PGZ~", "assets/sub/C.PGZ")
+        self.assertEqual(fnxmgr.copy_list([self.path("assets")]),
+                         [self.path("assets", "A.PGZ"), self.path("assets", "B.PGZ")])
+
+    def test_manifest_paths_are_relative_to_the_manifest(self):
+        self.make("lists/data/LEVEL1.DAT", "lists/data/LEVEL2.DAT")
+        with open(self.path("lists", "files.txt"), "w") as f:
+            f.write("# levels\ndata/LEVEL1.DAT\n\n  data/LEVEL2.DAT  \n{}\n".format(self.path("lists", "data", "LEVEL1.DAT")))
+        self.assertEqual(fnxmgr.copy_list(["@" + self.path("lists", "files.txt")]),
+                         [self.path("lists", "data/LEVEL1.DAT"), self.path("lists", "data/LEVEL2.DAT"),
+                          self.path("lists", "data", "LEVEL1.DAT")])
+
+    def test_arguments_are_expanded_in_order(self):
+        self.make("GAME.PGZ", "assets/A.PGZ", "more/B.DAT")
+        with open(self.path("more", "list.txt"), "w") as f:
+            f.write("B.DAT\n")
+        self.assertEqual(fnxmgr.copy_list([self.path("GAME.PGZ"), "@" + self.path("more", "list.txt"), self.path("assets")]),
+                         [self.path("GAME.PGZ"), self.path("more", "B.DAT"), self.path("assets", "A.PGZ")])
+
+
+class CopyFilesTests(SimulatedBoardTest):
+    def test_each_file_is_staged_in_turn(self):
+        files = {"A.PGZ": b"first file", "B.DAT": b"second", "C.DAT": b"third and last"}
+        filenames = []
+        for (name, data) in files.items():
+            filenames.append(os.path.join(self.directory.name, name))
+            with open(filenames[-1], "wb") as f:
+                f.write(data)
+
+        staged = []
+        stage_copy = fnxmgr.stage_copy
+        def staging(c256, f, name):
+            staged.append(name)
+            return stage_copy(c256, f, name)
+
+        with patch.object(fnxmgr, "stage_copy", staging), patch.object(fnxmgr, "is_stopped", return_value=False), \
+                patch.object(fnxmgr.time, "sleep") as sleep, contextlib.redirect_stdout(io.StringIO()):
+            fnxmgr.copy_files("test", filenames)
+
+        self.assertEqual(staged, list(files))
+        self.assertEqual(self.simulator.commands[constants.CMD_ENTER_DEBUG], 3)
+        self.assertEqual(self.simulator.commands[constants.CMD_EXIT_DEBUG], 3)
+        # The firmware is given time to save each file before the next is sent
+        self.assertEqual([c.args for c in sleep.call_args_list], [(2.0,), (2.0,)])
+        header = b"C.DAT\x00" + crc.mycrc(files["C.DAT"]).to_bytes(4, byteorder='little') + bytes([14, 0, 0])
+        self.assertEqual(self.simulator.memory[0x10000:0x10000 + len(header) + 14], header + files["C.DAT"])
+
+
+class WatchTests(SimulatedBoardTest):
+    def watch(self, *ranges):
+        """Watch the ranges for two polls, changing 0x1012 in between, and return what was shown."""
+        self.simulator.memory[0x1000:0x1100] = bytes(range(256))
+
+        def sleep(seconds):
+            if self.simulator.memory[0x1012] == 0x12:
+                self.simulator.memory[0x1012] = 0xEE
+            else:
+                raise KeyboardInterrupt
+
+        shown = Mock()
+        changed = Mock(return_value=[])
+        with patch.object(fnxmgr, "display", shown), patch.object(fnxmgr.hexdump, "changed_lines", changed), \
+                patch.object(fnxmgr.time, "sleep", sleep):
+            fnxmgr.watch("test", [fnxmgr.parse_watch_range(text, "10") for text in ranges], 0, True)
+        return ([c.args for c in shown.call_args_list], [c.args[:3] for c in changed.call_args_list])
+
+    def test_overlapping_ranges(self):
+        (shown, changed) = self.watch("1000:100", "1010:10")
+        self.assertEqual(shown, [(0x1000, bytes(range(256))), (0x1010, bytes(range(0x10, 0x20)))])
+
+        after = bytearray(range(256))
+        after[0x12] = 0xEE
+        self.assertEqual(changed, [(0x1000, bytes(range(256)), bytes(after)),
+                                   (0x1010, bytes(range(0x10, 0x20)), bytes(after[0x10:0x20]))])
+
+    def test_repeated_range(self):
+        (shown, changed) = self.watch("1000", "1000")
+        self.assertEqual(shown, [(0x1000, bytes(range(0x10)))] * 2)
+        self.assertEqual([(address, len(old), len(new)) for (address, old, new) in changed], [(0x1000, 0x10, 0x10)] * 2)
+
+
+class CalibrationTests(SimulatedBoardTest):
+    def setUp(self):
+        super().setUp()
+        for (target, name, value) in [(calibration, "CALIBRATION_FILE", os.path.join(self.directory.name, "calibration.json")),
+                                      (fnxmgr, "confirm_answers", {}),
+                                      (foenix_config, "load", lambda: self.config)]:
+            patcher = patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def main(self, *arguments):
+        output = io.StringIO()
+        with patch.object(fnxmgr, "quiet_mode", False), contextlib.redirect_stdout(output):
+            fnxmgr.main(["--port", "test", "--target", self.target] + list(arguments))
+        return output.getvalue()
+
+    def test_calibration_asks_before_overwriting_ram(self):
+        with patch("builtins.input", return_value="n") as ask:
+            self.main("--calibrate", "--address", "10000")
+        self.assertIn("65536 bytes of RAM at 0x10000", ask.call_args.args[0])
+        self.assertEqual(self.writes(), 0)
+        self.assertIsNone(calibration.load("test", self.target))
+
+    def test_saved_settings_are_used_and_reported(self):
+        calibration.save("test", self.target, {"chunk_size": 512, "pipeline_depth": 2, "bytes_per_s": 1})
+        output = self.main("--dump", "1000", "--count", "10")
+        self.assertIn("Using chunk size 512 and pipeline depth 2 from --calibrate", output)
+        self.assertEqual((self.config.profile().chunk_size, self.config.profile().pipeline_depth), (512, 2))
+
+    def test_saved_settings_can_be_ignored(self):
+        calibration.save("test", self.target, {"chunk_size": 512, "pipeline_depth": 2, "bytes_per_s": 1})
+        output = self.main("--no-calibration", "--dump", "1000", "--count", "10")
+        self.assertNotIn("--calibrate", output)
+        self.assertEqual(self.config.profile().chunk_size, 4096)
+
+
+class FlashManifestTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        patcher = patch.object(flash_manifest, "MANIFEST_DIRECTORY", self.directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_record_match_and_clear(self):
+        manifest = flash_manifest.FlashManifest("/dev/ttyUSB0", "fnx1591")
+        self.assertFalse(manifest.matches(0x12, b"sector"))
+
+        manifest.record(0x12, b"sector")
+        self.assertTrue(manifest.matches(0x12, b"sector"))
+        self.assertFalse(manifest.matches(0x12, b"other"))
+        self.assertFalse(manifest.matches(0x13, b"sector"))
+
+        # The record is kept for the next run, on the same port and target only
+        self.assertTrue(flash_manifest.FlashManifest("/dev/ttyUSB0", "fnx1591").matches(0x12, b"sector"))
+        self.assertFalse(flash_manifest.FlashManifest("/dev/ttyUSB1", "fnx1591").matches(0x12, b"sector"))
+        self.assertFalse(flash_manifest.FlashManifest("/dev/ttyUSB0", "f256k").matches(0x12, b"sector"))
+
+        manifest.clear()
+        self.assertFalse(manifest.matches(0x12, b"sector"))
+        self.assertFalse(flash_manifest.FlashManifest("/dev/ttyUSB0", "fnx1591").matches(0x12, b"sector"))
+
+
+class SkipUnchangedTests(SimulatedBoardTest):
+    """Program two sectors with --flash-bulk --skip-unchanged, then do it again."""
+
+    settings = {"flash_poll": "1"}
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(fnxmgr, "skip_unchanged", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.sectors = {0x01: bytes(range(256)) * 32, 0x02: bytes(reversed(range(256))) * 32}
+        self.csv_file = os.path.join(self.directory.name, "bulk.csv")
+        with open(self.csv_file, "w") as csv_file:
+            for (sector, data) in self.sectors.items():
+                filename = os.path.join(self.directory.name, "sector{:02X}.bin".format(sector))
+                with open(filename, "wb") as f:
+                    f.write(data)
+                csv_file.write("{:02X},{}\n".format(sector, filename))
+
+    def programmed(self):
+        return self.simulator.commands.get(constants.CMD_PROGRAM_SECTOR, 0)
+
+    def flash_bulk(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            fnxmgr.program_flash_bulk("test", self.csv_file, False)
+
+    def test_unchanged_sectors_are_skipped(self):
+        self.flash_bulk()
+        self.assertEqual(self.programmed(), 2)
+        for (sector, data) in self.sectors.items():
+            self.assertEqual(self.simulator.flash[sector * 0x2000:(sector + 1) * 0x2000], data)
+
+        self.flash_bulk()
+        self.assertEqual(self.programmed(), 2)
+
+    def test_changed_sector_is_programmed(self):
+        self.flash_bulk()
+        # The flash is read back, so a sector changed by other means is programmed again
+        self.simulator.flash[0x2000 * 0x02:0x2000 * 0x03] = bytes([0xFF]) * 0x2000
+        self.flash_bulk()
+        self.assertEqual(self.programmed(), 3)
+        self.assertEqual(self.simulator.flash[0x2000 * 0x02:0x2000 * 0x03], self.sectors[0x02])
+
+
+class SkipUnchangedWithoutReadableFlashTests(SkipUnchangedTests):
+    """As SkipUnchangedTests, on a target whose flash cannot be read, so the manifest decides."""
+
+    target = "fnx1591"
+
+    def setUp(self):
+        super().setUp()
+        self.simulator = simulator.FoenixSimulator(flash_base=None)
+        # Without polling, each flash operation waits for its worst case time
+        patcher = patch.object(foenix.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_changed_sector_is_programmed(self):
+        self.flash_bulk()
+        # What is on the flash is not known, beyond what FoenixMgr last put there
+        self.simulator.flash[0x2000 * 0x02:0x2000 * 0x03] = bytes([0xFF]) * 0x2000
+        self.flash_bulk()
+        self.assertEqual(self.programmed(), 2)
+
+        flash_manifest.FlashManifest("test", self.target).clear()
+        self.flash_bulk()
+        self.assertEqual(self.programmed(), 4)
+        self.assertEqual(self.simulator.flash[0x2000 * 0x02:0x2000 * 0x03], self.sectors[0x02])
+
+
+if __name__ == "__main__":
+    unittest.main()
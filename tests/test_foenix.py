@@ -0,0 +1,369 @@
+import sys
+import unittest
+from pathlib import Path
+from unittest.mock import Mock
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import foenix
+import foenix_config
+
+
+class ScriptedConnection(foenix.FoenixConnection):
+    """Answer every request with a canned response and log the traffic."""
+
+    def __init__(self, responses=b""):
+        self.incoming = bytearray(responses)
+        self.events = []
+
+    def open(self, port):
+        pass
+
+    def close(self):
+        pass
+
+    def is_open(self):
+        return True
+
+    def read(self, num_bytes):
+        data = bytes(self.incoming[:num_bytes])
+        del self.incoming[:num_bytes]
+        self.events.append(("read", len(data)))
+        return data
+
+    def write(self, data):
+        self.events.append(("write", bytes(data)))
+        return len(data)
+
+
+class TrickleConnection(ScriptedConnection):
+    """Hand back at most 'piece' bytes per read, like a socket that has only received part of a response."""
+
+    def __init__(self, responses=b"", piece=3):
+        super().__init__(responses)
+        self.piece = piece
+
+    def read_available(self, num_bytes, limit):
+        return self.read(min(limit, self.piece))
+
+
+class FlakyConnection(ScriptedConnection):
+    """Answer each request written with the next of a list of responses, as a Foenix would."""
+
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.discards = 0
+
+    def write(self, data):
+        self.incoming.extend(self.responses.pop(0))
+        return super().write(data)
+
+    def discard_input(self, quiet_time):
+        self.incoming.clear()
+        self.discards += 1
+
+
+class SlowConnection(ScriptedConnection):
+    """Time out on the first 'silences' reads, then answer."""
+
+    def __init__(self, responses, silences):
+        super().__init__(responses)
+        self.silences = silences
+
+    def read_available(self, num_bytes, limit):
+        if self.silences:
+            self.silences -= 1
+            return b""
+        return super().read_available(num_bytes, limit)
+
+
+def ok_response(status0=0, status1=0):
+    return bytes([0xAA, status0, status1, status0 ^ status1])
+
+
+class PipelinedWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.port = foenix.FoenixDebugPort()
+
+    def test_depth_keeps_requests_in_flight(self):
+        self.port.connection = ScriptedConnection(ok_response() * 4)
+        writer = foenix.PipelinedWriter(self.port, 3)
+        for i in range(4):
+            writer.write_block(0x1000 * i, bytes([i] * 4))
+        writer.flush()
+
+        kinds = [kind for kind, _ in self.port.connection.events]
+        first_read = kinds.index("read")
+        self.assertEqual(kinds[:first_read], ["write"] * 3)
+        self.assertEqual(kinds.count("write"), 4)
+
+    def test_reports_status_for_each_request(self):
+        self.port.connection = ScriptedConnection(ok_response(0, 2) + ok_response(0, 4))
+        writer = foenix.PipelinedWriter(self.port, 2)
+        writer.write_block(0x2000, b"ab")
+        writer.write_block(0x2002, b"cd")
+        self.assertEqual(writer.flush(), [(0x2000, 2, 0, 2), (0x2002, 2, 0, 4)])
+
+    def test_error_status_fails_with_the_address(self):
+        self.port = foenix.FoenixDebugPort(foenix_config.DEFAULT_PROFILE._replace(retries=0))
+        self.port.connection = ScriptedConnection(ok_response() + ok_response(1, 0) + ok_response())
+        writer = foenix.PipelinedWriter(self.port, 4)
+        for i in range(3):
+            writer.write_block(0x100 * i, b"x")
+        with self.assertRaisesRegex(Exception, "0x000100 failed .*status 0x01"):
+            writer.flush()
+        self.assertEqual(len(writer.pending), 0)
+
+    def test_missing_response_fails_and_abandons_the_rest(self):
+        self.port.connection = ScriptedConnection(ok_response())
+        writer = foenix.PipelinedWriter(self.port, 4)
+        for i in range(3):
+            writer.write_block(0x100 * i, b"x")
+        with self.assertRaisesRegex(Exception, "0x000100 failed"):
+            writer.flush()
+        self.assertEqual(len(writer.pending), 0)
+
+    def test_packets_match_single_transfers(self):
+        self.port.connection = ScriptedConnection(ok_response())
+        self.port.transfer(0x01, 0x123456, b"\x01\x02\x03", 0)
+        expected = self.port.connection.events[0][1]
+
+        self.port.connection = ScriptedConnection(ok_response())
+        writer = foenix.PipelinedWriter(self.port, 8)
+        writer.write_block(0x123456, b"\x01\x02\x03")
+        writer.flush()
+        self.assertEqual(self.port.connection.events[0][1], expected)
+
+
+class ResponseReaderTests(unittest.TestCase):
+    def setUp(self):
+        self.port = foenix.FoenixDebugPort()
+
+    def test_short_reads_are_completed(self):
+        data = bytes(range(200))
+        self.port.connection = TrickleConnection(bytes([0xAA, 0, 0]) + data + b"\x00", piece=7)
+        self.assertEqual(self.port.read_block(0x1000, len(data)), data)
+
+    def test_skips_noise_before_the_sync_byte(self):
+        self.port.connection = ScriptedConnection(b"\x00\x17" + bytes([0xAA, 0, 6]) + b"xy" + b"\x00")
+        self.assertEqual(self.port.read_block(0x1000, 2), b"xy")
+        self.assertEqual((self.port.status0, self.port.status1), (0, 6))
+
+    def test_pipelined_responses_share_reads(self):
+        connection = TrickleConnection(ok_response(1, 0) + ok_response(2, 0) + ok_response(3, 0), piece=64)
+        self.port.connection = connection
+        statuses = []
+        for _ in range(3):
+            self.port.read_response(0)
+            statuses.append(self.port.status0)
+        self.assertEqual(statuses, [1, 2, 3])
+        self.assertEqual(self.port.reader.reads, 1)
+
+    def test_truncated_response_fails(self):
+        self.port = foenix.FoenixDebugPort(foenix_config.DEFAULT_PROFILE._replace(retries=0))
+        self.port.connection = ScriptedConnection(bytes([0xAA, 0, 0]) + b"abc")
+        with self.assertRaisesRegex(Exception, "only 5 of 11 bytes arrived"):
+            self.port.read_block(0x1000, 8)
+
+    def test_counts_reads_for_each_request(self):
+        stats = Mock()
+        self.port.stats = stats
+        self.port.connection = TrickleConnection(bytes([0xAA, 0, 0]) + bytes(16) + b"\x00", piece=5)
+        self.port.read_block(0x1000, 16)
+        self.assertEqual(stats.record.call_args.kwargs["reads"], 4)
+
+
+class RetryTests(unittest.TestCase):
+    def setUp(self):
+        self.port = foenix.FoenixDebugPort(foenix_config.DEFAULT_PROFILE._replace(check_lrc=True, retries=2))
+
+    def writes(self):
+        return [data for (kind, data) in self.port.connection.events if kind == "write"]
+
+    def test_bad_lrc_is_rejected(self):
+        self.port = foenix.FoenixDebugPort(foenix_config.DEFAULT_PROFILE._replace(check_lrc=True, retries=0))
+        self.port.connection = FlakyConnection([bytes([0xAA, 0, 0]) + b"xy" + b"\x00"])
+        with self.assertRaisesRegex(foenix.ResponseError, "Bad LRC"):
+            self.port.read_block(0x1000, 2)
+
+    def test_read_is_sent_again_after_bad_lrc(self):
+        good = bytes([0xAA, 0, 0]) + b"xy" + bytes([ord("x") ^ ord("y")])
+        self.port.connection = FlakyConnection([good[:-1] + b"\x00", good])
+        self.assertEqual(self.port.read_block(0x1000, 2), b"xy")
+        self.assertEqual(self.writes()[0], self.writes()[1])
+        self.assertEqual(self.port.connection.discards, 1)
+
+    def test_pipelined_writes_resend_only_those_in_flight(self):
+        self.port.connection = FlakyConnection([ok_response(), b"\xAA\x00", ok_response(),
+                                                ok_response(), ok_response(), ok_response()])
+        writer = foenix.PipelinedWriter(self.port, 2)
+        buffer = bytearray(b"aaaa")
+        for i in range(4):
+            buffer[:] = bytes([0x61 + i]) * 4      # The caller reuses its buffer
+            writer.write_block(0x100 * i, buffer)
+        self.assertEqual([address for (address, _, _, _) in writer.flush()], [0x000, 0x100, 0x200, 0x300])
+
+        writes = self.writes()
+        self.assertEqual(len(writes), 6)
+        self.assertEqual(writes[3:5], writes[1:3])
+        self.assertEqual(writes[3][7:11], b"bbbb")
+
+    def test_error_status_is_sent_again(self):
+        self.port.connection = FlakyConnection([ok_response(1, 0), ok_response()])
+        writer = foenix.PipelinedWriter(self.port, 2)
+        writer.write_block(0x2000, b"ab")
+        self.assertEqual(writer.flush(), [(0x2000, 2, 0, 0)])
+        self.assertEqual(len(self.writes()), 2)
+
+    def test_gives_up_after_the_retries(self):
+        self.port.connection = FlakyConnection([b"\x00"] * 3)
+        writer = foenix.PipelinedWriter(self.port, 4)
+        writer.write_block(0x100, b"x")
+        with self.assertRaisesRegex(Exception, "Write of 1 bytes to 0x000100 failed"):
+            writer.flush()
+        self.assertEqual(len(self.writes()), 3)
+
+    def test_other_commands_are_not_sent_again(self):
+        self.port = foenix.FoenixDebugPort(foenix_config.DEFAULT_PROFILE._replace(timeout=0.05, retries=2))
+        self.port.connection = FlakyConnection([b""])
+        with self.assertRaisesRegex(foenix.ResponseError, "within 0.05 seconds"):
+            self.port.enter_debug()
+        self.assertEqual(len(self.writes()), 1)
+
+    def test_other_commands_are_waited_for(self):
+        # The connection times out twice before the Foenix (busy erasing its flash, say) answers
+        self.port.connection = SlowConnection(ok_response(), silences=2)
+        self.port.erase_flash()
+        self.assertEqual(len(self.writes()), 1)
+        self.assertEqual(self.port.connection.silences, 0)
+
+    def test_memory_requests_are_not_waited_for(self):
+        self.port = foenix.FoenixDebugPort(foenix_config.DEFAULT_PROFILE._replace(retries=0))
+        self.port.connection = SlowConnection(ok_response(), silences=1)
+        with self.assertRaisesRegex(foenix.ResponseError, "Timed out"):
+            self.port.write_block(0x1000, b"ab")
+
+
+class FlashPollingTests(unittest.TestCase):
+    def setUp(self):
+        self.port = foenix.FoenixDebugPort()
+        self.port.transfer = Mock()
+
+    def test_program_polls_until_flash_holds_data(self):
+        data = bytes(range(256)) * 32
+        self.port.flash_base = 0x080000
+        self.port.read_block = Mock(side_effect=[bytes(len(data)), bytes(len(data)), data])
+        with patch("time.sleep") as sleep:
+            self.port.program_flash_sector(3, data)
+        self.port.read_block.assert_called_with(0x080000 + 3 * 0x2000, len(data))
+        self.assertEqual(self.port.read_block.call_count, 3)
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [0.005, 0.01])
+
+    def test_erase_polls_each_block(self):
+        self.port.flash_base = 0x080000
+        self.port.read_block = Mock(return_value=foenix.ERASED_BLOCK)
+        with patch("time.sleep") as sleep:
+            self.port.erase_flash_sector(1)
+        self.assertEqual([c.args for c in self.port.read_block.call_args_list],
+                         [(0x082000, 0x1000), (0x083000, 0x1000)])
+        sleep.assert_not_called()
+
+    def test_without_readable_flash_waits_worst_case(self):
+        with patch("time.sleep") as sleep:
+            self.port.program_flash_sector(0, b"data")
+        sleep.assert_called_once_with(2)
+
+    def test_double_buffered_program_waits_only_the_remaining_time(self):
+        with patch("time.perf_counter", return_value=10.5), patch("time.sleep") as sleep:
+            self.port.program_flash_sector(2, b"data", 0x2000, wait=False)
+            sleep.assert_not_called()
+            self.port.wait_program_sector(2, b"data", started=10.0)
+        self.port.transfer.assert_called_once_with(0x13, 0x042000, 0, 0)
+        sleep.assert_called_once_with(1.5)
+
+    def test_gives_up_after_timeout(self):
+        self.port.read_block = Mock(return_value=b"\x00")
+        with patch("time.sleep"):
+            self.assertIsNone(self.port.wait_flash_ready(0x080000, b"\xff", timeout=0))
+
+    def test_polling_stops_at_the_worst_case_time(self):
+        # A sector that was not erased first never reads back as the data programmed into it
+        self.port.flash_base = 0x080000
+        self.port.read_block = Mock(return_value=bytes(4))
+        clock = [100.0]
+        def sleep(seconds):
+            clock[0] += seconds
+        with patch("time.perf_counter", side_effect=lambda: clock[0]), patch("time.sleep", side_effect=sleep):
+            self.port.program_flash_sector(3, b"data")
+        self.assertAlmostEqual(clock[0], 100.0 + 2)
+        self.assertGreater(self.port.read_block.call_count, 1)
+
+
+class TargetProfileTests(unittest.TestCase):
+    def profile(self, cpu):
+        return foenix_config.DEFAULT_PROFILE._replace(cpu=cpu, aligned_writes=cpu in ("68040", "68060"))
+
+    def test_flash_base_comes_from_the_profile(self):
+        config = foenix_config.FoenixConfig({"flash_poll": "1"})
+        config.set_target("f256k")
+        self.assertEqual(foenix.FoenixDebugPort(config.profile()).flash_base, 0x080000)
+
+        self.assertIsNone(foenix.FoenixDebugPort(config.profile()._replace(flash_poll=False)).flash_base)
+
+        # Polling is opt-in
+        config = foenix_config.FoenixConfig({})
+        config.set_target("f256k")
+        self.assertIsNone(foenix.FoenixDebugPort(config.profile()).flash_base)
+
+        config.set_target("fnx1591")
+        self.assertIsNone(foenix.FoenixDebugPort(config.profile()).flash_base)
+
+    def test_ports_made_without_a_profile_read_no_configuration(self):
+        with patch("foenix_config.FoenixConfig") as config:
+            port = foenix.FoenixDebugPort()
+            connections = [foenix.SerialFoenixConnection(), foenix.SocketFoenixConnection()]
+        config.assert_not_called()
+        self.assertIs(port.profile, foenix_config.DEFAULT_PROFILE)
+        self.assertEqual([c.profile for c in connections], [foenix_config.DEFAULT_PROFILE] * 2)
+
+    def test_writes_do_not_read_the_configuration(self):
+        port = foenix.FoenixDebugPort(self.profile("65816"))
+        port.connection = ScriptedConnection(ok_response() * 2)
+        with patch("foenix_config.FoenixConfig") as config:
+            port.write_block(0x1000, b"ab")
+            foenix.PipelinedWriter(port, 1).write_block(0x1002, b"cd")
+        config.assert_not_called()
+
+    def test_aligned_writes_read_modify_write(self):
+        port = foenix.FoenixDebugPort(self.profile("68040"))
+        port.connection = ScriptedConnection(bytes([0xAA, 0, 0]) + b"wxyz" + b"\x00" + ok_response())
+        port.write_block(0x1001, b"ab")
+        writes = [data for (kind, data) in port.connection.events if kind == "write"]
+        self.assertEqual(writes[0][1:7], bytes([0x00, 0x00, 0x10, 0x00, 0x00, 0x04]))
+        self.assertEqual(writes[1][1:11], bytes([0x01, 0x00, 0x10, 0x00, 0x00, 0x04]) + b"wabz")
+
+    def test_response_timeout_scales_with_the_link(self):
+        fast = foenix_config.FoenixConfig({"chunk_size": "1024", "data_rate": "6000000"}).profile()
+        slow = foenix_config.FoenixConfig({"chunk_size": "4096", "data_rate": "115200", "pipeline_depth": "4"}).profile()
+        self.assertLess(fast.response_timeout, 0.3)
+        self.assertGreater(slow.response_timeout, 4 * 4096 * 10 / 115200)
+        self.assertLess(slow.response_timeout, 2)
+
+        configured = foenix_config.FoenixConfig({"response_timeout": "1.5"}).profile()
+        self.assertEqual(configured.response_timeout, 1.5)
+
+    def test_profile_is_made_again_only_after_a_change(self):
+        config = foenix_config.FoenixConfig({})
+        profile = config.profile()
+        self.assertIs(config.profile(), profile)
+        with self.assertRaises(AttributeError):
+            profile.cpu = "68040"
+        config.set_chunk_size(profile.chunk_size)
+        self.assertIsNot(config.profile(), profile)
+        self.assertEqual(config.profile(), profile)
+
+
+if __name__ == "__main__":
+    unittest.main()
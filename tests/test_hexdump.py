@@ -0,0 +1,54 @@
+import io
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import hexdump
+
+
+class HexdumpTests(unittest.TestCase):
+    def setUp(self):
+        self.data = b"Hello, Foenix!\x00\xff" + bytes(range(0x41, 0x45))
+
+    def dump(self, format):
+        out = io.StringIO()
+        hexdump.write(out, 0x001230, self.data, format)
+        return out.getvalue()
+
+    def test_hex_format(self):
+        self.assertEqual(self.dump("hex"),
+                         "001230: 48656C6C6F2C2046 6F656E69782100FF Hello, Foenix!..\n"
+                         "001240: 41424344 ABCD\n")
+
+    def test_hex_format_of_no_data(self):
+        self.data = b""
+        self.assertEqual(self.dump("hex"), " \n")
+
+    def test_xxd_format(self):
+        self.assertEqual(self.dump("xxd"),
+                         "00001230: 4865 6c6c 6f2c 2046 6f65 6e69 7821 00ff  Hello, Foenix!..\n"
+                         "00001240: 4142 4344                                ABCD\n")
+
+    def test_c_format(self):
+        lines = self.dump("c").splitlines()
+        self.assertEqual(lines[1], "const unsigned char data_001230[20] = {")
+        self.assertEqual(lines[3], "    0x78, 0x21, 0x00, 0xFF, 0x41, 0x42, 0x43, 0x44,")
+        self.assertEqual(lines[-1], "};")
+
+
+    def test_changed_lines_show_only_changed_bytes(self):
+        new = bytearray(self.data)
+        new[9] = 0x30
+        lines = list(hexdump.changed_lines(0x001230, self.data, new))
+        self.assertEqual(lines, ["001230: ................ ..30............ Hello, Fo0nix!..\n"])
+
+    def test_changed_lines_highlight_changed_bytes(self):
+        new = bytearray(self.data)
+        new[17] = 0x61
+        (line,) = hexdump.changed_lines(0x001230, self.data, new, highlight=True)
+        self.assertEqual(line, "001240: 41\x1b[7m61\x1b[0m4344 AaCD\n")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import image
+import intelhex
+
+
+class SparseImageTests(unittest.TestCase):
+    def setUp(self):
+        self.memory = image.SparseImage()
+
+    def test_adjacent_blocks_are_merged(self):
+        self.memory.add(0x1000, b"ab")
+        self.memory.add(0x1002, b"cd")
+        self.memory.add(0x0FFE, b"yz")
+        self.assertEqual(self.memory.ranges(), [(0x0FFE, 6)])
+        self.assertEqual(bytes(self.memory.segments[0]), b"yzabcd")
+
+    def test_separate_blocks_stay_separate(self):
+        self.memory.add(0x2000, b"2")
+        self.memory.add(0x1000, b"1")
+        self.memory.add(0x3000, b"3")
+        self.assertEqual(self.memory.ranges(), [(0x1000, 1), (0x2000, 1), (0x3000, 1)])
+
+    def test_later_data_wins_on_overlap(self):
+        self.memory.add(0x10, b"aaaa")
+        self.memory.add(0x20, b"cccc")
+        self.memory.add(0x12, bytes(16))
+        self.assertEqual(self.memory.ranges(), [(0x10, 20)])
+        self.assertEqual(bytes(self.memory.segments[0]), b"aa" + bytes(16) + b"cc")
+
+    def test_chunks_cover_image_in_order(self):
+        self.memory.add(0x100, bytes(range(10)))
+        self.memory.add(0x200, bytes(range(3)))
+        chunks = [(address, bytes(data)) for (address, data) in self.memory.chunks(4)]
+        self.assertEqual(chunks, [
+            (0x100, bytes([0, 1, 2, 3])),
+            (0x104, bytes([4, 5, 6, 7])),
+            (0x108, bytes([8, 9])),
+            (0x200, bytes([0, 1, 2])),
+        ])
+
+    def test_read_returns_only_whole_blocks(self):
+        self.memory.add(0x100, b"abcdef")
+        self.memory.add(0x200, b"xyz")
+        self.assertEqual(bytes(self.memory.read(0x102, 3)), b"cde")
+        self.assertEqual(bytes(self.memory.read(0x200, 3)), b"xyz")
+        self.assertIsNone(self.memory.read(0x104, 4))
+        self.assertIsNone(self.memory.read(0x0FF, 2))
+        self.assertIsNone(self.memory.read(0x180, 1))
+
+    def test_save_and_load(self):
+        self.memory.add(0x100, b"abcdef")
+        self.memory.add(0x20000, bytes(range(256)))
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "images", "test.img")
+            self.memory.save(filename)
+            loaded = image.SparseImage()
+            self.assertTrue(loaded.load(filename))
+        self.assertEqual(loaded.ranges(), self.memory.ranges())
+        self.assertEqual(loaded.segments, self.memory.segments)
+
+    def test_load_rejects_other_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "test.img")
+            self.assertFalse(self.memory.load(filename))
+
+            with open(filename, "wb") as f:
+                f.write(b"NOPE")
+            self.assertFalse(self.memory.load(filename))
+
+            with open(filename, "wb") as f:
+                f.write(image.CACHE_SIGNATURE + (0x100).to_bytes(4, 'little') + (16).to_bytes(4, 'little') + b"short")
+            self.assertFalse(self.memory.load(filename))
+        self.assertEqual(self.memory.ranges(), [])
+
+    def test_hex_file_collapses_to_few_chunks(self):
+        lines = [":020000040001F9\n"]
+        for address in range(0, 0x1000, 16):
+            record = bytes([16, address >> 8, address & 0xff, 0]) + bytes(16)
+            checksum = (-sum(record)) & 0xff
+            lines.append(":" + (record + bytes([checksum])).hex().upper() + "\n")
+
+        infile = intelhex.HexFile()
+        infile.set_handler(lambda address, data: self.memory.add(address, bytes.fromhex(data)))
+        for line in lines:
+            infile.parse_line(line)
+
+        self.assertEqual(self.memory.ranges(), [(0x10000, 0x1000)])
+        self.assertEqual(len(list(self.memory.chunks(1024))), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import labels
+
+LABEL_FILE = """COUNTER = $001230
+INDEX = $1240
+VKY_CTRL = $D000
+VKY_BORDER=$D004
+COUNTER = $9999
+; not a label
+"""
+
+
+class LabelIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = labels.LabelIndex(labels.parse(LABEL_FILE))
+
+    def test_lookup_uses_first_definition(self):
+        self.assertEqual(self.index.lookup("COUNTER"), 0x1230)
+        self.assertIsNone(self.index.lookup("MISSING"))
+
+    def test_search_with_wildcards(self):
+        self.assertEqual(self.index.search("VKY_*"), [("VKY_CTRL", 0xD000), ("VKY_BORDER", 0xD004)])
+        self.assertEqual(self.index.search("INDEX"), [("INDEX", 0x1240)])
+        self.assertEqual(self.index.search("NOTHING*"), [])
+
+    def test_nearest_label_below_address(self):
+        self.assertEqual(self.index.nearest(0xD002), ("VKY_CTRL", 0xD000))
+        self.assertEqual(self.index.nearest(0x1240), ("INDEX", 0x1240))
+        self.assertIsNone(self.index.nearest(0x10))
+
+
+class LabelCacheTests(unittest.TestCase):
+    def test_cache_is_refreshed_when_the_file_changes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "kernel.lbl")
+            with open(filename, "w") as f:
+                f.write(LABEL_FILE)
+
+            with patch("labels.CACHE_DIRECTORY", os.path.join(directory, "cache")):
+                self.assertEqual(labels.load(filename).lookup("INDEX"), 0x1240)
+                with patch("labels.parse", side_effect=AssertionError("parsed again")):
+                    self.assertEqual(labels.load(filename).lookup("INDEX"), 0x1240)
+
+                with open(filename, "a") as f:
+                    f.write("EXTRA = $2000\n")
+                self.assertEqual(labels.load(filename).lookup("EXTRA"), 0x2000)
+
+
+if __name__ == "__main__":
+    unittest.main()
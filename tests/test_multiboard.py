@@ -0,0 +1,39 @@
+import io
+import sys
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import multiboard
+
+
+class RunOnBoardsTests(unittest.TestCase):
+    def test_jobs_run_at_the_same_time(self):
+        barrier = threading.Barrier(3, timeout=5)
+        boards = multiboard.run_on_boards(["a", "b", "c"], lambda port: barrier.wait())
+        self.assertTrue(all(board.ok for board in boards))
+
+    def test_failures_are_reported_per_board(self):
+        def job(port):
+            if port == "bad":
+                raise Exception("no response")
+            if port == "exit":
+                sys.exit(1)
+
+        boards = multiboard.run_on_boards(["good", "bad", "exit"], job)
+        self.assertEqual([board.ok for board in boards], [True, False, False])
+        self.assertEqual(boards[1].error, "no response")
+        self.assertIn("1 of 3 boards passed", multiboard.report(boards, 1.0))
+
+    def test_output_is_prefixed_with_the_port(self):
+        output = io.StringIO()
+        with patch("sys.stdout", output):
+            multiboard.run_on_boards(["COM3"], lambda port: print("Connecting...", end="") or print(" done"))
+        self.assertEqual(output.getvalue(), "[COM3] Connecting... done\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
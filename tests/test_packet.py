@@ -0,0 +1,56 @@
+import random
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import packet
+
+
+def reference_request(command, address, data, read_length):
+    """The packet exactly as transfer() used to assemble it, byte by byte."""
+    length = read_length if data == 0 else len(data)
+    header = bytearray([0x55, command]) + address.to_bytes(3, "big") + length.to_bytes(2, "big")
+    lrc = 0
+    for i in range(0, 6):
+        lrc ^= header[i]
+    if data:
+        for b in data:
+            lrc ^= b
+        return header + data + bytes([lrc])
+    return header + bytes([lrc])
+
+
+class LrcTests(unittest.TestCase):
+    def test_matches_byte_loop(self):
+        rng = random.Random(1)
+        for size in [0, 1, 2, 3, 7, 8, 9, 255, 1024, 4097]:
+            with self.subTest(size=size):
+                data = bytes(rng.randrange(256) for _ in range(size))
+                expected = 0
+                for b in data:
+                    expected ^= b
+                self.assertEqual(packet.lrc(data), expected)
+
+    def test_initial_value_is_folded_in(self):
+        self.assertEqual(packet.lrc(b"\x0f", 0xf0), 0xff)
+
+
+class EncodeRequestTests(unittest.TestCase):
+    def test_write_packet(self):
+        data = bytes(range(200))
+        self.assertEqual(packet.encode_request(0x01, 0x380000, data, 0),
+                         reference_request(0x01, 0x380000, data, 0))
+
+    def test_read_packet(self):
+        self.assertEqual(packet.encode_request(0x00, 0xF01642, 0, 0x1234),
+                         reference_request(0x00, 0xF01642, 0, 0x1234))
+
+    def test_length_must_fit_in_sixteen_bits(self):
+        with self.assertRaises(OverflowError):
+            packet.encode_request(0x00, 0, 0, 0x10000)
+
+
+if __name__ == "__main__":
+    unittest.main()
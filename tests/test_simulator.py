@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import foenix
+import simulator
+
+
+class SimulatorTests(unittest.TestCase):
+    def setUp(self):
+        self.simulator = simulator.FoenixSimulator(revision=3)
+        self.port = foenix.FoenixDebugPort()
+        self.port.connection = simulator.SimulatorConnection(self.simulator)
+
+    def test_memory_round_trip(self):
+        self.port.enter_debug()
+        self.port.write_block(0x1234, b"Foenix")
+        self.assertEqual(self.port.read_block(0x1232, 8), b"\x00\x00Foenix")
+        self.assertEqual(self.port.get_revision(), 3)
+        self.port.exit_debug()
+        self.assertEqual(self.simulator.resets, 1)
+
+    def test_flash_sector_with_polling(self):
+        self.simulator.flash_busy_time = 0.02
+        self.port.flash_base = simulator.FLASH_BASE
+        data = bytes(range(256)) * 32
+        self.port.write_block(0, data)
+        self.port.erase_flash_sector(5)
+        self.port.program_flash_sector(5, data)
+        self.assertEqual(bytes(self.simulator.flash[5 * 0x2000:6 * 0x2000]), data)
+        self.assertEqual(self.port.read_block(simulator.FLASH_BASE + 5 * 0x2000, 16), data[:16])
+
+    def test_bad_lrc_is_reported_in_status(self):
+        request = bytearray(b"\x55\x01\x00\x10\x00\x00\x02ab\x00")
+        response = self.simulator.handle(bytes(request))
+        self.assertEqual(response[1], simulator.STATUS_BAD_LRC)
+        self.assertEqual(self.simulator.memory[0x1000:0x1002], b"\x00\x00")
+
+    def test_pipelined_requests_over_tcp(self):
+        listening = threading.Event()
+        ports = []
+        threading.Thread(target=simulator.serve_tcp, daemon=True,
+                         args=(self.simulator, "127.0.0.1", 0),
+                         kwargs={"ready": lambda port: (ports.append(port), listening.set())}).start()
+        self.assertTrue(listening.wait(5))
+
+        port = foenix.FoenixDebugPort()
+        port.open("127.0.0.1:{}".format(ports[0]))
+        try:
+            writer = foenix.PipelinedWriter(port, 4)
+            for i in range(16):
+                writer.write_block(0x2000 + i * 256, bytes([i]) * 256)
+            writer.flush()
+            self.assertEqual(port.read_block(0x2000 + 15 * 256, 4), bytes([15]) * 4)
+        finally:
+            port.close()
+
+    @unittest.skipUnless(hasattr(os, "openpty"), "needs pseudo-terminals")
+    def test_serial_port_through_pty(self):
+        (master, name) = simulator.open_pty()
+        threading.Thread(target=simulator.serve_pty, args=(self.simulator, master), daemon=True).start()
+
+        port = foenix.FoenixDebugPort()
+        port.open(name)
+        try:
+            port.write_block(0x3000, b"pty")
+            self.assertEqual(port.read_block(0x3000, 3), b"pty")
+        finally:
+            port.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
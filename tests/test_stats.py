@@ -0,0 +1,90 @@
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import constants
+import foenix
+import foenix_config
+import simulator
+import stats
+
+
+class PortStatisticsTests(unittest.TestCase):
+    def setUp(self):
+        self.stats = stats.PortStatistics(trace=True)
+        # A write sent at 10.000 s, with its response starting 0.5 ms and ending 0.8 ms later...
+        self.stats.record(constants.CMD_WRITE_MEM, 0x1000, 1032, 4, 10.0, 10.0005, 10.0008, 10.0001, reads=1)
+        # ... a second write taking 3 ms...
+        self.stats.record(constants.CMD_WRITE_MEM, 0x1400, 1032, 4, 10.001, 10.003, 10.004, 10.001, reads=2)
+        # ... and a read of 256 bytes taking 7 s
+        self.stats.record(constants.CMD_READ_MEM, 0x2000, 8, 260, 10.004, 10.5, 17.004, 10.004, reads=5)
+
+    def test_histogram_buckets(self):
+        write = self.stats.commands[constants.CMD_WRITE_MEM]
+        self.assertEqual(write.histogram_dict(), {"<=1": 1, "<=5": 1})
+        read = self.stats.commands[constants.CMD_READ_MEM]
+        self.assertEqual(read.histogram_dict(), {">5000": 1})
+
+    def test_totals_for_each_command(self):
+        write = self.stats.commands[constants.CMD_WRITE_MEM]
+        self.assertEqual((write.count, write.bytes_sent, write.bytes_received, write.reads), (2, 2064, 8, 3))
+        self.assertAlmostEqual(write.round_trip, 0.0038)
+        self.assertAlmostEqual(write.max_round_trip, 0.003)
+        self.assertAlmostEqual(write.sync_wait, 0.0024)
+        self.assertEqual(self.stats.total_bytes(), 2064 + 8 + 8 + 260)
+        self.assertAlmostEqual(self.stats.elapsed(), 7.004)
+
+    def test_as_dict_and_trace(self):
+        report = self.stats.as_dict()
+        self.assertEqual(sorted(report["commands"]), ["READ_MEM", "WRITE_MEM"])
+        self.assertEqual(report["commands"]["WRITE_MEM"]["count"], 2)
+        self.assertEqual(report["commands"]["READ_MEM"]["histogram_ms"], {">5000": 1})
+        self.assertEqual([(t["command"], t["address"]) for t in report["trace"]],
+                         [("WRITE_MEM", 0x1000), ("WRITE_MEM", 0x1400), ("READ_MEM", 0x2000)])
+        self.assertAlmostEqual(report["trace"][1]["start_s"], 0.001)
+        self.assertEqual(report["trace"][2]["reads"], 5)
+
+    def test_summary_times_are_per_request(self):
+        lines = self.stats.summary().splitlines()
+        self.assertIn("avg sync ms", lines[0])
+        write = next(line for line in lines if line.startswith("WRITE_MEM")).split()
+        self.assertEqual(write[4:8], ["1.90", "3.00", "1.20", "1.50"])
+
+    def test_retries_are_counted(self):
+        self.stats.record_retry(constants.CMD_ERASE_SECTOR)
+        self.assertEqual(self.stats.as_dict()["commands"]["ERASE_SECTOR"]["retries"], 1)
+        self.assertIn("retries: 1", self.stats.summary())
+
+
+class PipelinedStatisticsTests(unittest.TestCase):
+    def test_responses_are_matched_to_requests_in_send_order(self):
+        port = foenix.FoenixDebugPort(foenix_config.DEFAULT_PROFILE)
+        port.connection = simulator.SimulatorConnection(simulator.FoenixSimulator())
+        port.stats = stats.PortStatistics(trace=True)
+
+        writer = foenix.PipelinedWriter(port, 3)
+        for i in range(5):
+            writer.write_block(0x1000 + 0x100 * i, bytes(16 * (i + 1)))
+        writer.flush()
+        reader = foenix.PipelinedReader(port, 2)
+        list(reader.read_blocks([(0x1000, 32), (0x1100, 64)]))
+
+        trace = port.stats.trace
+        self.assertEqual([(t["command"], t["address"], t["bytes_sent"], t["bytes_received"]) for t in trace], [
+            ("WRITE_MEM", 0x1000, 8 + 16, 4),
+            ("WRITE_MEM", 0x1100, 8 + 32, 4),
+            ("WRITE_MEM", 0x1200, 8 + 48, 4),
+            ("WRITE_MEM", 0x1300, 8 + 64, 4),
+            ("WRITE_MEM", 0x1400, 8 + 80, 4),
+            ("READ_MEM", 0x1000, 8, 4 + 32),
+            ("READ_MEM", 0x1100, 8, 4 + 64),
+        ])
+        self.assertEqual([t["start_s"] for t in trace], sorted(t["start_s"] for t in trace))
+        self.assertEqual(port.stats.commands[constants.CMD_WRITE_MEM].count, 5)
+        self.assertEqual(len(port.in_flight), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import sys
+import unittest
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "FoenixMgr"))
+
+import foenix
+import image
+import verify
+
+
+class MemoryPort:
+    """Answer read requests from a bytearray, tracking how many are in flight."""
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.requests = deque()
+        self.most_in_flight = 0
+
+    def send_request(self, command, address, data, read_length):
+        self.requests.append((address, read_length))
+        self.most_in_flight = max(self.most_in_flight, len(self.requests))
+
+    def read_response(self, read_length):
+        (address, length) = self.requests.popleft()
+        return bytes(self.memory[address:address + length])
+
+    def check_status(self):
+        pass
+
+
+class VerifyImageTests(unittest.TestCase):
+    def setUp(self):
+        self.data = bytes(range(256)) * 64
+        self.memory = image.SparseImage()
+        self.memory.add(0x1000, self.data)
+
+    def test_matching_memory_verifies(self):
+        port = MemoryPort(bytearray(0x1000) + self.data)
+        result = verify.verify_image(port, self.memory, 4, chunk_size=0x1000)
+        self.assertTrue(result.ok())
+        self.assertEqual(result.bytes_checked, len(self.data))
+        self.assertEqual(port.most_in_flight, 4)
+
+    def test_reports_first_mismatching_addresses(self):
+        ram = bytearray(0x1000) + self.data
+        ram[0x2345] ^= 0xFF
+        ram[0x3000] ^= 0x01
+        result = verify.verify_image(MemoryPort(ram), self.memory, 2, chunk_size=0x1000)
+        self.assertFalse(result.ok())
+        self.assertEqual(result.mismatches, [(0x2345, 0x45, 0xBA), (0x3000, 0x00, 0x01)])
+        self.assertIn("0x002345: expected 0x45, read 0xBA", result.report())
+
+    def test_short_read_fails(self):
+        port = MemoryPort(bytearray(0x1000) + self.data[:100])
+        with self.assertRaisesRegex(Exception, "Read of 4096 bytes from 0x001000 failed"):
+            verify.verify_image(port, self.memory, 1, chunk_size=0x1000)
+
+
+
+class ReadRangeTests(unittest.TestCase):
+    def test_splits_large_ranges_into_maximal_reads(self):
+        ram = bytearray(range(256)) * 1024
+        port = MemoryPort(ram)
+        blocks = list(foenix.PipelinedReader(port, 2).read_range(0x100, 0x20000))
+        self.assertEqual([(address, len(data)) for (address, data) in blocks],
+                         [(0x100, 0xFFFC), (0x100FC, 0xFFFC), (0x200F8, 0x8)])
+        self.assertEqual(b"".join(data for (_, data) in blocks), ram[0x100:0x20100])
+
+if __name__ == "__main__":
+    unittest.main()
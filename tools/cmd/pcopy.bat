@@ -1,4 +1,4 @@
 @echo off
-REM Copy a file from PC to the SDCARD on Foenix
+REM Copy files from PC to the SDCARD on Foenix
 
-python %FOENIXMGR%\FoenixMgr\fnxmgr.py --copy %1
+python %FOENIXMGR%\FoenixMgr\fnxmgr.py --copy %*